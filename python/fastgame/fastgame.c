@@ -1,4 +1,5 @@
 #include <stdbool.h>
+#include <stddef.h>
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
@@ -33,6 +34,9 @@ typedef struct GameState {
 	int8_t trick_winning_rank;     // 0-12=2-Ace.
 
 	int8_t bidding_is_open;        // 0=false 1=true
+
+	// Zobrist hash of all the bytes above, kept up to date by SET.
+	uint8_t hash[8];               // uint64_t, unaligned.
 } GameState;
 
 typedef struct {
@@ -40,8 +44,44 @@ typedef struct {
 	int8_t action;
 } HistoryEntry;
 
+// Bitboard form of the card play part of a GameState, for fully dealt hands.
+// Card (suit, rank) is bit 16 * suit + rank, so each suit is a 16-bit lane.
+typedef struct PackedState {
+	uint64_t dealt_cards[4];       // seat.
+	uint64_t played_cards;
+
+	int8_t tricks_taken[4];        // seat
+
+	int8_t stage;                  // as GameState.
+	int8_t next_to_act;
+	int8_t trump;                  // last_bid_strain. 4=notrump.
+	int8_t declarer;
+
+	int8_t trick_suit;
+	int8_t trick_position;
+	int8_t trick_winning_seat;
+	int8_t trick_winning_suit;
+	int8_t trick_winning_rank;
+} PackedState;
+
+
+// The bytes of a GameState changed by one action, for undo_action.
+// changes[i] = {offset, old value, new value}, in the order they were written.
+// num_changes = -1 marks a record that overflowed and cannot be undone.
+#define UNDO_CAPACITY 64
+typedef struct UndoRecord {
+	int16_t num_changes;
+	int16_t changes[UNDO_CAPACITY][3];
+} UndoRecord;
+
 
 #define STATE_SIZE sizeof(GameState)
+#define HASHED_SIZE offsetof(GameState, hash)
+#define UNDO_RECORD_SIZE (sizeof(UndoRecord) / sizeof(int16_t))
+#define PACKED_STATE_SIZE sizeof(PackedState)
+#define CARD_BIT(suit, rank) (1ULL << (16 * (suit) + (rank)))
+#define SUIT_MASK(suit) (0x1FFFULL << (16 * (suit)))
+#define NUM_ACTIONS 90
 #define NA -1
 #define STAGE_BIDDING 0
 #define STAGE_PLAY 1
@@ -52,88 +92,184 @@ typedef struct {
 #define CALL_REDOUBLE 2
 
 
+// Error codes, indexing error_messages. 0=no error.
+#define ERR_NONE 0
+#define ERR_STAGE_FOR_BID 1
+#define ERR_INSUFFICIENT_BID 2
+#define ERR_STAGE_FOR_CALL 3
+#define ERR_DOUBLE_STATE_FOR_DOUBLE 4
+#define ERR_DOUBLE_OF_OWN_SIDE 5
+#define ERR_DOUBLE_STATE_FOR_REDOUBLE 6
+#define ERR_REDOUBLE_OF_OTHER_SIDE 7
+#define ERR_DUPLICATE_CARD 8
+#define ERR_CARD_ALREADY_PLAYED 9
+#define ERR_FOURTEEN_CARDS 10
+#define ERR_LENGTH_EXCEEDED 11
+#define ERR_STAGE_FOR_PLAY 12
+#define ERR_REVOKE 13
+#define ERR_CARD_NOT_HELD 14
+#define NUM_ERRORS 15
+
+static char* error_messages[NUM_ERRORS] = {
+	NULL,
+	"stage for bid",
+	"Insufficient bid",
+	"stage for call",
+	"double state for double",
+	"double of own sides' contract",
+	"double state for redouble",
+	"redouble of other sides' contract",
+	"Duplicate card",
+	"Card already played",
+	"14 cards in hand",
+	"Revoke?",
+	"stage for play",
+	"Revoke",
+	"Card not in hand",
+};
+
+
 char* g_error_message = NULL;
+int g_error_code = ERR_NONE;
+UndoRecord *g_undo_record = NULL;
+
+// The Zobrist key of byte offset having value. Keys are derived from a
+// fixed splitmix64 sequence, so hashes are stable across processes.
+static uint64_t zobrist_key(int offset, int8_t value) {
+	if (value == 0) {
+		return 0;
+	}
+	uint64_t z = (((uint64_t) offset << 8) | (uint8_t) value) *
+		0x9E3779B97F4A7C15ULL;
+	z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+	z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+	return z ^ (z >> 31);
+}
+
+static uint64_t get_hash(GameState *state) {
+	uint64_t hash;
+	memcpy(&hash, state->hash, sizeof(hash));
+	return hash;
+}
+
+static void update_hash(GameState *state, int offset,
+		int8_t old_value, int8_t new_value) {
+	uint64_t hash = get_hash(state) ^
+		zobrist_key(offset, old_value) ^ zobrist_key(offset, new_value);
+	memcpy(state->hash, &hash, sizeof(hash));
+}
+
+// Recomputes the hash from scratch, after writes that bypassed SET.
+void rehash(GameState *state) {
+	uint64_t hash = 0;
+	int8_t *bytes = (int8_t*) state;
+	for (int offset = 0; offset < (int) HASHED_SIZE; ++offset) {
+		hash ^= zobrist_key(offset, bytes[offset]);
+	}
+	memcpy(state->hash, &hash, sizeof(hash));
+}
+
+// All writes to a GameState during an action go through SET, so that they
+// can be journaled into g_undo_record.
+static void set_byte(GameState *state, int8_t *field, int value) {
+	UndoRecord *undo = g_undo_record;
+	update_hash(state, field - (int8_t*) state, *field, value);
+	if (undo != NULL && *field != value && undo->num_changes >= 0) {
+		if (undo->num_changes == UNDO_CAPACITY) {
+			undo->num_changes = -1;
+		} else {
+			undo->changes[undo->num_changes][0] =
+				field - (int8_t*) state;
+			undo->changes[undo->num_changes][1] = *field;
+			undo->changes[undo->num_changes][2] = value;
+			undo->num_changes++;
+		}
+	}
+	*field = value;
+}
+
+#define SET(state, field, value) set_byte((state), &(field), (value))
 
 
-static void set_error(GameState *state, char* msg) {
+static void set_error(GameState *state, int code) {
         if (state->stage != STAGE_ERROR) {
-                state->stage = STAGE_ERROR;
-                g_error_message = msg;
+                SET(state, state->stage, STAGE_ERROR);
+                g_error_code = code;
+                g_error_message = error_messages[code];
 	}
 }
 
 static void execute_bid_action(GameState *state, int level_ix, int strain_ix) {
         if (state->stage != STAGE_BIDDING) {
-		set_error(state, "stage for bid");
+		set_error(state, ERR_STAGE_FOR_BID);
                 return;
 	}
         if (state->bidding_is_open) {
                 if (level_ix < state->last_bid_level || (
                                 level_ix == state->last_bid_level &&
                                 strain_ix <= state->last_bid_strain)) {
-                        set_error(state, "Insufficient bid");
+                        set_error(state, ERR_INSUFFICIENT_BID);
                         return;
 		}
 	}
-	state->bidding_is_open = 1;
-        state->last_bid_seat = state->next_to_act;
-        state->last_bid_level = level_ix;
-        state->last_bid_strain = strain_ix;
-        state->last_bid_double = 0;
+	SET(state, state->bidding_is_open, 1);
+        SET(state, state->last_bid_seat, state->next_to_act);
+        SET(state, state->last_bid_level, level_ix);
+        SET(state, state->last_bid_strain, strain_ix);
+        SET(state, state->last_bid_double, 0);
         int partner_seat = (state->next_to_act + 2) % 4;
         if (!state->first_to_mention[partner_seat][strain_ix]) {
-                state->first_to_mention[state->next_to_act][strain_ix] = 1;
+                SET(state, state->first_to_mention[state->next_to_act][strain_ix], 1);
 	}
-        state->pass_position = 0;
-        state->next_to_act = (state->next_to_act + 1) % 4;
+        SET(state, state->pass_position, 0);
+        SET(state, state->next_to_act, (state->next_to_act + 1) % 4);
 }
 
 static void execute_call_action(GameState *state, int call) {
         if (state->stage != STAGE_BIDDING) {
-		set_error(state,	"stage for call");
+		set_error(state, ERR_STAGE_FOR_CALL);
                 return;
 	}
         if (call == CALL_PASS) {
                 if (state->pass_position == 3) {
-                        state->stage = STAGE_SCORING;
-                        state->next_to_act = NA;
-                        state->pass_position = 0;
+                        SET(state, state->stage, STAGE_SCORING);
+                        SET(state, state->next_to_act, NA);
+                        SET(state, state->pass_position, 0);
                 } else if (state->bidding_is_open &&
 				state->pass_position == 2) {
-                        state->stage = STAGE_PLAY;
-                        state->pass_position = NA;
-                        state->trick_position = 0;
+                        SET(state, state->stage, STAGE_PLAY);
+                        SET(state, state->pass_position, NA);
+                        SET(state, state->trick_position, 0);
                         if (state->first_to_mention[state->last_bid_seat]
 					[state->last_bid_strain]) {
-                                state->declarer = state->last_bid_seat;
+                                SET(state, state->declarer, state->last_bid_seat);
                         } else {
-                                state->declarer =
-				       	(state->last_bid_seat + 2) % 4;
+                                SET(state, state->declarer, (state->last_bid_seat + 2) % 4);
 			}
-                        state->next_to_act = (state->declarer + 1) % 4;
+                        SET(state, state->next_to_act, (state->declarer + 1) % 4);
                 } else {
-                        state->pass_position += 1;
-                        state->next_to_act = (state->next_to_act + 1) % 4;
+                        SET(state, state->pass_position, state->pass_position + 1);
+                        SET(state, state->next_to_act, (state->next_to_act + 1) % 4);
 		}
         } else if (call == CALL_DOUBLE) {
                 if (state->last_bid_double != CALL_PASS) {
-			set_error(state, "double state for double");
+			set_error(state, ERR_DOUBLE_STATE_FOR_DOUBLE);
                 } else if (state->last_bid_seat % 2 == state->next_to_act % 2) {
-                        set_error(state, "double of own sides' contract");
+                        set_error(state, ERR_DOUBLE_OF_OWN_SIDE);
                 } else {
-                        state->last_bid_double = CALL_DOUBLE;
-                        state->pass_position = 0;
-                        state->next_to_act = (state->next_to_act + 1) % 4;
+                        SET(state, state->last_bid_double, CALL_DOUBLE);
+                        SET(state, state->pass_position, 0);
+                        SET(state, state->next_to_act, (state->next_to_act + 1) % 4);
 		}
         } else if (call == CALL_REDOUBLE) {
                 if (state->last_bid_double != CALL_DOUBLE) {
-                        set_error(state, "double state for redouble");
+                        set_error(state, ERR_DOUBLE_STATE_FOR_REDOUBLE);
                 } else if (state->last_bid_seat % 2 != state->next_to_act % 2) {
-                        set_error(state, "redouble of other sides' contract");
+                        set_error(state, ERR_REDOUBLE_OF_OTHER_SIDE);
                 } else {
-                        state->last_bid_double = CALL_REDOUBLE;
-                        state->pass_position = 0;
-                        state->next_to_act = (state->next_to_act + 1) % 4;
+                        SET(state, state->last_bid_double, CALL_REDOUBLE);
+                        SET(state, state->pass_position, 0);
+                        SET(state, state->next_to_act, (state->next_to_act + 1) % 4);
 		}
 	}
 }
@@ -159,90 +295,170 @@ static void give_card(GameState *state, int seat, int suit, int rank) {
 	}
 	int num_cards = 0;
 	for (int osuit = 0; osuit < 4; ++osuit) {
-		for (int orank = 0; orank < 4; ++orank) {
+		for (int orank = 0; orank < 13; ++orank) {
 			num_cards += state->dealt_cards[seat][osuit][orank];
 		}
 	}
         if (num_duplicates > 0) {
-                set_error(state, "Duplicate card");
+                set_error(state, ERR_DUPLICATE_CARD);
         } else if (state->played_cards[suit][rank] > 0) {
-                set_error(state, "Card already played");
+                set_error(state, ERR_CARD_ALREADY_PLAYED);
         } else if (num_cards >= 13) {
-                set_error(state, "14 cards in hand");
+                set_error(state, ERR_FOURTEEN_CARDS);
         } else if (!state->dealt_cards[seat][suit][rank]) {
-                state->dealt_cards[seat][suit][rank] = 1;
-                state->min_length[seat][suit] += 1;
+		int num_in_suit = 0;
+		for (int orank = 0; orank < 13; ++orank) {
+			num_in_suit += state->dealt_cards[seat][suit][orank];
+		}
+                SET(state, state->dealt_cards[seat][suit][rank], 1);
+		if (num_in_suit >= state->min_length[seat][suit]) {
+			SET(state, state->min_length[seat][suit],
+					num_in_suit + 1);
+		}
                 if (state->min_length[seat][suit] >
 			       	state->max_length[seat][suit]) {
-                        set_error(state, "Revoke?");
+                        set_error(state, ERR_LENGTH_EXCEEDED);
                 }
 	}
 }
 
+// Tightens min_length and max_length to the bounds implied by the dealt
+// cards and by every hand and every suit having 13 cards, until they stop
+// changing. Returns false if they cannot be met.
+bool shrink_lengths(GameState *state) {
+	bool changed = true;
+	while (changed) {
+		changed = false;
+		int min_in_hand[4] = {0, 0, 0, 0};
+		int max_in_hand[4] = {0, 0, 0, 0};
+		int min_in_suit[4] = {0, 0, 0, 0};
+		int max_in_suit[4] = {0, 0, 0, 0};
+		for (int seat = 0; seat < 4; ++seat) {
+			for (int suit = 0; suit < 4; ++suit) {
+				min_in_hand[seat] += state->min_length[seat][suit];
+				max_in_hand[seat] += state->max_length[seat][suit];
+				min_in_suit[suit] += state->min_length[seat][suit];
+				max_in_suit[suit] += state->max_length[seat][suit];
+			}
+		}
+		for (int seat = 0; seat < 4; ++seat) {
+			for (int suit = 0; suit < 4; ++suit) {
+				int min = state->min_length[seat][suit];
+				int max = state->max_length[seat][suit];
+				int lower = 0;
+				for (int rank = 0; rank < 13; ++rank) {
+					lower += state->dealt_cards[seat][suit][rank];
+				}
+				int upper = 13 - (min_in_hand[seat] - min);
+				int n = 13 - (min_in_suit[suit] - min);
+				upper = n < upper ? n : upper;
+				n = 13 - (max_in_hand[seat] - max);
+				lower = n > lower ? n : lower;
+				n = 13 - (max_in_suit[suit] - max);
+				lower = n > lower ? n : lower;
+				if (upper < max) {
+					SET(state, state->max_length[seat][suit], upper);
+					changed = true;
+				}
+				if (lower > min) {
+					SET(state, state->min_length[seat][suit], lower);
+					changed = true;
+				}
+				if (state->min_length[seat][suit] >
+						state->max_length[seat][suit]) {
+					return false;
+				}
+			}
+		}
+	}
+	return true;
+}
+
 static void execute_play_action(GameState *state, int suit, int rank) {
         if (state->stage != STAGE_PLAY) {
-		set_error(state, "stage for call");
+		set_error(state, ERR_STAGE_FOR_PLAY);
                 return;
 	}
         int seat = state->next_to_act;
         if (state->played_cards[suit][rank]) {
-                set_error(state, "Card already played");
+                set_error(state, ERR_CARD_ALREADY_PLAYED);
 	}
+        bool learned = false;
         if (state->trick_position != 0 && suit != state->trick_suit) {
 		int tsuit = state->trick_suit;
+		int num_in_suit = 0;
 		for (int orank = 0; orank < 13; ++orank) {
 			if (state->dealt_cards[seat][tsuit][orank] &&
 				       	!state->played_cards[tsuit][orank]) {
-				set_error(state, "Revoke");
+				set_error(state, ERR_REVOKE);
 				break;
 			}
+			num_in_suit += state->dealt_cards[seat][tsuit][orank];
 		}
-                state->max_length[seat][state->trick_suit] =
-			state->min_length[seat][state->trick_suit];
+                SET(state, state->max_length[seat][tsuit], num_in_suit);
+                learned = true;
 	}
         if (!state->dealt_cards[seat][suit][rank]) {
                 give_card(state, seat, suit, rank);
+                learned = true;
+	}
+        if (learned && state->stage != STAGE_ERROR &&
+			!shrink_lengths(state)) {
+		set_error(state, ERR_LENGTH_EXCEEDED);
 	}
         if (state->stage == STAGE_ERROR) {
                 return;
 	}
 
-        state->played_cards[suit][rank] = 1;
+        SET(state, state->played_cards[suit][rank], 1);
         if (state->trick_position == 0) {
-                state->trick_suit = suit;
+                SET(state, state->trick_suit, suit);
 	}
 
         if (state->trick_position == 0 ||
 		       	is_strongest_card_played(state, suit, rank)) {
-                state->trick_winning_seat = seat;
-                state->trick_winning_suit = suit;
-                state->trick_winning_rank = rank;
+                SET(state, state->trick_winning_seat, seat);
+                SET(state, state->trick_winning_suit, suit);
+                SET(state, state->trick_winning_rank, rank);
 	}
 
         if (state->trick_position < 3) {
-                state->trick_position += 1;
-                state->next_to_act = (state->next_to_act + 1) % 4;
+                SET(state, state->trick_position, state->trick_position + 1);
+                SET(state, state->next_to_act, (state->next_to_act + 1) % 4);
         } else {
-                state->trick_position = 0;
-                state->next_to_act = state->trick_winning_seat;
-                state->tricks_taken[state->trick_winning_seat] += 1;
+                SET(state, state->trick_position, 0);
+                SET(state, state->next_to_act, state->trick_winning_seat);
+                int winner = state->trick_winning_seat;
+                SET(state, state->tricks_taken[winner],
+				state->tricks_taken[winner] + 1);
+		// Cleared, so that transposed positions hash alike.
+		SET(state, state->trick_suit, NA);
+		SET(state, state->trick_winning_seat, NA);
+		SET(state, state->trick_winning_suit, NA);
+		SET(state, state->trick_winning_rank, NA);
 		int total_tricks_taken = 0;
 		for (int oseat = 0; oseat < 4; ++oseat) {
 			total_tricks_taken += state->tricks_taken[oseat];
 		}
                 if (total_tricks_taken == 13) {
-                        state->stage = STAGE_SCORING;
-                        state->next_to_act = NA;
+                        SET(state, state->stage, STAGE_SCORING);
+                        SET(state, state->next_to_act, NA);
 		}
 	}
 }
 
+// If undo is not NULL, the changes made by ids[i] are recorded in undo[i].
 int execute_action_ids(
 		GameState *state,
 		int num_ids, int8_t *ids,
-		HistoryEntry *history) {
+		HistoryEntry *history,
+		UndoRecord *undo) {
 	for (int i = 0; i < num_ids; ++i) {
 		int id = ids[i];
+		if (undo != NULL) {
+			g_undo_record = &undo[i];
+			g_undo_record->num_changes = 0;
+		}
 		history[i].actor = state->next_to_act;
 		history[i].action = id;
 		if (id < 35) {
@@ -255,140 +471,2962 @@ int execute_action_ids(
 			execute_play_action(state, suit, rank);
 		}
 		if (state->stage == STAGE_ERROR) {
+			g_undo_record = NULL;
 			return i;
 		}
 	}
+	g_undo_record = NULL;
 	return num_ids;
 }
 
-PyObject* wrap_execute_action_ids(PyObject *unused_self, PyObject* args) {
-	PyObject *vector_obj = NULL;
-	PyObject *ids_obj = NULL;
-	PyObject *history_obj = NULL;
-	PyArrayObject *vector = NULL;
-	PyArrayObject *ids = NULL;
-	PyArrayObject *history = NULL;
-	GameState *state;
-	int num_ids;
-	int8_t *ids0;
-	HistoryEntry *history00;
-	int n;
+// Reverts the action recorded in history_entry and undo, which must be the
+// last action executed on state. Returns false, leaving state unchanged, if
+// the record overflowed or does not match the state.
+bool undo_action(GameState *state, HistoryEntry *history_entry,
+		UndoRecord *undo) {
+	if (undo->num_changes < 0 || undo->num_changes > UNDO_CAPACITY) {
+		return false;
+	}
+	int8_t *bytes = (int8_t*) state;
+	int i;
+	for (i = undo->num_changes - 1; i >= 0; --i) {
+		int offset = undo->changes[i][0];
+		if (offset < 0 || offset >= (int) HASHED_SIZE ||
+				bytes[offset] != undo->changes[i][2]) {
+			break;
+		}
+		bytes[offset] = undo->changes[i][1];
+		update_hash(state, offset, undo->changes[i][2], bytes[offset]);
+	}
+	if (i < 0 && state->next_to_act == history_entry->actor) {
+		return true;
+	}
+	// Mismatch: roll the changes forward again.
+	for (++i; i < undo->num_changes; ++i) {
+		int offset = undo->changes[i][0];
+		bytes[offset] = undo->changes[i][2];
+		update_hash(state, offset, undo->changes[i][1], bytes[offset]);
+	}
+	return false;
+}
 
-	if (!PyArg_ParseTuple(args, "OOO", &vector_obj, &ids_obj, &history_obj))
-		return NULL;
-	vector = (PyArrayObject*) PyArray_FROM_OTF(
-			vector_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
-	ids = (PyArrayObject*) PyArray_FROM_OTF(
-			ids_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
-	history = (PyArrayObject*) PyArray_FROM_OTF(
-			history_obj, NPY_INT8, NPY_ARRAY_OUT_ARRAY);
-	if (vector == NULL || ids == NULL || history == NULL)
-		goto fail;
+// Sets mask[id] for each action id that next_to_act may take without error.
+// A card not known to be in the actor's hand is allowed if it is unplayed,
+// not known to be elsewhere, and the actor's min_length/max_length leave
+// room for it. The actor must follow suit with a card it holds or, if its
+// min_length shows it holds more of the suit than are known, any of them.
+void legal_action_mask(GameState *state, bool *mask) {
+	int actor = state->next_to_act;
+	memset(mask, 0, NUM_ACTIONS * sizeof(bool));
+	if (state->stage == STAGE_BIDDING) {
+		int first_bid = 0;
+		if (state->bidding_is_open) {
+			first_bid = 5 * state->last_bid_level +
+				state->last_bid_strain + 1;
+		}
+		for (int id = first_bid; id < 35; ++id) {
+			mask[id] = true;
+		}
+		mask[35 + CALL_PASS] = true;
+		if (state->bidding_is_open) {
+			bool own_side = state->last_bid_seat % 2 == actor % 2;
+			mask[35 + CALL_DOUBLE] =
+				state->last_bid_double == CALL_PASS && !own_side;
+			mask[35 + CALL_REDOUBLE] =
+				state->last_bid_double == CALL_DOUBLE && own_side;
+		}
+	} else if (state->stage == STAGE_PLAY) {
+		int num_cards = 0;
+		int suit_cards[4] = {0, 0, 0, 0};
+		bool must_follow = false;
+		for (int suit = 0; suit < 4; ++suit) {
+			for (int rank = 0; rank < 13; ++rank) {
+				suit_cards[suit] +=
+					state->dealt_cards[actor][suit][rank];
+			}
+			num_cards += suit_cards[suit];
+		}
+		if (state->trick_position != 0) {
+			int tsuit = state->trick_suit;
+			must_follow = suit_cards[tsuit] <
+				state->min_length[actor][tsuit];
+			for (int rank = 0; rank < 13; ++rank) {
+				if (state->dealt_cards[actor][tsuit][rank] &&
+						!state->played_cards[tsuit][rank]) {
+					must_follow = true;
+					break;
+				}
+			}
+		}
+		for (int suit = 0; suit < 4; ++suit) {
+			if (must_follow && suit != state->trick_suit) {
+				continue;
+			}
+			bool room_in_suit = num_cards < 13 && (
+				suit_cards[suit] < state->min_length[actor][suit] ||
+				state->min_length[actor][suit] <
+					state->max_length[actor][suit]);
+			for (int rank = 0; rank < 13; ++rank) {
+				if (state->played_cards[suit][rank]) {
+					continue;
+				}
+				if (state->dealt_cards[actor][suit][rank]) {
+					mask[38 + 13 * suit + rank] = true;
+				} else if (room_in_suit) {
+					bool elsewhere = false;
+					for (int oseat = 0; oseat < 4; ++oseat) {
+						elsewhere |= state->dealt_cards
+							[oseat][suit][rank];
+					}
+					mask[38 + 13 * suit + rank] = !elsewhere;
+				}
+			}
+		}
+	}
+}
 
-	if (
-		       	PyArray_NDIM(vector) != 1 ||
-		       	PyArray_NDIM(ids) != 1 ||
-		       	PyArray_NDIM(history) != 2 ||
-		       	PyArray_DIMS(vector)[0] != STATE_SIZE ||
-		       	PyArray_DIMS(history)[1] != 2) {
-		PyErr_SetString(PyExc_ValueError, "hi");
-		goto fail;
+// Turns the fully dealt state reached by history into what is public after
+// it, with the hands of the seats in the bit mask visible also shown. Hidden
+// seats keep only the cards they have played, and min_length/max_length are
+// recomputed from the known cards and from the suits each seat has shown out
+// of, as replaying history onto a public state does. Returns false if the
+// lengths cannot be met.
+bool mask_hidden_cards(GameState *state, int num_actions,
+		HistoryEntry *history, int visible) {
+	for (int seat = 0; seat < 4; ++seat) {
+		for (int suit = 0; suit < 4; ++suit) {
+			if (!(visible & (1 << seat))) {
+				for (int rank = 0; rank < 13; ++rank) {
+					state->dealt_cards[seat][suit][rank] &=
+						state->played_cards[suit][rank];
+				}
+			}
+			state->min_length[seat][suit] = 0;
+			state->max_length[seat][suit] = 13;
+		}
+	}
+	int num_plays = 0;
+	int led = 0;
+	for (int i = 0; i < num_actions; ++i) {
+		if (history[i].action < 38) {
+			continue;
+		}
+		int seat = history[i].actor;
+		int suit = (history[i].action - 38) / 13;
+		if (num_plays++ % 4 == 0) {
+			led = suit;
+		} else if (suit != led) {
+			// A seat showing out has played all its cards of the suit.
+			int num_in_suit = 0;
+			for (int rank = 0; rank < 13; ++rank) {
+				num_in_suit += state->dealt_cards[seat][led][rank];
+			}
+			state->max_length[seat][led] = num_in_suit;
+		}
 	}
+	bool ok = shrink_lengths(state);
+	rehash(state);
+	return ok;
+}
 
-	state = (GameState*) PyArray_GETPTR1(vector, 0);
-	num_ids = PyArray_DIMS(ids)[0];
-	ids0 = (int8_t*) PyArray_GETPTR1(ids, 0);
-	history00 = (HistoryEntry*) PyArray_GETPTR2(history, 0, 0);
+// Steps a batch of deals. ids is (num_states, max_ids), each row padded with
+// negative ids; histories is (num_states, max_ids). Deals already in
+// STAGE_ERROR are skipped.
+void execute_action_ids_batch(
+		GameState *states, int num_states,
+		int max_ids, int8_t *ids,
+		HistoryEntry *histories,
+		int32_t *counts, int8_t *errors) {
+	for (int i = 0; i < num_states; ++i) {
+		GameState *state = &states[i];
+		int8_t *row = &ids[i * max_ids];
+		int num_ids = 0;
+		while (num_ids < max_ids && row[num_ids] >= 0) {
+			++num_ids;
+		}
+		g_error_code = ERR_NONE;
+		if (state->stage == STAGE_ERROR) {
+			counts[i] = 0;
+		} else {
+			counts[i] = execute_action_ids(state, num_ids, row,
+					&histories[i * max_ids], NULL);
+		}
+		errors[i] = g_error_code;
+	}
+}
 
-	n = execute_action_ids(state, num_ids, ids0, history00);
+// Observation features of a deal for the seat deciding the next action:
+// the next to act, or declarer when dummy is to act. Seats are relative to
+// that observer, 0=observer 1=left hand opponent 2=partner 3=right hand
+// opponent, and cards are 13 * suit + rank.
+#define OBS_HAND 0                          // card. Unplayed cards held.
+#define OBS_DUMMY (OBS_HAND + 52)           // card. Once dummy is public.
+#define OBS_PLAYED (OBS_DUMMY + 52)         // seat, card.
+#define OBS_DEALER (OBS_PLAYED + 4 * 52)    // seat.
+#define OBS_BIDS (OBS_DEALER + 4)           // bid, seat, 0=bid 1=x 2=xx.
+#define OBS_VULNERABLE (OBS_BIDS + 35 * 4 * 3)  // 0=own side 1=other side.
+#define OBS_NEXT_TO_ACT (OBS_VULNERABLE + 2)    // seat.
+#define OBSERVATION_SIZE (OBS_NEXT_TO_ACT + 4)
 
-	PyArray_ResolveWritebackIfCopy(vector);
-	Py_DECREF(vector);
-	Py_DECREF(ids);
-	PyArray_ResolveWritebackIfCopy(history);
-	Py_DECREF(history);
-	return Py_BuildValue("iz", n, g_error_message);
+// Writes the observation of state, whose actions are the first history
+// entries up to one with a negative action, into features, which is zeroed
+// first. vulnerable is {North-South, East-West}.
+void encode_observation(GameState *state, HistoryEntry *history,
+		int history_size, int8_t *vulnerable, uint8_t *features) {
+	memset(features, 0, OBSERVATION_SIZE);
+	int observer = state->next_to_act == NA ? 0 : state->next_to_act;
+	bool playing = state->stage == STAGE_PLAY || state->stage == STAGE_SCORING;
+	int dummy = playing ? (state->declarer + 2) % 4 : NA;
+	if (observer == dummy) {
+		observer = state->declarer;
+	}
+	for (int card = 0; card < 52; ++card) {
+		int suit = card / 13;
+		int rank = card % 13;
+		if (!state->played_cards[suit][rank]) {
+			features[OBS_HAND + card] =
+				state->dealt_cards[observer][suit][rank];
+		}
+	}
+	int tricks = 0;
+	for (int seat = 0; seat < 4; ++seat) {
+		tricks += state->tricks_taken[seat];
+	}
+	if (playing && (state->trick_position > 0 || tricks > 0)) {
+		for (int card = 0; card < 52; ++card) {
+			int suit = card / 13;
+			int rank = card % 13;
+			if (!state->played_cards[suit][rank]) {
+				features[OBS_DUMMY + card] =
+					state->dealt_cards[dummy][suit][rank];
+			}
+		}
+	}
 
-fail:
-	PyArray_DiscardWritebackIfCopy(vector);
-	Py_XDECREF(vector);
-	Py_XDECREF(ids);
-	PyArray_DiscardWritebackIfCopy(history);
-	Py_XDECREF(history);
-	return NULL;
+	int dealer = state->next_to_act;
+	int last_bid = NA;
+	for (int i = 0; i < history_size && history[i].action >= 0; ++i) {
+		int seat = (history[i].actor - observer + 4) % 4;
+		int action = history[i].action;
+		if (i == 0) {
+			dealer = history[i].actor;
+		}
+		if (action < 35) {
+			last_bid = action;
+			features[OBS_BIDS + 12 * action + 3 * seat] = 1;
+		} else if (action < 38) {
+			if (action != 35 + CALL_PASS && last_bid != NA) {
+				features[OBS_BIDS + 12 * last_bid + 3 * seat +
+					action - 35] = 1;
+			}
+		} else {
+			features[OBS_PLAYED + 52 * seat + action - 38] = 1;
+		}
+	}
+	if (dealer != NA) {
+		features[OBS_DEALER + (dealer - observer + 4) % 4] = 1;
+	}
+	features[OBS_VULNERABLE + 0] = vulnerable[observer % 2] != 0;
+	features[OBS_VULNERABLE + 1] = vulnerable[1 - observer % 2] != 0;
+	if (state->next_to_act != NA) {
+		features[OBS_NEXT_TO_ACT +
+			(state->next_to_act - observer + 4) % 4] = 1;
+	}
 }
 
-#if 0
-// fastgame.shrink_lengths(self._vector)
-PyObject* wrap_shrink_lengths(PyObject *unused_self, PyObject* args) {
-	PyObject *vector_obj = NULL;
-	PyArrayObject *vector = NULL;
-	GameState *state;
-	bool ok;
+static void pack_state(GameState *state, PackedState *packed) {
+	memset(packed, 0, sizeof(PackedState));
+	for (int suit = 0; suit < 4; ++suit) {
+		for (int rank = 0; rank < 13; ++rank) {
+			for (int seat = 0; seat < 4; ++seat) {
+				if (state->dealt_cards[seat][suit][rank]) {
+					packed->dealt_cards[seat] |=
+						CARD_BIT(suit, rank);
+				}
+			}
+			if (state->played_cards[suit][rank]) {
+				packed->played_cards |= CARD_BIT(suit, rank);
+			}
+		}
+	}
+	memcpy(packed->tricks_taken, state->tricks_taken, 4);
+	packed->stage = state->stage;
+	packed->next_to_act = state->next_to_act;
+	packed->trump = state->last_bid_strain;
+	packed->declarer = state->declarer;
+	packed->trick_suit = state->trick_suit;
+	packed->trick_position = state->trick_position;
+	packed->trick_winning_seat = state->trick_winning_seat;
+	packed->trick_winning_suit = state->trick_winning_suit;
+	packed->trick_winning_rank = state->trick_winning_rank;
+}
 
-	if (!PyArg_ParseTuple(args, "O", &vector_obj))
-		return NULL;
-	vector = (PyArrayObject*) PyArray_FROM_OTF(
-			vector_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
-	if (vector == NULL)
-		goto fail;
+// Cards next_to_act may play, as a bitboard.
+static uint64_t packed_legal_cards(PackedState *packed) {
+	if (packed->stage != STAGE_PLAY) {
+		return 0;
+	}
+	uint64_t cards = packed->dealt_cards[packed->next_to_act] &
+		~packed->played_cards;
+	if (packed->trick_position != 0) {
+		uint64_t follow = cards & SUIT_MASK(packed->trick_suit);
+		if (follow) {
+			return follow;
+		}
+	}
+	return cards;
+}
 
-	if ( PyArray_NDIM(vector) != 1 || PyArray_DIMS(vector)[0] != STATE_SIZE)
-		goto fail;
+static bool packed_is_strongest_card_played(
+		PackedState *packed, int suit, int rank) {
+	int trump = packed->trump;
+	if (suit == trump && packed->trick_winning_suit != trump) {
+		return true;
+	}
+	if (suit != packed->trick_winning_suit) {
+		return false;
+	}
+	return rank > packed->trick_winning_rank;
+}
 
-	state = (GameState*) PyArray_GETPTR1(vector, 0);
-	ok = shrink_lengths(state);
+// As execute_play_action, for a card known to be in packed_legal_cards.
+static void packed_play_card(PackedState *packed, int suit, int rank) {
+	int seat = packed->next_to_act;
+	packed->played_cards |= CARD_BIT(suit, rank);
+	if (packed->trick_position == 0) {
+		packed->trick_suit = suit;
+	}
+	if (packed->trick_position == 0 ||
+			packed_is_strongest_card_played(packed, suit, rank)) {
+		packed->trick_winning_seat = seat;
+		packed->trick_winning_suit = suit;
+		packed->trick_winning_rank = rank;
+	}
+	if (packed->trick_position < 3) {
+		packed->trick_position += 1;
+		packed->next_to_act = (packed->next_to_act + 1) % 4;
+	} else {
+		packed->trick_position = 0;
+		packed->next_to_act = packed->trick_winning_seat;
+		packed->tricks_taken[packed->trick_winning_seat] += 1;
+		packed->trick_suit = NA;
+		packed->trick_winning_seat = NA;
+		packed->trick_winning_suit = NA;
+		packed->trick_winning_rank = NA;
+		int total_tricks_taken = 0;
+		for (int oseat = 0; oseat < 4; ++oseat) {
+			total_tricks_taken += packed->tricks_taken[oseat];
+		}
+		if (total_tricks_taken == 13) {
+			packed->stage = STAGE_SCORING;
+			packed->next_to_act = NA;
+		}
+	}
+}
 
-	PyArray_ResolveWritebackIfCopy(vector);
-	Py_DECREF(vector);
-	Py_INCREF(Py_None);
-	return Py_None;
+static void packed_set_error(PackedState *packed, int code) {
+	if (packed->stage != STAGE_ERROR) {
+		packed->stage = STAGE_ERROR;
+		g_error_code = code;
+		g_error_message = error_messages[code];
+	}
+}
 
-fail:
-	PyArray_DiscardWritebackIfCopy(vector);
-	Py_XDECREF(vector);
-	return NULL;
+int execute_packed_action_ids(PackedState *packed, int num_ids, int8_t *ids) {
+	for (int i = 0; i < num_ids; ++i) {
+		int id = ids[i];
+		if (packed->stage != STAGE_PLAY || id < 38) {
+			packed_set_error(packed, ERR_STAGE_FOR_PLAY);
+			return i;
+		}
+		int suit = (id - 38) / 13;
+		int rank = (id - 38) % 13;
+		uint64_t card = CARD_BIT(suit, rank);
+		if (packed->played_cards & card) {
+			packed_set_error(packed, ERR_CARD_ALREADY_PLAYED);
+			return i;
+		} else if (!(packed->dealt_cards[packed->next_to_act] & card)) {
+			packed_set_error(packed, ERR_CARD_NOT_HELD);
+			return i;
+		} else if (!(packed_legal_cards(packed) & card)) {
+			packed_set_error(packed, ERR_REVOKE);
+			return i;
+		}
+		packed_play_card(packed, suit, rank);
+	}
+	return num_ids;
 }
-#endif
 
-static PyMethodDef fastgamemethods[] = {
-	{
-		"execute_action_ids",
-		(PyCFunction)wrap_execute_action_ids,
-		METH_VARARGS,
-		"Execute a list of action id"
-	},
-#if 0
-	{
-		"shrink_lengths",
-		(PyCFunction)wrap_shrink_lengths,
-		METH_VARARGS,
-		"Shrink {min,max}_lengths to reflect logical possibilities"
-	},
-#endif
-	{NULL, NULL, 0, NULL}
-};
+// Double dummy solver over PackedState, for fully dealt hands.
+//
+// Values are the tricks North-South take from the cards that remain,
+// including the trick in progress. The transposition table is consulted at
+// the start of each trick. An entry records the hand lengths and who holds
+// only the top cards of each suit that the search found relevant, so it
+// also answers for positions that differ below those cards.
+//
+// The relevant cards of a search are kept as the lowest relevant rank of
+// each suit (13 = none): the ranks of trick winners that beat another card
+// of their suit, and those a bound or table entry depended on.
 
-static struct PyModuleDef fastgamemoduledef = {
-  PyModuleDef_HEAD_INIT,
-  "fastgame",
-  NULL,
-  -1,
-  fastgamemethods,
-  NULL,
-  NULL,
-  NULL,
-  NULL
-};
+typedef struct DDEntry {
+	uint64_t lengths;      // as in DDKey; 0=empty.
+	uint32_t owners[4];    // suit. Seat of each of the top cards, 2 bits each.
+	int8_t num_top[4];     // suit. Number of cards in owners.
+	int8_t trump;
+	int8_t lower;          // bounds on the value.
+	int8_t upper;
+	int8_t best_move;      // 16 * suit + rank counted from the top, or NA.
+} DDEntry;
 
-PyMODINIT_FUNC
-PyInit_fastgame() {
-	PyObject *m = NULL;
-	if (STATE_SIZE != 330) {
-		printf("GameState has size %ld, but need 330", STATE_SIZE);
-	} else {
-		m = PyModule_Create(&fastgamemoduledef);
-		import_array();
+#define DD_BUCKET_SIZE 256
+
+typedef struct DDSolver {
+	DDEntry *table;        // buckets of DD_BUCKET_SIZE entries.
+	uint64_t bucket_mask;  // number of buckets - 1.
+	int64_t nodes;
+	int8_t killers[14];    // remaining tricks. The last lead to cut off.
+} DDSolver;
+
+// Position features computed once per trick.
+typedef struct DDKey {
+	uint64_t lengths;
+	int8_t trump;
+	uint32_t owners[4];    // suit. Seat of each remaining card, from the top.
+	int8_t num_cards[4];   // suit.
+	int8_t ranks[4][13];   // suit, position from the top.
+} DDKey;
+
+#define DD_TABLE_LOG2_SIZE 12
+#define ALL_CARDS (SUIT_MASK(0) | SUIT_MASK(1) | SUIT_MASK(2) | SUIT_MASK(3))
+#define SUIT_CARDS(cards, suit) ((int) (((cards) >> (16 * (suit))) & 0x1FFF))
+#define NO_RANK 13
+
+static bool dd_init(DDSolver *solver, int log2_size) {
+	solver->table = calloc((size_t) DD_BUCKET_SIZE << log2_size,
+			sizeof(DDEntry));
+	solver->bucket_mask = ((uint64_t) 1 << log2_size) - 1;
+	solver->nodes = 0;
+	memset(solver->killers, NA, sizeof(solver->killers));
+	return solver->table != NULL;
+}
+
+static void dd_free(DDSolver *solver) {
+	free(solver->table);
+	solver->table = NULL;
+}
+
+static uint64_t remaining_cards(PackedState *packed, int seat) {
+	return packed->dealt_cards[seat] & ~packed->played_cards;
+}
+
+static void clear_relevant(int8_t *relevant) {
+	memset(relevant, NO_RANK, 4);
+}
+
+static void add_relevant(int8_t *relevant, int suit, int rank) {
+	if (rank < relevant[suit]) {
+		relevant[suit] = rank;
+	}
+}
+
+static void merge_relevant(int8_t *relevant, int8_t *other) {
+	for (int suit = 0; suit < 4; ++suit) {
+		add_relevant(relevant, suit, other[suit]);
+	}
+}
+
+// The remaining lengths of each hand, 4 bits each, except the last of
+// West's, which follows from the others as all hands have the same size.
+// The leader is in the top bits, with a set bit that makes them nonzero.
+static void dd_key(PackedState *packed, DDKey *key) {
+	key->lengths = ((uint64_t) 1 << 63) |
+		((uint64_t) packed->next_to_act << 60);
+	// Once the trumps are gone the play is as in notrump.
+	key->trump = packed->trump != 4 &&
+		SUIT_CARDS(~packed->played_cards, packed->trump) ?
+		packed->trump : 4;
+	for (int seat = 0; seat < 4; ++seat) {
+		uint64_t cards = remaining_cards(packed, seat);
+		for (int suit = 0; suit < 4 && 4 * seat + suit < 15; ++suit) {
+			key->lengths |= (uint64_t) __builtin_popcount(
+					SUIT_CARDS(cards, suit)) <<
+				(4 * (4 * seat + suit));
+		}
+	}
+	for (int suit = 0; suit < 4; ++suit) {
+		uint32_t owners = 0;
+		int n = 0;
+		for (int rank = 12; rank >= 0; --rank) {
+			uint64_t card = CARD_BIT(suit, rank);
+			if (packed->played_cards & card) {
+				continue;
+			}
+			int seat = 0;
+			while (!(packed->dealt_cards[seat] & card)) {
+				++seat;
+			}
+			owners = (owners << 2) | seat;
+			key->ranks[suit][n++] = rank;
+		}
+		key->owners[suit] = owners;
+		key->num_cards[suit] = n;
+	}
+}
+
+// Entries with the same lengths and trumps share a bucket, so that a
+// position finds those that only record the top cards of each suit.
+static DDEntry *dd_bucket(DDSolver *solver, DDKey *key) {
+	uint64_t z = (key->lengths ^ key->trump) * 0x9E3779B97F4A7C15ULL;
+	return &solver->table[DD_BUCKET_SIZE *
+		((z ^ (z >> 29)) & solver->bucket_mask)];
+}
+
+// Whether entry's top cards are held as in key.
+static bool dd_matches(DDEntry *entry, DDKey *key) {
+	if (entry->lengths != key->lengths || entry->trump != key->trump) {
+		return false;
+	}
+	for (int suit = 0; suit < 4; ++suit) {
+		int shift = 2 * (key->num_cards[suit] - entry->num_top[suit]);
+		if (key->owners[suit] >> shift != entry->owners[suit]) {
+			return false;
+		}
+	}
+	return true;
+}
+
+static void dd_entry_relevant(DDEntry *entry, DDKey *key, int8_t *relevant) {
+	for (int suit = 0; suit < 4; ++suit) {
+		if (entry->num_top[suit] > 0) {
+			add_relevant(relevant, suit,
+				key->ranks[suit][entry->num_top[suit] - 1]);
+		}
+	}
+}
+
+static void dd_store(DDSolver *solver, DDKey *key, int8_t *relevant,
+		int lower, int upper, int best_move) {
+	DDEntry entry;
+	memset(&entry, 0, sizeof(entry));
+	entry.lengths = key->lengths;
+	entry.trump = key->trump;
+	for (int suit = 0; suit < 4; ++suit) {
+		int n = 0;
+		while (n < key->num_cards[suit] &&
+				key->ranks[suit][n] >= relevant[suit]) {
+			++n;
+		}
+		entry.num_top[suit] = n;
+		entry.owners[suit] = key->owners[suit] >>
+			(2 * (key->num_cards[suit] - n));
+	}
+	entry.lower = lower;
+	entry.upper = upper;
+	entry.best_move = best_move;
+
+	DDEntry *bucket = dd_bucket(solver, key);
+	DDEntry *slot = &bucket[solver->nodes % DD_BUCKET_SIZE];
+	for (int i = 0; i < DD_BUCKET_SIZE; ++i) {
+		DDEntry *other = &bucket[i];
+		if (other->lengths == 0) {
+			slot = other;
+		} else if (other->lengths == entry.lengths &&
+				other->trump == entry.trump &&
+				!memcmp(other->num_top, entry.num_top, 4) &&
+				!memcmp(other->owners, entry.owners, 16)) {
+			if (other->lower > entry.lower) {
+				entry.lower = other->lower;
+			}
+			if (other->upper < entry.upper) {
+				entry.upper = other->upper;
+			}
+			slot = other;
+			break;
+		}
+	}
+	*slot = entry;
+}
+
+static int ns_tricks(PackedState *packed) {
+	return packed->tricks_taken[0] + packed->tricks_taken[2];
+}
+
+// Whether every card is either played or held, and the hands have sizes
+// consistent with the trick in progress.
+static bool dd_is_fully_dealt(PackedState *packed) {
+	uint64_t cards = packed->played_cards;
+	for (int seat = 0; seat < 4; ++seat) {
+		cards |= packed->dealt_cards[seat];
+	}
+	if (cards != ALL_CARDS || packed->stage != STAGE_PLAY) {
+		return false;
+	}
+	int n = __builtin_popcountll(
+			remaining_cards(packed, packed->next_to_act));
+	for (int i = 0; i < 4; ++i) {
+		int seat = (packed->next_to_act + i) % 4;
+		int expected = i < 4 - packed->trick_position ? n : n - 1;
+		if (__builtin_popcountll(remaining_cards(packed, seat)) !=
+				expected) {
+			return false;
+		}
+	}
+	return true;
+}
+
+// Winners seat can cash in suit from the top without losing the lead, if
+// it were on lead: all its cards once the opponents are exhausted, unless
+// partner could overtake one of them.
+static int dd_suit_winners(PackedState *packed, int seat, int suit,
+		int8_t *relevant) {
+	int trump = packed->trump;
+	int held = SUIT_CARDS(remaining_cards(packed, seat), suit);
+	int partners = SUIT_CARDS(remaining_cards(packed, (seat + 2) % 4), suit);
+	int rest = 0;
+	int longest = 0;
+	int safe = 13;
+	for (int i = 1; i < 4; ++i) {
+		int oseat = (seat + i) % 4;
+		int cards = SUIT_CARDS(remaining_cards(packed, oseat), suit);
+		rest |= cards;
+		if (i == 2) {
+			continue;
+		}
+		int n = __builtin_popcount(cards);
+		longest = n > longest ? n : longest;
+		if (trump != 4 && suit != trump && SUIT_CARDS(
+				remaining_cards(packed, oseat), trump) != 0) {
+			safe = n < safe ? n : safe;
+		}
+	}
+	int top = 0;
+	int lowest = NO_RANK;
+	for (int rank = 12; rank >= 0 && !(rest & (1 << rank)); --rank) {
+		if (held & (1 << rank)) {
+			++top;
+			lowest = rank;
+		}
+	}
+	int winners = top;
+	if (top >= longest && top > 0 &&
+			partners >> __builtin_ctz(held) == 0) {
+		winners = __builtin_popcount(held);
+		if (partners != 0) {
+			lowest = __builtin_ctz(held);
+		}
+	}
+	winners = winners < safe ? winners : safe;
+	if (winners > 0 && rest != 0) {
+		add_relevant(relevant, suit, lowest);
+	}
+	return winners;
+}
+
+// Whether the top card of a is above that of b, in one suit, where a is
+// not empty. relevant gets the higher of the two, which settles it.
+static bool dd_above(int a, int b, int suit, int8_t *relevant) {
+	int a_top = 31 - __builtin_clz(a);
+	if (b == 0) {
+		return true;
+	}
+	int b_top = 31 - __builtin_clz(b);
+	add_relevant(relevant, suit, a_top > b_top ? a_top : b_top);
+	return a_top > b_top;
+}
+
+// The lowest card of the longest suit of hand, to discard.
+static uint64_t dd_discard(uint64_t hand) {
+	uint64_t cards = hand;
+	int best = NA;
+	int best_length = 0;
+	for (int suit = 0; suit < 4; ++suit) {
+		int length = __builtin_popcount(SUIT_CARDS(cards, suit));
+		if (length > best_length) {
+			best = suit;
+			best_length = length;
+		}
+	}
+	return CARD_BIT(best, __builtin_ctz(SUIT_CARDS(cards, best)));
+}
+
+// A lower bound on the tricks the leader's side takes from the start of a
+// trick, by playing out a plan in which it only leads to tricks it wins
+// whatever the opponents do: to a card above all theirs in the suit that
+// none of them can ruff, or to a ruff by partner while both opponents
+// follow suit or have no trumps. The opponents follow with their lowest
+// cards and are taken to keep those they discard, which only helps them.
+// With cross_first the plan starts by leading to partner's winner.
+static int dd_cash_tricks(PackedState *packed, bool cross_first,
+		int8_t *relevant) {
+	int leader = packed->next_to_act;
+	int trump = packed->trump;
+	uint64_t hands[2] = {
+		remaining_cards(packed, leader),
+		remaining_cards(packed, (leader + 2) % 4),
+	};
+	uint64_t opponents[2] = {
+		remaining_cards(packed, (leader + 1) % 4),
+		remaining_cards(packed, (leader + 3) % 4),
+	};
+	clear_relevant(relevant);
+	int tricks = 0;
+	int h = 0;
+	while (hands[h]) {
+		uint64_t opps = opponents[0] | opponents[1];
+		int plan = NA;
+		int plan_suit = NA;
+		int plan_score = 0;
+		int8_t plan_relevant[4];
+		for (int suit = 0; suit < 4; ++suit) {
+			int own = SUIT_CARDS(hands[h], suit);
+			if (own == 0) {
+				continue;
+			}
+			int partners = SUIT_CARDS(hands[1 - h], suit);
+			int opp = SUIT_CARDS(opps, suit);
+			bool ruffable = false;
+			bool overruffable = false;
+			if (trump != 4 && suit != trump) {
+				for (int i = 0; i < 2; ++i) {
+					bool void_in_suit = SUIT_CARDS(
+						opponents[i], suit) == 0;
+					bool trumps = SUIT_CARDS(
+						opponents[i], trump) != 0;
+					ruffable |= void_in_suit && trumps;
+				}
+				overruffable = ruffable;
+			}
+			int score = 0;
+			int kind = NA;
+			// Only the comparisons of the plan carried out matter.
+			int8_t cash_relevant[4];
+			int8_t cross_relevant[4];
+			clear_relevant(cash_relevant);
+			clear_relevant(cross_relevant);
+			if (!ruffable) {
+				bool cash = dd_above(own, opp, suit, cash_relevant);
+				bool cross = partners &&
+					dd_above(partners, opp, suit,
+						cross_relevant) &&
+					dd_above(partners, own & -own, suit,
+						cross_relevant);
+				bool partner_wins = partners && dd_above(
+						partners, opp, suit, cross_relevant);
+				if (cross && cross_first && tricks == 0) {
+					kind = 1;
+					score = 60;
+				} else if (cash && suit == trump) {
+					kind = 0;
+					score = 50;
+				} else if (cash && (!partner_wins ||
+						__builtin_popcount(own) >=
+						__builtin_popcount(partners))) {
+					kind = 0;
+					score = 40;
+				} else if (cross) {
+					kind = 1;
+					score = 30;
+				} else if (cash) {
+					kind = 0;
+					score = 10;
+				}
+			}
+			if (kind == NA && trump != 4 && suit != trump &&
+					partners == 0 && SUIT_CARDS(
+						hands[1 - h], trump) != 0 &&
+					!overruffable) {
+				kind = 2;
+				score = 20;
+			}
+			if (score > plan_score) {
+				plan = kind;
+				plan_suit = suit;
+				plan_score = score;
+				memcpy(plan_relevant, kind == 0 ? cash_relevant :
+						cross_relevant, 4);
+			}
+		}
+		if (plan == NA) {
+			break;
+		}
+		merge_relevant(relevant, plan_relevant);
+		int suit = plan_suit;
+		int own = SUIT_CARDS(hands[h], suit);
+		int partners = SUIT_CARDS(hands[1 - h], suit);
+		// The cards played by the leading hand and partner.
+		int lead_rank = plan == 0 ? 31 - __builtin_clz(own) :
+			__builtin_ctz(own);
+		uint64_t lead = CARD_BIT(suit, lead_rank);
+		uint64_t follow;
+		int winner = h;
+		if (plan == 2) {
+			follow = CARD_BIT(trump, __builtin_ctz(
+					SUIT_CARDS(hands[1 - h], trump)));
+			winner = 1 - h;
+		} else if (partners == 0) {
+			follow = dd_discard(hands[1 - h]);
+		} else {
+			int follow_rank = plan == 1 ?
+				31 - __builtin_clz(partners) :
+				__builtin_ctz(partners);
+			follow = CARD_BIT(suit, follow_rank);
+			add_relevant(relevant, suit, lead_rank > follow_rank ?
+					lead_rank : follow_rank);
+			if (follow_rank > lead_rank) {
+				winner = 1 - h;
+			}
+		}
+		hands[h] &= ~lead;
+		hands[1 - h] &= ~follow;
+		for (int i = 0; i < 2; ++i) {
+			int cards = SUIT_CARDS(opponents[i], suit);
+			if (cards) {
+				opponents[i] &= ~CARD_BIT(suit, __builtin_ctz(cards));
+			}
+		}
+		++tricks;
+		h = winner;
+	}
+	return tricks;
+}
+
+// A lower bound on the tricks the leader's side takes from the start of a
+// trick: the leader's winners, then those of one suit in which partner has
+// the top card and the leader a card to reach it.
+static int dd_quick_tricks(PackedState *packed, int8_t *relevant) {
+	int leader = packed->next_to_act;
+	int partner = (leader + 2) % 4;
+	uint64_t own = remaining_cards(packed, leader);
+	uint64_t partners = remaining_cards(packed, partner);
+	uint64_t all = ~packed->played_cards & ALL_CARDS;
+	int tricks = 0;
+	int entry_tricks = 0;
+	int entry_suit = NA;
+	int8_t entry_relevant[4];
+	clear_relevant(relevant);
+	for (int suit = 0; suit < 4; ++suit) {
+		tricks += dd_suit_winners(packed, leader, suit, relevant);
+		int cards = SUIT_CARDS(all, suit);
+		if (cards == 0 || SUIT_CARDS(own, suit) == 0) {
+			continue;
+		}
+		int top_rank = 31 - __builtin_clz(cards);
+		if (SUIT_CARDS(partners, suit) & (1 << top_rank)) {
+			int8_t suit_relevant[4];
+			clear_relevant(suit_relevant);
+			add_relevant(suit_relevant, suit, top_rank);
+			int n = dd_suit_winners(packed, partner, suit,
+					suit_relevant);
+			if (n > entry_tricks) {
+				entry_tricks = n;
+				entry_suit = suit;
+				memcpy(entry_relevant, suit_relevant, 4);
+			}
+		}
+	}
+	if (entry_suit != NA) {
+		tricks += entry_tricks;
+		merge_relevant(relevant, entry_relevant);
+	}
+	int remaining = __builtin_popcountll(own);
+	for (int cross_first = 0; cross_first < 2; ++cross_first) {
+		int8_t cash_relevant[4];
+		int n = dd_cash_tricks(packed, cross_first, cash_relevant);
+		if (n > tricks) {
+			tricks = n;
+			memcpy(relevant, cash_relevant, 4);
+		}
+	}
+	return tricks < remaining ? tricks : remaining;
+}
+
+// A lower bound on the tricks side (0=North-South) takes at any time: each
+// trump above all the opponents' trumps wins the trick it is played to, and
+// those in one hand are played to different tricks. Two top trumps split
+// between the hands also take two tricks if one of the hands has another
+// trump, and the second best trump takes a trick if it is guarded and its
+// partner holds the third or it sits over the top one.
+static int dd_trump_tricks(PackedState *packed, int side, int8_t *relevant) {
+	int trump = packed->trump;
+	clear_relevant(relevant);
+	if (trump == 4) {
+		return 0;
+	}
+	int trumps[4];
+	for (int seat = 0; seat < 4; ++seat) {
+		trumps[seat] = SUIT_CARDS(remaining_cards(packed, seat), trump);
+	}
+	int own[2] = {trumps[side], trumps[side + 2]};
+	int opponents = trumps[1 - side] | trumps[3 - side];
+	int n[2] = {0, 0};
+	int lowest[2] = {NO_RANK, NO_RANK};
+	int rank = 12;
+	for (; rank >= 0 && !(opponents & (1 << rank)); --rank) {
+		for (int i = 0; i < 2; ++i) {
+			if (own[i] & (1 << rank)) {
+				++n[i];
+				lowest[i] = rank;
+			}
+		}
+	}
+	if (rank < 0) {
+		return n[0] > n[1] ? n[0] : n[1];
+	}
+	if (n[0] == 1 && n[1] == 1 && (__builtin_popcount(own[0]) > 1 ||
+			__builtin_popcount(own[1]) > 1)) {
+		add_relevant(relevant, trump, lowest[0]);
+		add_relevant(relevant, trump, lowest[1]);
+		return 2;
+	}
+	if (n[0] + n[1] > 0) {
+		int i = n[0] > n[1] ? 0 : 1;
+		add_relevant(relevant, trump, lowest[i]);
+		return n[i];
+	}
+
+	// The opponents hold the top trump.
+	int cards = own[0] | own[1] | opponents;
+	int top = rank;
+	int second = top - 1;
+	while (second >= 0 && !(cards & (1 << second))) {
+		--second;
+	}
+	if (second < 0 || !((own[0] | own[1]) & (1 << second))) {
+		return 0;
+	}
+	int holder = own[0] & (1 << second) ? side : side + 2;
+	if (__builtin_popcount(trumps[holder]) < 2) {
+		return 0;
+	}
+	if (trumps[(holder + 3) % 4] & (1 << top)) {
+		add_relevant(relevant, trump, second);
+		return 1;
+	}
+	int third = second - 1;
+	while (third >= 0 && !(cards & (1 << third))) {
+		--third;
+	}
+	if (third >= 0 && ((own[0] | own[1]) & (1 << third))) {
+		add_relevant(relevant, trump, third);
+		return 1;
+	}
+	return 0;
+}
+
+// Whether the leader's side loses one of the remaining tricks: the one
+// about to start if the opponents hold the top card of each suit the leader
+// can lead and partner cannot ruff it, and without trumps if the suits
+// whose top card the side holds are too short to lead to each trick.
+static bool dd_loses_trick(PackedState *packed, int8_t *relevant) {
+	int leader = packed->next_to_act;
+	int trump = packed->trump;
+	uint64_t own = remaining_cards(packed, leader);
+	uint64_t partners = remaining_cards(packed, (leader + 2) % 4);
+	uint64_t opponents = remaining_cards(packed, (leader + 1) % 4) |
+		remaining_cards(packed, (leader + 3) % 4);
+	bool partner_ruffs = trump != 4 && SUIT_CARDS(partners, trump) != 0;
+	bool trumps_left = trump != 4 &&
+		SUIT_CARDS(own | partners | opponents, trump) != 0;
+	bool loses_first = true;
+	int controlled = 0;
+	int8_t first_relevant[4];
+	clear_relevant(first_relevant);
+	clear_relevant(relevant);
+	for (int suit = 0; suit < 4; ++suit) {
+		int cards = SUIT_CARDS(own | partners | opponents, suit);
+		if (cards == 0) {
+			continue;
+		}
+		int top_rank = 31 - __builtin_clz(cards);
+		int own_length = __builtin_popcount(SUIT_CARDS(own, suit));
+		int partner_length = __builtin_popcount(
+				SUIT_CARDS(partners, suit));
+		if (SUIT_CARDS(opponents, suit) & (1 << top_rank)) {
+			if (own_length + partner_length > 0 ||
+					SUIT_CARDS(opponents, suit) !=
+					(1 << top_rank)) {
+				add_relevant(relevant, suit, top_rank);
+			}
+			if (own_length > 0) {
+				add_relevant(first_relevant, suit, top_rank);
+			}
+			if (own_length > 0 && suit != trump && partner_ruffs &&
+					partner_length == 0) {
+				loses_first = false;
+			}
+		} else {
+			controlled += own_length > partner_length ?
+				own_length : partner_length;
+			if (own_length > 0) {
+				loses_first = false;
+			}
+		}
+	}
+	if (loses_first) {
+		memcpy(relevant, first_relevant, 4);
+		return true;
+	}
+	return !trumps_left && controlled > 0 &&
+		controlled < __builtin_popcountll(own);
+}
+
+// Whether the side of the second hand to play wins the trick in progress:
+// one of its hands can ruff and the third hand cannot, or it holds a card
+// above the lead and the third hand's cards that the third hand cannot
+// ruff.
+static bool dd_second_hand_wins(PackedState *packed, int8_t *relevant) {
+	int seat = packed->next_to_act;
+	int trump = packed->trump;
+	int suit = packed->trick_suit;
+	uint64_t own = remaining_cards(packed, seat);
+	uint64_t partners = remaining_cards(packed, (seat + 2) % 4);
+	uint64_t third = remaining_cards(packed, (seat + 1) % 4);
+	bool side_suit = trump != 4 && suit != trump;
+	bool third_ruffs = side_suit && SUIT_CARDS(third, suit) == 0 &&
+		SUIT_CARDS(third, trump) != 0;
+	clear_relevant(relevant);
+	if (third_ruffs) {
+		return false;
+	}
+	if (side_suit && ((SUIT_CARDS(own, suit) == 0 &&
+			SUIT_CARDS(own, trump) != 0) ||
+			(SUIT_CARDS(partners, suit) == 0 &&
+			 SUIT_CARDS(partners, trump) != 0))) {
+		return true;
+	}
+	int cards = SUIT_CARDS(own | partners, suit);
+	if (cards == 0) {
+		return false;
+	}
+	int top_rank = 31 - __builtin_clz(cards);
+	if (top_rank < packed->trick_winning_rank ||
+			(SUIT_CARDS(third, suit) >> top_rank) != 0) {
+		return false;
+	}
+	add_relevant(relevant, suit, top_rank);
+	return true;
+}
+
+// Fills moves with the legal cards (as 16 * suit + rank) of next_to_act,
+// one per group of equivalent cards, best first. Cards are equivalent when
+// no card between them remains in another hand or wins the current trick.
+static int dd_moves(PackedState *packed, int first_move, int killer,
+		int8_t *moves) {
+	int seat = packed->next_to_act;
+	uint64_t legal = packed_legal_cards(packed);
+	uint64_t others = 0;
+	for (int oseat = 0; oseat < 4; ++oseat) {
+		if (oseat != seat) {
+			others |= remaining_cards(packed, oseat);
+		}
+	}
+	if (packed->trick_position != 0) {
+		others |= CARD_BIT(packed->trick_winning_suit,
+				packed->trick_winning_rank);
+	}
+	uint64_t partners = remaining_cards(packed, (seat + 2) % 4);
+	bool partner_winning = packed->trick_position != 0 &&
+		packed->trick_winning_seat % 2 == seat % 2;
+
+	int scores[13];
+	int num_moves = 0;
+	for (int suit = 0; suit < 4; ++suit) {
+		int length = __builtin_popcount(SUIT_CARDS(legal, suit));
+		bool previous_held = false;
+		for (int rank = 12; rank >= 0; --rank) {
+			uint64_t card = CARD_BIT(suit, rank);
+			if (others & card) {
+				previous_held = false;
+				continue;
+			} else if (!(legal & card)) {
+				continue;
+			} else if (previous_held) {
+				continue;
+			}
+			previous_held = true;
+
+			int score;
+			if (16 * suit + rank == first_move) {
+				score = 1000;
+			} else if (16 * suit + rank == killer) {
+				score = 900;
+			} else if (packed->trick_position == 0) {
+				// Winners first, then low to partner's winners,
+				// then low from long suits.
+				int above = SUIT_CARDS(others, suit) >> rank;
+				if (above == 0) {
+					score = 200 + length;
+				} else if (SUIT_CARDS(partners, suit) >> rank & (1 << (31 -
+						__builtin_clz(above)))) {
+					score = 150 - rank;
+				} else {
+					score = 50 + 4 * length - rank;
+				}
+			} else if (packed_is_strongest_card_played(
+						packed, suit, rank)) {
+				score = partner_winning ? -rank : 100 - rank;
+			} else {
+				score = 50 - rank;
+			}
+			int i = num_moves++;
+			for (; i > 0 && scores[i - 1] < score; --i) {
+				scores[i] = scores[i - 1];
+				moves[i] = moves[i - 1];
+			}
+			scores[i] = score;
+			moves[i] = 16 * suit + rank;
+		}
+	}
+	return num_moves;
+}
+
+// Fail-soft alpha-beta: the result is exact if it lies strictly inside
+// (alpha, beta), and otherwise a bound on the same side. trick_cards are
+// the cards played to the trick in progress. Sets relevant to the lowest
+// rank in each suit that the result depends on.
+static int dd_search(DDSolver *solver, PackedState *packed,
+		int alpha, int beta, uint64_t trick_cards, int8_t *relevant) {
+	solver->nodes++;
+	clear_relevant(relevant);
+	int remaining = __builtin_popcountll(
+			remaining_cards(packed, packed->next_to_act));
+	if (packed->stage != STAGE_PLAY || remaining == 0) {
+		return 0;
+	} else if (alpha >= remaining) {
+		return remaining;
+	} else if (beta <= 0) {
+		return 0;
+	}
+
+	DDKey key;
+	int first_move = NA;
+	if (packed->trick_position == 1 && dd_second_hand_wins(packed, relevant)) {
+		if (packed->next_to_act % 2 == 0 && beta <= 1) {
+			return 1;
+		} else if (packed->next_to_act % 2 == 1 &&
+				remaining - 1 <= alpha) {
+			return remaining - 1;
+		}
+		clear_relevant(relevant);
+	}
+	if (packed->trick_position == 0) {
+		int8_t quick_relevant[4];
+		int8_t ns_relevant[4];
+		int8_t ew_relevant[4];
+		int quick = dd_quick_tricks(packed, quick_relevant);
+		int lower = dd_trump_tricks(packed, 0, ns_relevant);
+		int upper = remaining - dd_trump_tricks(packed, 1, ew_relevant);
+		if (packed->next_to_act % 2 == 0 && quick > lower) {
+			lower = quick;
+			memcpy(ns_relevant, quick_relevant, 4);
+		} else if (packed->next_to_act % 2 == 1 &&
+				remaining - quick < upper) {
+			upper = remaining - quick;
+			memcpy(ew_relevant, quick_relevant, 4);
+		}
+		int8_t loses_relevant[4];
+		if (dd_loses_trick(packed, loses_relevant)) {
+			if (packed->next_to_act % 2 == 0 &&
+					remaining - 1 < upper) {
+				upper = remaining - 1;
+				memcpy(ew_relevant, loses_relevant, 4);
+			} else if (packed->next_to_act % 2 == 1 && 1 > lower) {
+				lower = 1;
+				memcpy(ns_relevant, loses_relevant, 4);
+			}
+		}
+		if (lower >= beta) {
+			memcpy(relevant, ns_relevant, 4);
+			return lower;
+		} else if (upper <= alpha) {
+			memcpy(relevant, ew_relevant, 4);
+			return upper;
+		}
+
+		dd_key(packed, &key);
+		DDEntry *bucket = dd_bucket(solver, &key);
+		for (int i = 0; i < DD_BUCKET_SIZE; ++i) {
+			DDEntry *entry = &bucket[i];
+			if (!dd_matches(entry, &key)) {
+				continue;
+			}
+			if (entry->lower >= beta || entry->upper <= alpha ||
+					entry->lower == entry->upper) {
+				clear_relevant(relevant);
+				dd_entry_relevant(entry, &key, relevant);
+				return entry->lower >= beta ||
+					entry->lower == entry->upper ?
+					entry->lower : entry->upper;
+			}
+			if (entry->lower > alpha || entry->upper < beta) {
+				dd_entry_relevant(entry, &key, relevant);
+				alpha = alpha > entry->lower ? alpha : entry->lower;
+				beta = beta < entry->upper ? beta : entry->upper;
+				if (alpha >= beta) {
+					return alpha;
+				}
+			}
+			if (first_move == NA && entry->best_move != NA &&
+					entry->best_move % 16 <
+					key.num_cards[entry->best_move / 16]) {
+				int suit = entry->best_move / 16;
+				first_move = 16 * suit +
+					key.ranks[suit][entry->best_move % 16];
+			}
+		}
+	}
+
+	int8_t moves[13];
+	int num_moves = dd_moves(packed, first_move,
+			packed->trick_position == 0 ? solver->killers[remaining] : NA,
+			moves);
+	bool maximize = packed->next_to_act % 2 == 0;
+	int best = maximize ? -1 : remaining + 1;
+	int best_move = NA;
+	int a = alpha;
+	int b = beta;
+	int8_t window_relevant[4];
+	memcpy(window_relevant, relevant, 4);
+	// Below low_cards[suit], a card is worth the same as the one searched.
+	int8_t low_cards[4] = {0, 0, 0, 0};
+	for (int i = 0; i < num_moves; ++i) {
+		int suit = moves[i] / 16;
+		int rank = moves[i] % 16;
+		if (rank < low_cards[suit]) {
+			continue;
+		}
+		// The trick winner, which play clears at the end of a trick.
+		int winning_suit = packed->trick_winning_suit;
+		int winning_rank = packed->trick_winning_rank;
+		if (packed_is_strongest_card_played(packed, suit, rank)) {
+			winning_suit = suit;
+			winning_rank = rank;
+		}
+		PackedState child = *packed;
+		packed_play_card(&child, suit, rank);
+		uint64_t child_trick_cards = trick_cards | CARD_BIT(suit, rank);
+		int won = ns_tricks(&child) - ns_tricks(packed);
+		int8_t child_relevant[4];
+		int value = won + dd_search(solver, &child, a - won, b - won,
+				packed->trick_position == 3 ? 0 : child_trick_cards,
+				child_relevant);
+		if (packed->trick_position == 3 && __builtin_popcount(
+				SUIT_CARDS(child_trick_cards, winning_suit)) > 1) {
+			add_relevant(child_relevant, winning_suit, winning_rank);
+		}
+		if (maximize ? value > best : value < best) {
+			best = value;
+			best_move = moves[i];
+		}
+		// A cutoff depends only on the move that caused it.
+		if (maximize ? best >= beta : best <= alpha) {
+			if (packed->trick_position == 0) {
+				solver->killers[remaining] = moves[i];
+			}
+			memcpy(relevant, child_relevant, 4);
+			merge_relevant(relevant, window_relevant);
+			break;
+		}
+		merge_relevant(relevant, child_relevant);
+		if (low_cards[suit] == 0 && rank < relevant[suit]) {
+			low_cards[suit] = relevant[suit];
+		}
+		if (maximize) {
+			a = best > a ? best : a;
+		} else {
+			b = best < b ? best : b;
+		}
+	}
+
+	if (packed->trick_position == 0) {
+		int suit = best_move / 16;
+		int n = 0;
+		while (key.ranks[suit][n] != best_move % 16) {
+			++n;
+		}
+		dd_store(solver, &key, relevant,
+				best > alpha ? best : 0,
+				best < beta ? best : remaining,
+				16 * suit + n);
+	}
+	return best;
+}
+
+// North-South tricks from the remaining cards, by null window searches
+// starting from a guess (MTD(f)).
+static int dd_solve_ns(DDSolver *solver, PackedState *packed, int guess) {
+	int lower = 0;
+	int upper = __builtin_popcountll(
+			remaining_cards(packed, packed->next_to_act));
+	int value = guess < upper ? guess : upper;
+	while (lower < upper) {
+		int target = value == lower ? value + 1 : value;
+		int8_t relevant[4];
+		value = dd_search(solver, packed, target - 1, target,
+				0, relevant);
+		if (value >= target) {
+			lower = value;
+		} else {
+			upper = value;
+		}
+	}
+	return lower;
+}
+
+// Tricks for the declaring side of packed, given ns further tricks for
+// North-South.
+static int declarer_tricks(PackedState *packed, int ns) {
+	int remaining = __builtin_popcountll(
+			remaining_cards(packed, packed->next_to_act));
+	if (packed->declarer % 2 == 0) {
+		return ns_tricks(packed) + ns;
+	} else {
+		return packed->tricks_taken[1] + packed->tricks_taken[3] +
+			remaining - ns;
+	}
+}
+
+// Total tricks for the declaring side with perfect play, including tricks
+// already taken, or -1 if packed is not fully dealt in the play stage.
+int double_dummy(DDSolver *solver, PackedState *packed) {
+	if (!dd_is_fully_dealt(packed)) {
+		return -1;
+	}
+	int remaining = __builtin_popcountll(
+			remaining_cards(packed, packed->next_to_act));
+	return declarer_tricks(packed,
+			dd_solve_ns(solver, packed, remaining / 2));
+}
+
+// Fills table[strain][declarer] with the tricks the declaring side takes
+// with perfect play from the opening lead, using the cards of deal.
+// Returns false if deal is not fully dealt. The result for one declarer is
+// the first guess for the next. Notrump goes first, as its table entries
+// also serve the suit contracts once trumps are drawn.
+bool double_dummy_table(DDSolver *solver, PackedState *deal,
+		int8_t table[5][4]) {
+	static const int strains[5] = {4, 0, 1, 2, 3};
+	int ns = 0;
+	for (int i = 0; i < 5; ++i) {
+		int strain = strains[i];
+		for (int declarer = 0; declarer < 4; ++declarer) {
+			PackedState packed = *deal;
+			memset(packed.tricks_taken, 0, 4);
+			packed.stage = STAGE_PLAY;
+			packed.next_to_act = (declarer + 1) % 4;
+			packed.trump = strain;
+			packed.declarer = declarer;
+			packed.trick_suit = NA;
+			packed.trick_position = 0;
+			packed.trick_winning_seat = NA;
+			packed.trick_winning_suit = NA;
+			packed.trick_winning_rank = NA;
+			if (!dd_is_fully_dealt(&packed)) {
+				return false;
+			}
+			if (declarer == 0) {
+				ns = __builtin_popcountll(remaining_cards(
+						&packed, packed.next_to_act)) / 2;
+			}
+			ns = dd_solve_ns(solver, &packed, ns);
+			table[strain][declarer] = declarer_tricks(&packed, ns);
+		}
+	}
+	return true;
+}
+
+// Random playouts.
+//
+// Actions are chosen uniformly from the legal ones, or with weights
+// prior[id] if a prior is given. Once the hands are fully dealt in the play
+// stage, the playout continues on a PackedState.
+
+// splitmix64.
+static uint64_t next_random(uint64_t *rng) {
+	uint64_t z = (*rng += 0x9E3779B97F4A7C15ULL);
+	z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+	z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+	return z ^ (z >> 31);
+}
+
+// A uniform integer in [0, n).
+static int random_below(uint64_t *rng, int n) {
+	return (int) (((next_random(rng) >> 32) * (uint64_t) n) >> 32);
+}
+
+// A uniform double in [0, 1).
+static double random_unit(uint64_t *rng) {
+	return (next_random(rng) >> 11) * (1.0 / 9007199254740992.0);
+}
+
+// The index of a random one of the num_legal true entries of mask, or NA.
+static int random_action_id(uint64_t *rng, bool *mask, int num_legal,
+		double *prior) {
+	if (num_legal == 0) {
+		return NA;
+	}
+	if (prior != NULL) {
+		double total = 0;
+		for (int id = 0; id < NUM_ACTIONS; ++id) {
+			total += mask[id] ? prior[id] : 0;
+		}
+		if (total > 0) {
+			double x = random_unit(rng) * total;
+			int last = NA;
+			for (int id = 0; id < NUM_ACTIONS; ++id) {
+				if (mask[id] && prior[id] > 0) {
+					last = id;
+					x -= prior[id];
+					if (x < 0) {
+						return id;
+					}
+				}
+			}
+			return last;
+		}
+	}
+	int k = random_below(rng, num_legal);
+	for (int id = 0; id < NUM_ACTIONS; ++id) {
+		if (mask[id] && k-- == 0) {
+			return id;
+		}
+	}
+	return NA;
+}
+
+// A random card of cards, as a bit index.
+static int random_card(uint64_t *rng, uint64_t cards, double *prior) {
+	if (prior != NULL) {
+		double total = 0;
+		for (uint64_t rest = cards; rest; rest &= rest - 1) {
+			int bit = __builtin_ctzll(rest);
+			total += prior[38 + 13 * (bit / 16) + bit % 16];
+		}
+		if (total > 0) {
+			double x = random_unit(rng) * total;
+			int last = NA;
+			for (uint64_t rest = cards; rest; rest &= rest - 1) {
+				int bit = __builtin_ctzll(rest);
+				double weight = prior[38 + 13 * (bit / 16) + bit % 16];
+				if (weight > 0) {
+					last = bit;
+					x -= weight;
+					if (x < 0) {
+						return bit;
+					}
+				}
+			}
+			return last;
+		}
+	}
+	for (int k = random_below(rng, __builtin_popcountll(cards)); k > 0; --k) {
+		cards &= cards - 1;
+	}
+	return __builtin_ctzll(cards);
+}
+
+static void random_packed_playout(PackedState *packed, uint64_t *rng,
+		double *prior) {
+	uint64_t cards;
+	while ((cards = packed_legal_cards(packed)) != 0) {
+		int bit = random_card(rng, cards, prior);
+		packed_play_card(packed, bit / 16, bit % 16);
+	}
+}
+
+static bool all_cards_played(GameState *state) {
+	for (int suit = 0; suit < 4; ++suit) {
+		for (int rank = 0; rank < 13; ++rank) {
+			if (!state->played_cards[suit][rank]) {
+				return false;
+			}
+		}
+	}
+	return true;
+}
+
+// Plays state out to the end with random actions. Returns false if an
+// action fails or no action is legal before every card is played, as can
+// happen when hands are partly hidden. Once play moves to a PackedState,
+// only the stage and tricks_taken of state are kept up to date.
+bool random_playout(GameState *state, uint64_t *rng, double *prior) {
+	bool mask[NUM_ACTIONS];
+	HistoryEntry history;
+	while (state->stage == STAGE_BIDDING || state->stage == STAGE_PLAY) {
+		if (state->stage == STAGE_PLAY) {
+			PackedState packed;
+			pack_state(state, &packed);
+			if (dd_is_fully_dealt(&packed)) {
+				random_packed_playout(&packed, rng, prior);
+				state->stage = packed.stage;
+				memcpy(state->tricks_taken, packed.tricks_taken, 4);
+				return true;
+			}
+		}
+		legal_action_mask(state, mask);
+		int num_legal = 0;
+		for (int id = 0; id < NUM_ACTIONS; ++id) {
+			num_legal += mask[id];
+		}
+		int8_t id = random_action_id(rng, mask, num_legal, prior);
+		if (id == NA) {
+			return state->stage == STAGE_PLAY && all_cards_played(state);
+		}
+		if (execute_action_ids(state, 1, &id, &history, NULL) != 1) {
+			return false;
+		}
+	}
+	return state->stage != STAGE_ERROR;
+}
+
+// Runs n playouts of state. tricks[i] gets tricks_taken and contracts[i]
+// the level, strain, declarer and double of the final contract, with NA for
+// a passed out deal; both rows are NA for a failed playout.
+void random_playouts(GameState *state, int n, uint64_t seed, double *prior,
+		int8_t (*tricks)[4], int8_t (*contracts)[4]) {
+	uint64_t rng = seed;
+	PackedState packed;
+	pack_state(state, &packed);
+	bool fully_dealt = dd_is_fully_dealt(&packed);
+	for (int i = 0; i < n; ++i) {
+		GameState playout;
+		GameState *final = state;
+		if (fully_dealt) {
+			PackedState packed_playout = packed;
+			random_packed_playout(&packed_playout, &rng, prior);
+			memcpy(tricks[i], packed_playout.tricks_taken, 4);
+		} else {
+			playout = *state;
+			final = &playout;
+			if (!random_playout(&playout, &rng, prior)) {
+				memset(tricks[i], NA, 4);
+				memset(contracts[i], NA, 4);
+				continue;
+			}
+			memcpy(tricks[i], playout.tricks_taken, 4);
+		}
+		contracts[i][0] = final->last_bid_level;
+		contracts[i][1] = final->last_bid_strain;
+		contracts[i][2] = final->declarer;
+		contracts[i][3] = final->last_bid_double;
+		if (!final->bidding_is_open) {
+			memset(contracts[i], NA, 4);
+		}
+	}
+}
+
+// Deals consistent with a partial view of the hands: the cards in no seat's
+// dealt_cards and not played are dealt out, so that every seat holds 13
+// cards and every length lies within min_length and max_length. Shapes are
+// drawn first, weighted by the number of deals having them, and then the
+// cards of each suit are shuffled into their shape, so every consistent
+// deal is equally likely however tight the bounds are.
+
+// The number of states of the cards still needed by each seat, 0-13.
+#define NEED_STATES (14 * 14 * 14 * 14)
+
+typedef struct DealSampler {
+	int8_t lower[4][4];       // suit, seat. Hidden cards to receive.
+	int8_t upper[4][4];       // suit, seat.
+	int8_t hidden[4][13];     // suit, i. The hidden ranks.
+	int8_t num_hidden[4];     // suit.
+	int8_t need[4];           // seat. Hidden cards to receive in all.
+	double factorial[14];
+	// ways[suit][need] is the number of ways to deal suits suit...3 to
+	// seats needing need cards. 0=not computed, -1=none. Zeroed memory
+	// starts out empty without being touched.
+	double (*ways)[NEED_STATES];
+} DealSampler;
+
+static int need_index(int8_t *need) {
+	return need[0] + 14 * (need[1] + 14 * (need[2] + 14 * need[3]));
+}
+
+static double remaining_ways(DealSampler *sampler, int suit, int8_t *need);
+
+// Runs over the splits of the hidden cards of suit among seats that need
+// need[seat] cards. With pick < 0, returns the total ways of the splits.
+// Otherwise stops at the split where the running total exceeds pick, or else
+// the last possible split, and leaves it in split.
+static double split_suit(DealSampler *sampler, int suit, int8_t *need,
+		double pick, int8_t *split) {
+	int8_t *lower = sampler->lower[suit];
+	int8_t *upper = sampler->upper[suit];
+	int8_t rest[4];
+	int8_t n[4];
+	double total = 0;
+	for (n[0] = lower[0]; n[0] <= upper[0] && n[0] <= need[0]; ++n[0]) {
+	for (n[1] = lower[1]; n[1] <= upper[1] && n[1] <= need[1]; ++n[1]) {
+	for (n[2] = lower[2]; n[2] <= upper[2] && n[2] <= need[2]; ++n[2]) {
+		n[3] = sampler->num_hidden[suit] - n[0] - n[1] - n[2];
+		if (n[3] < lower[3] || n[3] > upper[3] || n[3] > need[3]) {
+			continue;
+		}
+		double ways = sampler->factorial[sampler->num_hidden[suit]];
+		for (int seat = 0; seat < 4; ++seat) {
+			rest[seat] = need[seat] - n[seat];
+			ways /= sampler->factorial[n[seat]];
+		}
+		ways *= remaining_ways(sampler, suit + 1, rest);
+		total += ways;
+		if (pick >= 0 && ways > 0) {
+			memcpy(split, n, 4);
+			if (total > pick) {
+				return total;
+			}
+		}
+	}
+	}
+	}
+	return total;
+}
+
+static double remaining_ways(DealSampler *sampler, int suit, int8_t *need) {
+	if (suit == 4) {
+		return need[0] == 0 && need[1] == 0 && need[2] == 0 && need[3] == 0;
+	}
+	double *ways = &sampler->ways[suit][need_index(need)];
+	if (*ways == 0) {
+		*ways = split_suit(sampler, suit, need, -1, NULL);
+		*ways = *ways > 0 ? *ways : -1;
+	}
+	return *ways > 0 ? *ways : 0;
+}
+
+// Returns false if state has no consistent deal.
+static bool deal_sampler_init(DealSampler *sampler, GameState *state) {
+	sampler->factorial[0] = 1;
+	for (int n = 1; n < 14; ++n) {
+		sampler->factorial[n] = sampler->factorial[n - 1] * n;
+	}
+	memset(sampler->num_hidden, 0, 4);
+	for (int suit = 0; suit < 4; ++suit) {
+		for (int rank = 0; rank < 13; ++rank) {
+			bool dealt = state->played_cards[suit][rank];
+			for (int seat = 0; seat < 4; ++seat) {
+				dealt |= state->dealt_cards[seat][suit][rank];
+			}
+			if (!dealt) {
+				int i = sampler->num_hidden[suit]++;
+				sampler->hidden[suit][i] = rank;
+			}
+		}
+	}
+	for (int seat = 0; seat < 4; ++seat) {
+		int num_cards = 0;
+		for (int suit = 0; suit < 4; ++suit) {
+			int num_in_suit = 0;
+			for (int rank = 0; rank < 13; ++rank) {
+				num_in_suit += state->dealt_cards[seat][suit][rank];
+			}
+			int lower = state->min_length[seat][suit] - num_in_suit;
+			int upper = state->max_length[seat][suit] - num_in_suit;
+			if (upper < 0) {
+				return false;
+			}
+			sampler->lower[suit][seat] = lower > 0 ? lower : 0;
+			sampler->upper[suit][seat] = upper;
+			num_cards += num_in_suit;
+		}
+		if (num_cards > 13) {
+			return false;
+		}
+		sampler->need[seat] = 13 - num_cards;
+	}
+	return remaining_ways(sampler, 0, sampler->need) > 0;
+}
+
+static void deal_sampler_sample(DealSampler *sampler, GameState *state,
+		uint64_t *rng, int8_t dealt[4][4][13]) {
+	int8_t need[4];
+	int8_t split[4];
+	memcpy(dealt, state->dealt_cards, sizeof(state->dealt_cards));
+	memcpy(need, sampler->need, 4);
+	for (int suit = 0; suit < 4; ++suit) {
+		double total = remaining_ways(sampler, suit, need);
+		split_suit(sampler, suit, need, random_unit(rng) * total, split);
+		int8_t ranks[13];
+		int num_hidden = sampler->num_hidden[suit];
+		memcpy(ranks, sampler->hidden[suit], num_hidden);
+		int i = 0;
+		for (int seat = 0; seat < 4; ++seat) {
+			for (int k = 0; k < split[seat]; ++k, ++i) {
+				int j = i + random_below(rng, num_hidden - i);
+				int8_t rank = ranks[j];
+				ranks[j] = ranks[i];
+				ranks[i] = rank;
+				dealt[seat][suit][rank] = 1;
+			}
+			need[seat] -= split[seat];
+		}
+	}
+}
+
+// Fills dealt[0...n-1] with random deals consistent with state. Returns 1, or
+// 0 if there are none, or -1 if out of memory.
+int sample_consistent_deals(GameState *state, int n, uint64_t seed,
+		int8_t (*dealt)[4][4][13]) {
+	DealSampler sampler;
+	sampler.ways = calloc(4, sizeof(*sampler.ways));
+	if (sampler.ways == NULL) {
+		return -1;
+	}
+	bool ok = deal_sampler_init(&sampler, state);
+	uint64_t rng = seed;
+	for (int i = 0; ok && i < n; ++i) {
+		deal_sampler_sample(&sampler, state, &rng, dealt[i]);
+	}
+	free(sampler.ways);
+	return ok;
+}
+
+// Information set Monte Carlo tree search of the card play, from the point
+// of view of the seat to act in state: the cards it cannot see are dealt
+// out afresh by a DealSampler for each simulation. Nodes stand for the
+// cards played since the root, so the tree is shared by all the sampled
+// deals, and a child counts as available on the visits to its parent where
+// its card was legal.
+typedef struct SearchTree {
+	int32_t (*children)[52];  // node, 13 * suit + rank. -1=unexpanded.
+	int32_t *visits;          // node.
+	int32_t *available;       // node.
+	// Sum over the visits of the fraction of the remaining tricks taken by
+	// the side that played the card leading to the node.
+	double *rewards;          // node.
+	int num_nodes;
+	int max_nodes;
+} SearchTree;
+
+static void packed_deal(PackedState *packed, int8_t dealt[4][4][13]) {
+	for (int seat = 0; seat < 4; ++seat) {
+		uint64_t cards = 0;
+		for (int suit = 0; suit < 4; ++suit) {
+			for (int rank = 0; rank < 13; ++rank) {
+				if (dealt[seat][suit][rank]) {
+					cards |= CARD_BIT(suit, rank);
+				}
+			}
+		}
+		packed->dealt_cards[seat] = cards;
+	}
+}
+
+static int new_search_node(SearchTree *tree) {
+	int node = tree->num_nodes++;
+	memset(tree->children[node], NA, sizeof(tree->children[node]));
+	tree->visits[node] = 0;
+	tree->available[node] = 0;
+	tree->rewards[node] = 0;
+	return node;
+}
+
+// The card of cards, as a bit index, of the child of node with the highest
+// upper confidence bound.
+static int select_card(SearchTree *tree, int node, uint64_t cards,
+		double exploration) {
+	int best = NA;
+	double best_bound = -1;
+	for (; cards; cards &= cards - 1) {
+		int bit = __builtin_ctzll(cards);
+		int child = tree->children[node][13 * (bit / 16) + bit % 16];
+		double visits = tree->visits[child];
+		double bound = tree->rewards[child] / visits + exploration *
+			sqrt(log(tree->available[child]) / visits);
+		if (bound > best_bound) {
+			best = bit;
+			best_bound = bound;
+		}
+	}
+	return best;
+}
+
+static void search_once(SearchTree *tree, PackedState *packed, uint64_t *rng,
+		double exploration) {
+	int path[53];
+	int8_t sides[53];
+	int depth = 0;
+	int root_tricks[2] = {
+		packed->tricks_taken[0] + packed->tricks_taken[2],
+		packed->tricks_taken[1] + packed->tricks_taken[3],
+	};
+	int remaining = (__builtin_popcountll(~packed->played_cards & ALL_CARDS) +
+			packed->trick_position + 3) / 4;
+	int node = 0;
+	uint64_t cards;
+	path[depth++] = node;
+	while ((cards = packed_legal_cards(packed)) != 0) {
+		uint64_t untried = 0;
+		for (uint64_t rest = cards; rest; rest &= rest - 1) {
+			int bit = __builtin_ctzll(rest);
+			int child = tree->children[node][13 * (bit / 16) + bit % 16];
+			if (child == NA) {
+				untried |= 1ULL << bit;
+			} else {
+				++tree->available[child];
+			}
+		}
+		int bit;
+		if (untried && tree->num_nodes < tree->max_nodes) {
+			bit = random_card(rng, untried, NULL);
+			int child = new_search_node(tree);
+			tree->children[node][13 * (bit / 16) + bit % 16] = child;
+			tree->available[child] = 1;
+		} else if (untried != cards) {
+			bit = select_card(tree, node, cards & ~untried, exploration);
+		} else {
+			break;
+		}
+		sides[depth] = packed->next_to_act % 2;
+		node = tree->children[node][13 * (bit / 16) + bit % 16];
+		path[depth++] = node;
+		packed_play_card(packed, bit / 16, bit % 16);
+		if (tree->visits[node] == 0) {
+			break;
+		}
+	}
+	random_packed_playout(packed, rng, NULL);
+
+	double rewards[2] = {0, 0};
+	if (remaining > 0) {
+		for (int side = 0; side < 2; ++side) {
+			rewards[side] = (double) (packed->tricks_taken[side] +
+					packed->tricks_taken[side + 2] -
+					root_tricks[side]) / remaining;
+		}
+	}
+	++tree->visits[0];
+	for (int i = 1; i < depth; ++i) {
+		++tree->visits[path[i]];
+		tree->rewards[path[i]] += rewards[sides[i]];
+	}
+}
+
+// Runs n simulations from state on tree, which is empty or was grown from
+// the same state. Returns the number of nodes of the tree, or NA if no
+// deal is consistent with state, or -2 if out of memory.
+int search_tree(GameState *state, SearchTree *tree, int n, uint64_t seed,
+		double exploration) {
+	DealSampler sampler;
+	sampler.ways = calloc(4, sizeof(*sampler.ways));
+	if (sampler.ways == NULL) {
+		return -2;
+	}
+	if (!deal_sampler_init(&sampler, state)) {
+		free(sampler.ways);
+		return NA;
+	}
+	if (tree->num_nodes == 0) {
+		new_search_node(tree);
+	}
+	PackedState root;
+	pack_state(state, &root);
+	uint64_t rng = seed;
+	for (int i = 0; i < n; ++i) {
+		int8_t dealt[4][4][13];
+		PackedState packed = root;
+		deal_sampler_sample(&sampler, state, &rng, dealt);
+		packed_deal(&packed, dealt);
+		search_once(tree, &packed, &rng, exploration);
+	}
+	free(sampler.ways);
+	return tree->num_nodes;
+}
+
+// n, error = fastgame.execute_action_ids(vector, ids, history[, undo_records])
+// undo_records, if given, is (len(ids), UNDO_RECORD_SIZE) int16.
+PyObject* wrap_execute_action_ids(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *ids_obj = NULL;
+	PyObject *history_obj = NULL;
+	PyObject *undo_obj = Py_None;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *ids = NULL;
+	PyArrayObject *history = NULL;
+	PyArrayObject *undo = NULL;
+	GameState *state;
+	int num_ids;
+	int8_t *ids0;
+	HistoryEntry *history00;
+	UndoRecord *undo0 = NULL;
+	int n;
+
+	if (!PyArg_ParseTuple(args, "OOO|O",
+				&vector_obj, &ids_obj, &history_obj, &undo_obj))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
+	ids = (PyArrayObject*) PyArray_FROM_OTF(
+			ids_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	history = (PyArrayObject*) PyArray_FROM_OTF(
+			history_obj, NPY_INT8, NPY_ARRAY_OUT_ARRAY);
+	if (vector == NULL || ids == NULL || history == NULL)
+		goto fail;
+	if (undo_obj != Py_None) {
+		undo = (PyArrayObject*) PyArray_FROM_OTF(
+				undo_obj, NPY_INT16, NPY_ARRAY_INOUT_ARRAY2);
+		if (undo == NULL)
+			goto fail;
+	}
+
+	if (
+		       	PyArray_NDIM(vector) != 1 ||
+		       	PyArray_NDIM(ids) != 1 ||
+		       	PyArray_NDIM(history) != 2 ||
+		       	PyArray_DIMS(vector)[0] != STATE_SIZE ||
+		       	PyArray_DIMS(history)[1] != 2) {
+		PyErr_SetString(PyExc_ValueError, "hi");
+		goto fail;
+	}
+	num_ids = PyArray_DIMS(ids)[0];
+	if (PyArray_DIMS(history)[0] < num_ids || (undo != NULL && (
+			PyArray_NDIM(undo) != 2 ||
+			PyArray_DIMS(undo)[0] < num_ids ||
+			PyArray_DIMS(undo)[1] != UNDO_RECORD_SIZE))) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected history and undo_records for each id");
+		goto fail;
+	}
+
+	state = (GameState*) PyArray_GETPTR1(vector, 0);
+	ids0 = (int8_t*) PyArray_GETPTR1(ids, 0);
+	history00 = (HistoryEntry*) PyArray_GETPTR2(history, 0, 0);
+	if (undo != NULL)
+		undo0 = (UndoRecord*) PyArray_DATA(undo);
+
+	n = execute_action_ids(state, num_ids, ids0, history00, undo0);
+
+	PyArray_ResolveWritebackIfCopy(vector);
+	Py_DECREF(vector);
+	Py_DECREF(ids);
+	PyArray_ResolveWritebackIfCopy(history);
+	Py_DECREF(history);
+	if (undo != NULL) {
+		PyArray_ResolveWritebackIfCopy(undo);
+		Py_DECREF(undo);
+	}
+	return Py_BuildValue("iz", n, g_error_message);
+
+fail:
+	PyArray_DiscardWritebackIfCopy(vector);
+	Py_XDECREF(vector);
+	Py_XDECREF(ids);
+	PyArray_DiscardWritebackIfCopy(history);
+	Py_XDECREF(history);
+	if (undo != NULL)
+		PyArray_DiscardWritebackIfCopy(undo);
+	Py_XDECREF(undo);
+	return NULL;
+}
+
+// fastgame.undo_action(vector, history_entry, undo_record)
+// Raises ValueError, leaving vector unchanged, if the record cannot be
+// applied to vector.
+PyObject* wrap_undo_action(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *entry_obj = NULL;
+	PyObject *undo_obj = NULL;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *entry = NULL;
+	PyArrayObject *undo = NULL;
+	bool ok;
+
+	if (!PyArg_ParseTuple(args, "OOO", &vector_obj, &entry_obj, &undo_obj))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
+	entry = (PyArrayObject*) PyArray_FROM_OTF(
+			entry_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	undo = (PyArrayObject*) PyArray_FROM_OTF(
+			undo_obj, NPY_INT16, NPY_ARRAY_IN_ARRAY);
+	if (vector == NULL || entry == NULL || undo == NULL)
+		goto fail;
+
+	if (
+			PyArray_NDIM(vector) != 1 ||
+			PyArray_NDIM(entry) != 1 ||
+			PyArray_NDIM(undo) != 1 ||
+			PyArray_DIMS(vector)[0] != STATE_SIZE ||
+			PyArray_DIMS(entry)[0] != 2 ||
+			PyArray_DIMS(undo)[0] != UNDO_RECORD_SIZE) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,), (2,), (UNDO_RECORD_SIZE,)");
+		goto fail;
+	}
+
+	ok = undo_action(
+			(GameState*) PyArray_DATA(vector),
+			(HistoryEntry*) PyArray_DATA(entry),
+			(UndoRecord*) PyArray_DATA(undo));
+	if (!ok) {
+		PyErr_SetString(PyExc_ValueError,
+				"undo record does not match state");
+		goto fail;
+	}
+
+	PyArray_ResolveWritebackIfCopy(vector);
+	Py_DECREF(vector);
+	Py_DECREF(entry);
+	Py_DECREF(undo);
+	Py_INCREF(Py_None);
+	return Py_None;
+
+fail:
+	PyArray_DiscardWritebackIfCopy(vector);
+	Py_XDECREF(vector);
+	Py_XDECREF(entry);
+	Py_XDECREF(undo);
+	return NULL;
+}
+
+// counts, errors = fastgame.execute_action_ids_batch(
+//         vectors, ids, histories)
+PyObject* wrap_execute_action_ids_batch(PyObject *unused_self, PyObject* args) {
+	PyObject *vectors_obj = NULL;
+	PyObject *ids_obj = NULL;
+	PyObject *histories_obj = NULL;
+	PyArrayObject *vectors = NULL;
+	PyArrayObject *ids = NULL;
+	PyArrayObject *histories = NULL;
+	PyArrayObject *counts = NULL;
+	PyArrayObject *errors = NULL;
+	npy_intp num_states;
+
+	if (!PyArg_ParseTuple(args, "OOO",
+				&vectors_obj, &ids_obj, &histories_obj))
+		return NULL;
+	vectors = (PyArrayObject*) PyArray_FROM_OTF(
+			vectors_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
+	ids = (PyArrayObject*) PyArray_FROM_OTF(
+			ids_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	histories = (PyArrayObject*) PyArray_FROM_OTF(
+			histories_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
+	if (vectors == NULL || ids == NULL || histories == NULL)
+		goto fail;
+
+	if (
+			PyArray_NDIM(vectors) != 2 ||
+			PyArray_NDIM(ids) != 2 ||
+			PyArray_NDIM(histories) != 3 ||
+			PyArray_DIMS(vectors)[1] != STATE_SIZE ||
+			PyArray_DIMS(ids)[0] != PyArray_DIMS(vectors)[0] ||
+			PyArray_DIMS(histories)[0] != PyArray_DIMS(vectors)[0] ||
+			PyArray_DIMS(histories)[1] != PyArray_DIMS(ids)[1] ||
+			PyArray_DIMS(histories)[2] != 2) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (N, STATE_SIZE), (N, K), (N, K, 2)");
+		goto fail;
+	}
+
+	num_states = PyArray_DIMS(vectors)[0];
+	counts = (PyArrayObject*) PyArray_SimpleNew(1, &num_states, NPY_INT32);
+	errors = (PyArrayObject*) PyArray_SimpleNew(1, &num_states, NPY_INT8);
+	if (counts == NULL || errors == NULL)
+		goto fail;
+
+	execute_action_ids_batch(
+			(GameState*) PyArray_DATA(vectors), num_states,
+			PyArray_DIMS(ids)[1], (int8_t*) PyArray_DATA(ids),
+			(HistoryEntry*) PyArray_DATA(histories),
+			(int32_t*) PyArray_DATA(counts),
+			(int8_t*) PyArray_DATA(errors));
+
+	PyArray_ResolveWritebackIfCopy(vectors);
+	Py_DECREF(vectors);
+	Py_DECREF(ids);
+	PyArray_ResolveWritebackIfCopy(histories);
+	Py_DECREF(histories);
+	return Py_BuildValue("NN", counts, errors);
+
+fail:
+	PyArray_DiscardWritebackIfCopy(vectors);
+	Py_XDECREF(vectors);
+	Py_XDECREF(ids);
+	PyArray_DiscardWritebackIfCopy(histories);
+	Py_XDECREF(histories);
+	Py_XDECREF(counts);
+	Py_XDECREF(errors);
+	return NULL;
+}
+
+// Number of rows in a (width,) array or an (N, width) batch; -1 otherwise.
+static npy_intp batch_size(PyArrayObject *array, npy_intp width) {
+	if (PyArray_NDIM(array) == 1 && PyArray_DIMS(array)[0] == width) {
+		return 1;
+	} else if (PyArray_NDIM(array) == 2 && PyArray_DIMS(array)[1] == width) {
+		return PyArray_DIMS(array)[0];
+	}
+	return -1;
+}
+
+// fastgame.rehash(vector)
+// Also accepts a batch of vectors (N, STATE_SIZE).
+PyObject* wrap_rehash(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyArrayObject *vector = NULL;
+	npy_intp num_states;
+
+	if (!PyArg_ParseTuple(args, "O", &vector_obj))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
+	if (vector == NULL)
+		return NULL;
+
+	num_states = batch_size(vector, STATE_SIZE);
+	if (num_states < 0) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,) or (N, STATE_SIZE)");
+		PyArray_DiscardWritebackIfCopy(vector);
+		Py_DECREF(vector);
+		return NULL;
+	}
+	for (npy_intp i = 0; i < num_states; ++i) {
+		rehash(&((GameState*) PyArray_DATA(vector))[i]);
+	}
+
+	PyArray_ResolveWritebackIfCopy(vector);
+	Py_DECREF(vector);
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+// fastgame.legal_action_mask(vector, out)
+// Also accepts a batch: vectors (N, STATE_SIZE), out (N, NUM_ACTIONS).
+PyObject* wrap_legal_action_mask(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *mask_obj = NULL;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *mask = NULL;
+	npy_intp num_states;
+
+	if (!PyArg_ParseTuple(args, "OO", &vector_obj, &mask_obj))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	mask = (PyArrayObject*) PyArray_FROM_OTF(
+			mask_obj, NPY_BOOL, NPY_ARRAY_OUT_ARRAY);
+	if (vector == NULL || mask == NULL)
+		goto fail;
+
+	num_states = batch_size(vector, STATE_SIZE);
+	if (num_states < 0 || PyArray_NDIM(mask) != PyArray_NDIM(vector) ||
+			batch_size(mask, NUM_ACTIONS) != num_states) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,), (NUM_ACTIONS,) or batches");
+		goto fail;
+	}
+
+	for (npy_intp i = 0; i < num_states; ++i) {
+		legal_action_mask(
+				&((GameState*) PyArray_DATA(vector))[i],
+				&((bool*) PyArray_DATA(mask))[i * NUM_ACTIONS]);
+	}
+
+	Py_DECREF(vector);
+	PyArray_ResolveWritebackIfCopy(mask);
+	Py_DECREF(mask);
+	Py_INCREF(Py_None);
+	return Py_None;
+
+fail:
+	Py_XDECREF(vector);
+	PyArray_DiscardWritebackIfCopy(mask);
+	Py_XDECREF(mask);
+	return NULL;
+}
+
+// fastgame.pack_state(vector, packed)
+// Also accepts a batch: vectors (N, STATE_SIZE), packed (N, PACKED_STATE_SIZE).
+PyObject* wrap_pack_state(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *packed_obj = NULL;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *packed = NULL;
+	npy_intp num_states;
+
+	if (!PyArg_ParseTuple(args, "OO", &vector_obj, &packed_obj))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	packed = (PyArrayObject*) PyArray_FROM_OTF(
+			packed_obj, NPY_UINT8, NPY_ARRAY_OUT_ARRAY);
+	if (vector == NULL || packed == NULL)
+		goto fail;
+
+	num_states = batch_size(vector, STATE_SIZE);
+	if (num_states < 0 || PyArray_NDIM(packed) != PyArray_NDIM(vector) ||
+			batch_size(packed, PACKED_STATE_SIZE) != num_states) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,), (PACKED_STATE_SIZE,) or batches");
+		goto fail;
+	}
+
+	for (npy_intp i = 0; i < num_states; ++i) {
+		pack_state(
+				&((GameState*) PyArray_DATA(vector))[i],
+				&((PackedState*) PyArray_DATA(packed))[i]);
+	}
+
+	Py_DECREF(vector);
+	PyArray_ResolveWritebackIfCopy(packed);
+	Py_DECREF(packed);
+	Py_INCREF(Py_None);
+	return Py_None;
+
+fail:
+	Py_XDECREF(vector);
+	PyArray_DiscardWritebackIfCopy(packed);
+	Py_XDECREF(packed);
+	return NULL;
+}
+
+// fastgame.packed_legal_action_mask(packed, out)
+// Also accepts a batch: packed (N, PACKED_STATE_SIZE), out (N, NUM_ACTIONS).
+PyObject* wrap_packed_legal_action_mask(PyObject *unused_self, PyObject* args) {
+	PyObject *packed_obj = NULL;
+	PyObject *mask_obj = NULL;
+	PyArrayObject *packed = NULL;
+	PyArrayObject *mask = NULL;
+	npy_intp num_states;
+
+	if (!PyArg_ParseTuple(args, "OO", &packed_obj, &mask_obj))
+		return NULL;
+	packed = (PyArrayObject*) PyArray_FROM_OTF(
+			packed_obj, NPY_UINT8, NPY_ARRAY_IN_ARRAY);
+	mask = (PyArrayObject*) PyArray_FROM_OTF(
+			mask_obj, NPY_BOOL, NPY_ARRAY_OUT_ARRAY);
+	if (packed == NULL || mask == NULL)
+		goto fail;
+
+	num_states = batch_size(packed, PACKED_STATE_SIZE);
+	if (num_states < 0 || PyArray_NDIM(mask) != PyArray_NDIM(packed) ||
+			batch_size(mask, NUM_ACTIONS) != num_states) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (PACKED_STATE_SIZE,), (NUM_ACTIONS,) or batches");
+		goto fail;
+	}
+
+	for (npy_intp i = 0; i < num_states; ++i) {
+		uint64_t cards = packed_legal_cards(
+				&((PackedState*) PyArray_DATA(packed))[i]);
+		bool *row = &((bool*) PyArray_DATA(mask))[i * NUM_ACTIONS];
+		memset(row, 0, NUM_ACTIONS * sizeof(bool));
+		for (int suit = 0; suit < 4; ++suit) {
+			for (int rank = 0; rank < 13; ++rank) {
+				row[38 + 13 * suit + rank] =
+					(cards & CARD_BIT(suit, rank)) != 0;
+			}
+		}
+	}
+
+	Py_DECREF(packed);
+	PyArray_ResolveWritebackIfCopy(mask);
+	Py_DECREF(mask);
+	Py_INCREF(Py_None);
+	return Py_None;
+
+fail:
+	Py_XDECREF(packed);
+	PyArray_DiscardWritebackIfCopy(mask);
+	Py_XDECREF(mask);
+	return NULL;
+}
+
+// n, err = fastgame.execute_packed_action_ids(packed, ids)
+PyObject* wrap_execute_packed_action_ids(PyObject *unused_self, PyObject* args) {
+	PyObject *packed_obj = NULL;
+	PyObject *ids_obj = NULL;
+	PyArrayObject *packed = NULL;
+	PyArrayObject *ids = NULL;
+	int n;
+
+	if (!PyArg_ParseTuple(args, "OO", &packed_obj, &ids_obj))
+		return NULL;
+	packed = (PyArrayObject*) PyArray_FROM_OTF(
+			packed_obj, NPY_UINT8, NPY_ARRAY_INOUT_ARRAY2);
+	ids = (PyArrayObject*) PyArray_FROM_OTF(
+			ids_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	if (packed == NULL || ids == NULL)
+		goto fail;
+
+	if (batch_size(packed, PACKED_STATE_SIZE) != 1 ||
+			PyArray_NDIM(packed) != 1 ||
+			PyArray_NDIM(ids) != 1) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (PACKED_STATE_SIZE,), (K,)");
+		goto fail;
+	}
+
+	g_error_code = ERR_NONE;
+	n = execute_packed_action_ids(
+			(PackedState*) PyArray_DATA(packed),
+			PyArray_DIMS(ids)[0], (int8_t*) PyArray_DATA(ids));
+
+	PyArray_ResolveWritebackIfCopy(packed);
+	Py_DECREF(packed);
+	Py_DECREF(ids);
+	return Py_BuildValue("iz", n, error_messages[g_error_code]);
+
+fail:
+	PyArray_DiscardWritebackIfCopy(packed);
+	Py_XDECREF(packed);
+	Py_XDECREF(ids);
+	return NULL;
+}
+
+// tricks = fastgame.double_dummy(packed)
+// Raises ValueError unless packed is fully dealt and in the play stage.
+PyObject* wrap_double_dummy(PyObject *unused_self, PyObject* args) {
+	PyObject *packed_obj = NULL;
+	PyArrayObject *packed = NULL;
+	PackedState state;
+	DDSolver solver;
+	int tricks;
+
+	if (!PyArg_ParseTuple(args, "O", &packed_obj))
+		return NULL;
+	packed = (PyArrayObject*) PyArray_FROM_OTF(
+			packed_obj, NPY_UINT8, NPY_ARRAY_IN_ARRAY);
+	if (packed == NULL)
+		return NULL;
+	if (batch_size(packed, PACKED_STATE_SIZE) != 1 ||
+			PyArray_NDIM(packed) != 1) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (PACKED_STATE_SIZE,)");
+		Py_DECREF(packed);
+		return NULL;
+	}
+	memcpy(&state, PyArray_DATA(packed), sizeof(state));
+	Py_DECREF(packed);
+
+	if (!dd_init(&solver, DD_TABLE_LOG2_SIZE)) {
+		dd_free(&solver);
+		return PyErr_NoMemory();
+	}
+	Py_BEGIN_ALLOW_THREADS
+	tricks = double_dummy(&solver, &state);
+	Py_END_ALLOW_THREADS
+	dd_free(&solver);
+	if (tricks < 0) {
+		PyErr_SetString(PyExc_ValueError,
+				"double dummy needs a fully dealt play stage");
+		return NULL;
+	}
+	return PyLong_FromLong(tricks);
+}
+
+// tables = fastgame.double_dummy_table(packed)
+// tables is (5, 4) int8 for packed (PACKED_STATE_SIZE,), indexed by strain and
+// declarer, or (N, 5, 4) for a batch (N, PACKED_STATE_SIZE). One transposition
+// table serves the whole batch. Only the cards in packed are used.
+PyObject* wrap_double_dummy_table(PyObject *unused_self, PyObject* args) {
+	PyObject *packed_obj = NULL;
+	PyArrayObject *packed = NULL;
+	PyArrayObject *tables = NULL;
+	DDSolver solver = {NULL, 0, 0};
+	npy_intp num_states;
+	npy_intp dims[3] = {0, 5, 4};
+	bool ok = true;
+
+	if (!PyArg_ParseTuple(args, "O", &packed_obj))
+		return NULL;
+	packed = (PyArrayObject*) PyArray_FROM_OTF(
+			packed_obj, NPY_UINT8, NPY_ARRAY_IN_ARRAY);
+	if (packed == NULL)
+		return NULL;
+	num_states = batch_size(packed, PACKED_STATE_SIZE);
+	if (num_states < 0) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (PACKED_STATE_SIZE,) or a batch");
+		Py_DECREF(packed);
+		return NULL;
+	}
+	dims[0] = num_states;
+	if (PyArray_NDIM(packed) == 1) {
+		tables = (PyArrayObject*) PyArray_SimpleNew(2, &dims[1], NPY_INT8);
+	} else {
+		tables = (PyArrayObject*) PyArray_SimpleNew(3, dims, NPY_INT8);
+	}
+	if (tables == NULL || !dd_init(&solver, DD_TABLE_LOG2_SIZE)) {
+		dd_free(&solver);
+		Py_DECREF(packed);
+		Py_XDECREF(tables);
+		return PyErr_NoMemory();
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	for (npy_intp i = 0; i < num_states && ok; ++i) {
+		PackedState state;
+		memcpy(&state, (uint8_t*) PyArray_DATA(packed) +
+				i * PACKED_STATE_SIZE, sizeof(state));
+		ok = double_dummy_table(&solver, &state,
+				&((int8_t (*)[5][4]) PyArray_DATA(tables))[i][0]);
+	}
+	Py_END_ALLOW_THREADS
+	dd_free(&solver);
+	Py_DECREF(packed);
+	if (!ok) {
+		PyErr_SetString(PyExc_ValueError,
+				"double dummy needs every card dealt");
+		Py_DECREF(tables);
+		return NULL;
+	}
+	return (PyObject*) tables;
+}
+
+// tricks, contracts = fastgame.random_playouts(vector, n, seed[, prior])
+// tricks and contracts are (n, 4) int8, as filled in by random_playouts.
+// prior, if given, is (NUM_ACTIONS,) float64 weights.
+PyObject* wrap_random_playouts(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *prior_obj = Py_None;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *prior = NULL;
+	PyArrayObject *tricks = NULL;
+	PyArrayObject *contracts = NULL;
+	GameState state;
+	double *prior0 = NULL;
+	int n;
+	unsigned long long seed;
+	npy_intp dims[2] = {0, 4};
+
+	if (!PyArg_ParseTuple(args, "OiK|O",
+				&vector_obj, &n, &seed, &prior_obj))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	if (vector == NULL)
+		goto fail;
+	if (prior_obj != Py_None) {
+		prior = (PyArrayObject*) PyArray_FROM_OTF(
+				prior_obj, NPY_FLOAT64, NPY_ARRAY_IN_ARRAY);
+		if (prior == NULL)
+			goto fail;
+	}
+
+	if (
+			PyArray_NDIM(vector) != 1 ||
+			PyArray_DIMS(vector)[0] != STATE_SIZE ||
+			n < 0 || (prior != NULL && (
+				PyArray_NDIM(prior) != 1 ||
+				PyArray_DIMS(prior)[0] != NUM_ACTIONS))) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,), n >= 0, (NUM_ACTIONS,)");
+		goto fail;
+	}
+
+	dims[0] = n;
+	tricks = (PyArrayObject*) PyArray_SimpleNew(2, dims, NPY_INT8);
+	contracts = (PyArrayObject*) PyArray_SimpleNew(2, dims, NPY_INT8);
+	if (tricks == NULL || contracts == NULL)
+		goto fail;
+
+	memcpy(&state, PyArray_DATA(vector), sizeof(state));
+	if (prior != NULL)
+		prior0 = (double*) PyArray_DATA(prior);
+	Py_BEGIN_ALLOW_THREADS
+	random_playouts(&state, n, seed, prior0,
+			(int8_t (*)[4]) PyArray_DATA(tricks),
+			(int8_t (*)[4]) PyArray_DATA(contracts));
+	Py_END_ALLOW_THREADS
+
+	Py_DECREF(vector);
+	Py_XDECREF(prior);
+	return Py_BuildValue("NN", tricks, contracts);
+
+fail:
+	Py_XDECREF(vector);
+	Py_XDECREF(prior);
+	Py_XDECREF(tricks);
+	Py_XDECREF(contracts);
+	return NULL;
+}
+
+// dealt = fastgame.sample_consistent_deals(vector, n, seed)
+// dealt is (n, 4, 4, 13) int8, indexed like GameState.dealt_cards.
+PyObject* wrap_sample_consistent_deals(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *dealt = NULL;
+	GameState state;
+	int n;
+	int ok;
+	unsigned long long seed;
+	npy_intp dims[4] = {0, 4, 4, 13};
+
+	if (!PyArg_ParseTuple(args, "OiK", &vector_obj, &n, &seed))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	if (vector == NULL)
+		goto fail;
+
+	if (
+			PyArray_NDIM(vector) != 1 ||
+			PyArray_DIMS(vector)[0] != STATE_SIZE ||
+			n < 0) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,), n >= 0");
+		goto fail;
+	}
+
+	dims[0] = n;
+	dealt = (PyArrayObject*) PyArray_SimpleNew(4, dims, NPY_INT8);
+	if (dealt == NULL)
+		goto fail;
+
+	memcpy(&state, PyArray_DATA(vector), sizeof(state));
+	Py_BEGIN_ALLOW_THREADS
+	ok = sample_consistent_deals(&state, n, seed,
+			(int8_t (*)[4][4][13]) PyArray_DATA(dealt));
+	Py_END_ALLOW_THREADS
+	if (ok < 0) {
+		PyErr_NoMemory();
+		goto fail;
+	} else if (!ok) {
+		PyErr_SetString(PyExc_ValueError, "no consistent deal");
+		goto fail;
+	}
+
+	Py_DECREF(vector);
+	return (PyObject*) dealt;
+
+fail:
+	Py_XDECREF(vector);
+	Py_XDECREF(dealt);
+	return NULL;
+}
+
+// num_nodes = fastgame.search_tree(vector, children, visits, available,
+//     rewards, num_nodes, n, seed, exploration)
+// children is (max_nodes, 52) int32, and the others (max_nodes,).
+PyObject* wrap_search_tree(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *children_obj = NULL;
+	PyObject *visits_obj = NULL;
+	PyObject *available_obj = NULL;
+	PyObject *rewards_obj = NULL;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *children = NULL;
+	PyArrayObject *visits = NULL;
+	PyArrayObject *available = NULL;
+	PyArrayObject *rewards = NULL;
+	GameState state;
+	SearchTree tree;
+	int n;
+	int num_nodes;
+	unsigned long long seed;
+	double exploration;
+	npy_intp max_nodes;
+
+	if (!PyArg_ParseTuple(args, "OOOOOiiKd",
+				&vector_obj, &children_obj, &visits_obj,
+				&available_obj, &rewards_obj, &num_nodes,
+				&n, &seed, &exploration))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	children = (PyArrayObject*) PyArray_FROM_OTF(
+			children_obj, NPY_INT32, NPY_ARRAY_INOUT_ARRAY2);
+	visits = (PyArrayObject*) PyArray_FROM_OTF(
+			visits_obj, NPY_INT32, NPY_ARRAY_INOUT_ARRAY2);
+	available = (PyArrayObject*) PyArray_FROM_OTF(
+			available_obj, NPY_INT32, NPY_ARRAY_INOUT_ARRAY2);
+	rewards = (PyArrayObject*) PyArray_FROM_OTF(
+			rewards_obj, NPY_FLOAT64, NPY_ARRAY_INOUT_ARRAY2);
+	if (vector == NULL || children == NULL || visits == NULL ||
+			available == NULL || rewards == NULL)
+		goto fail;
+
+	max_nodes = PyArray_NDIM(children) == 2 ? PyArray_DIMS(children)[0] : 0;
+	if (
+			PyArray_NDIM(vector) != 1 ||
+			PyArray_DIMS(vector)[0] != STATE_SIZE ||
+			PyArray_NDIM(children) != 2 ||
+			PyArray_DIMS(children)[1] != 52 ||
+			PyArray_NDIM(visits) != 1 ||
+			PyArray_DIMS(visits)[0] != max_nodes ||
+			PyArray_NDIM(available) != 1 ||
+			PyArray_DIMS(available)[0] != max_nodes ||
+			PyArray_NDIM(rewards) != 1 ||
+			PyArray_DIMS(rewards)[0] != max_nodes ||
+			max_nodes < 1 || max_nodes > INT32_MAX ||
+			num_nodes < 0 || num_nodes > max_nodes || n < 0) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,), (max_nodes, 52), "
+				"(max_nodes,) * 3, 0 <= num_nodes <= max_nodes, n >= 0");
+		goto fail;
+	}
+
+	memcpy(&state, PyArray_DATA(vector), sizeof(state));
+	tree.children = (int32_t (*)[52]) PyArray_DATA(children);
+	tree.visits = (int32_t*) PyArray_DATA(visits);
+	tree.available = (int32_t*) PyArray_DATA(available);
+	tree.rewards = (double*) PyArray_DATA(rewards);
+	tree.num_nodes = num_nodes;
+	tree.max_nodes = max_nodes;
+	Py_BEGIN_ALLOW_THREADS
+	num_nodes = search_tree(&state, &tree, n, seed, exploration);
+	Py_END_ALLOW_THREADS
+	if (num_nodes == -2) {
+		PyErr_NoMemory();
+		goto fail;
+	} else if (num_nodes == NA) {
+		PyErr_SetString(PyExc_ValueError, "no consistent deal");
+		goto fail;
+	}
+
+	PyArray_ResolveWritebackIfCopy(children);
+	PyArray_ResolveWritebackIfCopy(visits);
+	PyArray_ResolveWritebackIfCopy(available);
+	PyArray_ResolveWritebackIfCopy(rewards);
+	Py_DECREF(vector);
+	Py_DECREF(children);
+	Py_DECREF(visits);
+	Py_DECREF(available);
+	Py_DECREF(rewards);
+	return PyLong_FromLong(num_nodes);
+
+fail:
+	PyArray_DiscardWritebackIfCopy(children);
+	PyArray_DiscardWritebackIfCopy(visits);
+	PyArray_DiscardWritebackIfCopy(available);
+	PyArray_DiscardWritebackIfCopy(rewards);
+	Py_XDECREF(vector);
+	Py_XDECREF(children);
+	Py_XDECREF(visits);
+	Py_XDECREF(available);
+	Py_XDECREF(rewards);
+	return NULL;
+}
+
+// fastgame.encode_observations(vectors, histories, vulnerable, out)
+// vectors is (N, STATE_SIZE), histories (N, K, 2) int8, vulnerable (N, 2)
+// and out (N, OBSERVATION_SIZE) uint8 or float32. N may be left out of all.
+PyObject* wrap_encode_observations(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *history_obj = NULL;
+	PyObject *vulnerable_obj = NULL;
+	PyObject *out_obj = NULL;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *history = NULL;
+	PyArrayObject *vulnerable = NULL;
+	PyArrayObject *out = NULL;
+	npy_intp num_states;
+	npy_intp history_size;
+	bool as_float;
+
+	if (!PyArg_ParseTuple(args, "OOOO!", &vector_obj, &history_obj,
+				&vulnerable_obj, &PyArray_Type, &out_obj))
+		return NULL;
+	as_float = PyArray_TYPE((PyArrayObject*) out_obj) == NPY_FLOAT32;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	history = (PyArrayObject*) PyArray_FROM_OTF(
+			history_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	vulnerable = (PyArrayObject*) PyArray_FROM_OTF(
+			vulnerable_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	out = (PyArrayObject*) PyArray_FROM_OTF(out_obj,
+			as_float ? NPY_FLOAT32 : NPY_UINT8, NPY_ARRAY_INOUT_ARRAY2);
+	if (vector == NULL || history == NULL || vulnerable == NULL ||
+			out == NULL)
+		goto fail;
+
+	num_states = batch_size(vector, STATE_SIZE);
+	history_size = PyArray_NDIM(history) >= 2 ?
+		PyArray_DIMS(history)[PyArray_NDIM(history) - 2] : -1;
+	if (num_states < 0 ||
+			PyArray_NDIM(history) != PyArray_NDIM(vector) + 1 ||
+			PyArray_DIMS(history)[PyArray_NDIM(history) - 1] != 2 ||
+			(PyArray_NDIM(history) == 3 &&
+			 PyArray_DIMS(history)[0] != num_states) ||
+			PyArray_NDIM(vulnerable) != PyArray_NDIM(vector) ||
+			batch_size(vulnerable, 2) != num_states ||
+			PyArray_NDIM(out) != PyArray_NDIM(vector) ||
+			batch_size(out, OBSERVATION_SIZE) != num_states) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (STATE_SIZE,), (K, 2), (2,), "
+				"(OBSERVATION_SIZE,) or batches");
+		goto fail;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	for (npy_intp i = 0; i < num_states; ++i) {
+		uint8_t features[OBSERVATION_SIZE];
+		uint8_t *row = as_float ? features :
+			&((uint8_t*) PyArray_DATA(out))[i * OBSERVATION_SIZE];
+		encode_observation(
+				&((GameState*) PyArray_DATA(vector))[i],
+				&((HistoryEntry*) PyArray_DATA(history))[
+					i * history_size],
+				history_size,
+				&((int8_t*) PyArray_DATA(vulnerable))[2 * i],
+				row);
+		if (as_float) {
+			float *floats = &((float*) PyArray_DATA(out))[
+				i * OBSERVATION_SIZE];
+			for (int j = 0; j < OBSERVATION_SIZE; ++j) {
+				floats[j] = features[j];
+			}
+		}
+	}
+	Py_END_ALLOW_THREADS
+
+	Py_DECREF(vector);
+	Py_DECREF(history);
+	Py_DECREF(vulnerable);
+	PyArray_ResolveWritebackIfCopy(out);
+	Py_DECREF(out);
+	Py_INCREF(Py_None);
+	return Py_None;
+
+fail:
+	Py_XDECREF(vector);
+	Py_XDECREF(history);
+	Py_XDECREF(vulnerable);
+	PyArray_DiscardWritebackIfCopy(out);
+	Py_XDECREF(out);
+	return NULL;
+}
+
+// ok = fastgame.shrink_lengths(vector)
+PyObject* wrap_shrink_lengths(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyArrayObject *vector = NULL;
+	GameState *state;
+	bool ok;
+
+	if (!PyArg_ParseTuple(args, "O", &vector_obj))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
+	if (vector == NULL)
+		goto fail;
+
+	if (PyArray_NDIM(vector) != 1 || PyArray_DIMS(vector)[0] != STATE_SIZE) {
+		PyErr_SetString(PyExc_ValueError, "expected (STATE_SIZE,)");
+		goto fail;
+	}
+
+	state = (GameState*) PyArray_GETPTR1(vector, 0);
+	ok = shrink_lengths(state);
+
+	PyArray_ResolveWritebackIfCopy(vector);
+	Py_DECREF(vector);
+	return PyBool_FromLong(ok);
+
+fail:
+	PyArray_DiscardWritebackIfCopy(vector);
+	Py_XDECREF(vector);
+	return NULL;
+}
+
+// ok = fastgame.mask_hidden_cards(vector, history, num_actions, visible)
+// history is (K, 2) int8 as Deal._history, visible a bit mask of seats.
+PyObject* wrap_mask_hidden_cards(PyObject *unused_self, PyObject* args) {
+	PyObject *vector_obj = NULL;
+	PyObject *history_obj = NULL;
+	PyArrayObject *vector = NULL;
+	PyArrayObject *history = NULL;
+	int num_actions;
+	int visible;
+	bool ok;
+
+	if (!PyArg_ParseTuple(args, "OOii", &vector_obj, &history_obj,
+				&num_actions, &visible))
+		return NULL;
+	vector = (PyArrayObject*) PyArray_FROM_OTF(
+			vector_obj, NPY_INT8, NPY_ARRAY_INOUT_ARRAY2);
+	history = (PyArrayObject*) PyArray_FROM_OTF(
+			history_obj, NPY_INT8, NPY_ARRAY_IN_ARRAY);
+	if (vector == NULL || history == NULL)
+		goto fail;
+
+	if (PyArray_NDIM(vector) != 1 || PyArray_DIMS(vector)[0] != STATE_SIZE) {
+		PyErr_SetString(PyExc_ValueError, "expected (STATE_SIZE,)");
+		goto fail;
+	}
+	if (PyArray_NDIM(history) != 2 || PyArray_DIMS(history)[1] != 2 ||
+			num_actions < 0 || num_actions > PyArray_DIMS(history)[0]) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected (K, 2) history of at least num_actions");
+		goto fail;
+	}
+
+	ok = mask_hidden_cards((GameState*) PyArray_DATA(vector), num_actions,
+			(HistoryEntry*) PyArray_DATA(history), visible);
+
+	Py_DECREF(history);
+	PyArray_ResolveWritebackIfCopy(vector);
+	Py_DECREF(vector);
+	return PyBool_FromLong(ok);
+
+fail:
+	Py_XDECREF(history);
+	PyArray_DiscardWritebackIfCopy(vector);
+	Py_XDECREF(vector);
+	return NULL;
+}
+
+static PyMethodDef fastgamemethods[] = {
+	{
+		"execute_action_ids",
+		(PyCFunction)wrap_execute_action_ids,
+		METH_VARARGS,
+		"Execute a list of action id"
+	},
+	{
+		"undo_action",
+		(PyCFunction)wrap_undo_action,
+		METH_VARARGS,
+		"Revert the last executed action using its undo record"
+	},
+	{
+		"execute_action_ids_batch",
+		(PyCFunction)wrap_execute_action_ids_batch,
+		METH_VARARGS,
+		"Execute a padded batch of action id lists, one row per deal"
+	},
+	{
+		"rehash",
+		(PyCFunction)wrap_rehash,
+		METH_VARARGS,
+		"Recompute the Zobrist hash of a state or batch"
+	},
+	{
+		"legal_action_mask",
+		(PyCFunction)wrap_legal_action_mask,
+		METH_VARARGS,
+		"Fill a bool mask of the legal action ids for a state or batch"
+	},
+	{
+		"pack_state",
+		(PyCFunction)wrap_pack_state,
+		METH_VARARGS,
+		"Convert a state or batch to bitboard form"
+	},
+	{
+		"packed_legal_action_mask",
+		(PyCFunction)wrap_packed_legal_action_mask,
+		METH_VARARGS,
+		"Fill a bool mask of the legal plays for a bitboard state or batch"
+	},
+	{
+		"mask_hidden_cards",
+		(PyCFunction)wrap_mask_hidden_cards,
+		METH_VARARGS,
+		"Reduce a fully dealt state to the public view of its history"
+	},
+	{
+		"execute_packed_action_ids",
+		(PyCFunction)wrap_execute_packed_action_ids,
+		METH_VARARGS,
+		"Execute a list of play action ids on a bitboard state"
+	},
+	{
+		"double_dummy",
+		(PyCFunction)wrap_double_dummy,
+		METH_VARARGS,
+		"Tricks for the declaring side with perfect play"
+	},
+	{
+		"double_dummy_table",
+		(PyCFunction)wrap_double_dummy_table,
+		METH_VARARGS,
+		"Double dummy tricks for every strain and declarer"
+	},
+	{
+		"random_playouts",
+		(PyCFunction)wrap_random_playouts,
+		METH_VARARGS,
+		"Play a state out with random legal actions, n times"
+	},
+	{
+		"sample_consistent_deals",
+		(PyCFunction)wrap_sample_consistent_deals,
+		METH_VARARGS,
+		"Random full deals consistent with a partial view"
+	},
+	{
+		"search_tree",
+		(PyCFunction)wrap_search_tree,
+		METH_VARARGS,
+		"Information set Monte Carlo tree search of the card play"
+	},
+	{
+		"encode_observations",
+		(PyCFunction)wrap_encode_observations,
+		METH_VARARGS,
+		"Observation features for the seat to act, for a batch of deals"
+	},
+	{
+		"shrink_lengths",
+		(PyCFunction)wrap_shrink_lengths,
+		METH_VARARGS,
+		"Shrink {min,max}_lengths to reflect logical possibilities"
+	},
+	{NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef fastgamemoduledef = {
+  PyModuleDef_HEAD_INIT,
+  "fastgame",
+  NULL,
+  -1,
+  fastgamemethods,
+  NULL,
+  NULL,
+  NULL,
+  NULL
+};
+
+static int add_constants(PyObject *m) {
+	PyObject *messages = PyTuple_New(NUM_ERRORS);
+	if (messages == NULL)
+		return -1;
+	for (int i = 0; i < NUM_ERRORS; ++i) {
+		PyObject *msg = error_messages[i] ?
+			PyUnicode_FromString(error_messages[i]) :
+			(Py_INCREF(Py_None), Py_None);
+		if (msg == NULL) {
+			Py_DECREF(messages);
+			return -1;
+		}
+		PyTuple_SET_ITEM(messages, i, msg);
+	}
+	if (PyModule_AddObject(m, "error_messages", messages) < 0) {
+		Py_DECREF(messages);
+		return -1;
+	}
+	if (PyModule_AddIntConstant(m, "NUM_ACTIONS", NUM_ACTIONS) < 0)
+		return -1;
+	if (PyModule_AddIntConstant(m, "OBSERVATION_SIZE",
+				OBSERVATION_SIZE) < 0)
+		return -1;
+	if (PyModule_AddIntConstant(m, "PACKED_STATE_SIZE",
+				PACKED_STATE_SIZE) < 0)
+		return -1;
+	if (PyModule_AddIntConstant(m, "UNDO_RECORD_SIZE", UNDO_RECORD_SIZE) < 0)
+		return -1;
+	if (PyModule_AddIntConstant(m, "NEXT_TO_ACT_OFFSET",
+				offsetof(GameState, next_to_act)) < 0)
+		return -1;
+	return PyModule_AddIntConstant(m, "STATE_SIZE", STATE_SIZE);
+}
+
+PyMODINIT_FUNC
+PyInit_fastgame() {
+	PyObject *m = NULL;
+	if (STATE_SIZE != 338) {
+		printf("GameState has size %ld, but need 338", STATE_SIZE);
+	} else {
+		m = PyModule_Create(&fastgamemoduledef);
+		import_array();
+		if (m != NULL && add_constants(m) < 0) {
+			Py_DECREF(m);
+			m = NULL;
+		}
 	}
 	return m;
 }
@@ -0,0 +1,225 @@
+"""Ingests a corpus of .lin files into a file of PlayedBoard records.
+
+    python -m bridge.fastgame.ingest --output=boards.pb corpus/ extra.lin
+
+Files are parsed by a pool of worker processes, but written in sorted path
+order, and a board whose tables are identical to a board already written
+is dropped, so the output does not depend on the number of workers. Each
+record is a serialized PlayedBoard preceded by its length as a varint, the
+framing of protobuf's writeDelimitedTo.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import mmap
+import os
+import time
+
+from absl import app
+from absl import flags
+
+from bridge import lin
+from bridge.fastgame import wrapper
+from pb import alphabridge_pb2
+
+flags.DEFINE_string("output", None, "file to write PlayedBoard records to")
+flags.DEFINE_integer("workers", None, "worker processes, default one per cpu")
+
+FLAGS = flags.FLAGS
+
+
+FileResult = collections.namedtuple("FileResult", [
+        "path", "boards", "num_deals", "error_counts", "skipped_bytes"])
+
+IngestStats = collections.namedtuple("IngestStats", [
+        "num_files", "num_deals", "num_boards", "num_duplicates",
+        "error_counts", "skipped_bytes", "seconds"])
+
+# Files submitted to the pool per worker, ahead of the file being written.
+_files_per_worker = 4
+
+_game = None
+_parser = None
+
+
+def _init_worker():
+    global _game, _parser
+    _game = wrapper.Game(mode=wrapper.MODE_FAST)
+    _parser = lin.Parser()
+
+
+def lin_paths(paths):
+    """Returns the .lin files at paths, which may be directories, sorted and
+    without repeats."""
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(os.path.normpath(path))
+            continue
+        for root, _, names in os.walk(path):
+            found.extend(os.path.normpath(os.path.join(root, name))
+                    for name in names
+                    if name.lower().endswith(".lin"))
+    seen = set()
+    result = []
+    for path in sorted(found):
+        real = os.path.realpath(path)
+        if real not in seen:
+            seen.add(real)
+            result.append(path)
+    return result
+
+
+def parse_file(path):
+    """Returns the FileResult of the .lin file at path.
+
+    boards is a list of (key, record) pairs, one per board in the order
+    first seen, where record is the serialized PlayedBoard and key a digest
+    of its tables, which is the same for the same board in any file. A
+    file that cannot be read, or fails to parse with an exception, has no
+    boards, and is counted in error_counts by the exception type.
+    """
+    try:
+        return _parse_file(path)
+    except Exception as e:
+        logging.warning("Failed to ingest %s: %r", path, e)
+        return FileResult(path, [], 0,
+                {"Failed to ingest file: " + type(e).__name__: 1}, {})
+
+
+def _parse_file(path):
+    if _game is None:
+        _init_worker()
+    error_counts = {}
+    skipped_bytes = {}
+    boards = {}
+    num_deals = 0
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return FileResult(path, [], 0, error_counts, skipped_bytes)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for board_name, table_name, deal in _parser.iter_buffer_deals(
+                    buffer, _game, error_counts, skipped_bytes, name=path):
+                num_deals += 1
+                boards.setdefault(board_name, {})[table_name] = (
+                        _game.played_game_from_deal(deal))
+    records = []
+    for board_name, tables in boards.items():
+        board = alphabridge_pb2.PlayedBoard(
+                tables=[tables[name] for name in sorted(tables)])
+        key = hashlib.sha1(board.SerializeToString(deterministic=True))
+        board.board_id.source_uri = "{}#{}".format(path, board_name)
+        records.append((key.digest(),
+            board.SerializeToString(deterministic=True)))
+    return FileResult(path, records, num_deals, error_counts, skipped_bytes)
+
+
+def _bounded_map(executor, fn, items, limit):
+    """As executor.map, but submits at most limit calls ahead of the result
+    being consumed, so that many items do not fill memory with futures."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) > limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_record(f, record):
+    """Writes record to the binary file f, preceded by its varint length."""
+    n = len(record)
+    prefix = bytearray()
+    while n >= 0x80:
+        prefix.append(n & 0x7f | 0x80)
+        n >>= 7
+    prefix.append(n)
+    f.write(prefix)
+    f.write(record)
+
+
+def read_played_boards(f):
+    """Yields the PlayedBoards of the binary file f, as written by ingest."""
+    while True:
+        n, shift = 0, 0
+        while True:
+            byte = f.read(1)
+            if not byte:
+                if shift:
+                    raise EOFError("truncated record length")
+                return
+            n |= (byte[0] & 0x7f) << shift
+            shift += 7
+            if byte[0] < 0x80:
+                break
+        record = f.read(n)
+        if len(record) != n:
+            raise EOFError("truncated record")
+        yield alphabridge_pb2.PlayedBoard.FromString(record)
+
+
+def ingest(paths, f, workers=None):
+    """Writes the boards of the .lin files at paths to the binary file f.
+
+    Returns IngestStats, with the error_counts and skipped_bytes of all
+    files summed.
+    """
+    start = time.time()
+    paths = lin_paths(paths)
+    workers = min(workers or os.cpu_count() or 1, max(len(paths), 1))
+    error_counts = collections.Counter()
+    skipped_bytes = collections.Counter()
+    seen = set()
+    num_files = num_deals = num_boards = num_duplicates = 0
+    executor = None
+    if workers <= 1:
+        results = map(parse_file, paths)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(workers,
+                initializer=_init_worker)
+        results = _bounded_map(executor, parse_file, paths,
+                _files_per_worker * workers)
+    try:
+        for result in results:
+            num_files += 1
+            num_deals += result.num_deals
+            error_counts.update(result.error_counts)
+            skipped_bytes.update(result.skipped_bytes)
+            for key, record in result.boards:
+                if key in seen:
+                    num_duplicates += 1
+                    continue
+                seen.add(key)
+                write_record(f, record)
+                num_boards += 1
+            if num_files % 1000 == 0:
+                logging.info("Ingested %d of %d files, %d deals",
+                        num_files, len(paths), num_deals)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return IngestStats(num_files, num_deals, num_boards, num_duplicates,
+            dict(error_counts), dict(skipped_bytes), time.time() - start)
+
+
+def main(argv):
+    if not FLAGS.output:
+        raise app.UsageError("--output is required")
+    with open(FLAGS.output, "wb") as f:
+        stats = ingest(argv[1:], f, FLAGS.workers)
+    seconds = max(stats.seconds, 1e-9)
+    print("{} files, {} deals, {} boards written, {} duplicate boards".format(
+        stats.num_files, stats.num_deals, stats.num_boards,
+        stats.num_duplicates))
+    print("{:.1f}s, {:.1f} files/sec, {:.1f} deals/sec".format(
+        stats.seconds, stats.num_files / seconds, stats.num_deals / seconds))
+    for err, count in sorted(stats.error_counts.items(),
+            key=lambda item: (-item[1], item[0])):
+        print("{:8d} {}".format(count, err))
+    for err, n in sorted(stats.skipped_bytes.items()):
+        print("{:8d} bytes skipped after {}".format(n, err))
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,113 @@
+from absl.testing import absltest
+import concurrent.futures
+import io
+import os
+
+import bridge.fastgame.ingest as ingest
+import bridge.fastgame.wrapper as bridgegame
+import bridge.lin as lin
+
+
+_header = """vg|Gabi Pleven Teams,Round 5_11,I,1,32,Avesta,0,Struma,0|
+rs|,,,,,,,,,,,,,,,,2HN+1,1NSx=,3CN+2,3HW-4,3SE+1,4SE=,4SW-1,4SW-1,3NN+3,3NN=,3HW-1,2HW=,1NS=,2CW-2,4HE+1,4SE+1,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,|
+pn|Ferov,Dunev,Andonov,Kovandzhiy,Slavov,Alexandrov,Videnova,Georgiev|pg||
+"""
+
+_deal = """qx|{}|st||md|3SK97H96DQJT98CA42,SAQJ5HKT4DA7CKJT5,ST86HAQ832DK52C73,S432HJ75D643CQ986|sv|e|mb|p|mb|p|mb|1D!|mb|d|mb|1H|mb|p|mb|1N|mb|d|mb|2H|mb|p|mb|p|mb|p|pc|c6|pc|c2|pc|cK|pc|c3|pg||
+pc|cJ|pc|c7|pc|c8|pc|cA|pg||
+"""
+
+
+class IngestTest(absltest.TestCase):
+    def setUp(self):
+        self.dir = self.create_tempdir().full_path
+        files = {
+            "a.lin": _header + _deal.format("o9") + _deal.format("c9"),
+            "sub/b.lin": _header + _deal.format("o9") + _deal.format("c9"),
+            "sub/c.LIN": _header + _deal.format("x9")
+                + _deal.format("o10").split("|pc|")[0] + "|pg||\n",
+            "d.lin": _header + "qx|o1|mbx|1|\n" + _deal.format("o9"),
+            "notes.txt": _header + _deal.format("o11"),
+        }
+        for name, contents in files.items():
+            path = os.path.join(self.dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(contents)
+
+    def test_ingest(self):
+        outputs = []
+        for workers in [1, 3]:
+            out = io.BytesIO()
+            stats = ingest.ingest([self.dir], out, workers)
+            outputs.append(out.getvalue())
+            self.assertEqual(stats.num_files, 4)
+            self.assertEqual(stats.num_deals, 6)
+            self.assertEqual(stats.num_boards, 3)
+            self.assertEqual(stats.num_duplicates, 1)
+            self.assertEqual(stats.error_counts, {"Unexpected room code": 1,
+                "Expected 2 letters in lin command": 1})
+            self.assertEqual(stats.skipped_bytes,
+                {"Expected 2 letters in lin command": len("mbx|1|\n")})
+        self.assertEqual(outputs[0], outputs[1])
+
+        boards = list(ingest.read_played_boards(io.BytesIO(outputs[0])))
+        self.assertEqual([b.board_id.source_uri for b in boards], [
+            os.path.join(self.dir, "a.lin#9"),
+            os.path.join(self.dir, "d.lin#9"),
+            os.path.join(self.dir, "sub/c.LIN#10")])
+        self.assertEqual([t.table_name for t in boards[0].tables],
+                ["c", "o"])
+        game = bridgegame.Game()
+        with open(os.path.join(self.dir, "a.lin"), "rb") as f:
+            deals = list(lin.Parser().iter_buffer_deals(f.read(), game))
+        self.assertEqual(boards[0].tables[1],
+                game.played_game_from_deal(deals[0][2]))
+        self.assertLen(boards[0].tables[1].actions, 20)
+
+    def test_unreadable_file(self):
+        missing = os.path.join(self.dir, "missing.lin")
+        for workers in [1, 3]:
+            stats = ingest.ingest([self.dir, missing], io.BytesIO(), workers)
+            self.assertEqual(stats.num_files, 5)
+            self.assertEqual(stats.num_boards, 3)
+            self.assertEqual(stats.error_counts, {"Unexpected room code": 1,
+                "Expected 2 letters in lin command": 1,
+                "Failed to ingest file: FileNotFoundError": 1})
+
+    def test_bounded_map(self):
+        submitted = []
+
+        class Executor(concurrent.futures.ThreadPoolExecutor):
+            def submit(self, fn, item):
+                submitted.append(item)
+                return super().submit(fn, item)
+
+        with Executor(2) as executor:
+            for i, result in enumerate(ingest._bounded_map(executor,
+                    lambda x: x * x, range(20), 3)):
+                self.assertEqual(result, i * i)
+                self.assertLessEqual(len(submitted), i + 4)
+        self.assertEqual(submitted, list(range(20)))
+
+    def test_lin_paths(self):
+        a = os.path.join(self.dir, "a.lin")
+        paths = ingest.lin_paths([os.path.join(self.dir, "sub"), a,
+            os.path.join(self.dir, ".", "a.lin"), self.dir])
+        self.assertEqual(paths, [a, os.path.join(self.dir, "d.lin"),
+            os.path.join(self.dir, "sub/b.lin"),
+            os.path.join(self.dir, "sub/c.LIN")])
+
+    def test_truncated(self):
+        out = io.BytesIO()
+        ingest.write_record(out, b"x" * 200)
+        data = out.getvalue()
+        self.assertEqual(data[:2], bytes([200 & 0x7f | 0x80, 1]))
+        with self.assertRaises(EOFError):
+            list(ingest.read_played_boards(io.BytesIO(data[:-1])))
+        with self.assertRaises(EOFError):
+            list(ingest.read_played_boards(io.BytesIO(data[:1])))
+
+
+if __name__ == "__main__":
+    absltest.main()
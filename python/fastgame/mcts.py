@@ -0,0 +1,137 @@
+"""Information set Monte Carlo tree search of the card play."""
+import collections
+import random
+import time
+import numpy as np
+
+from bridge.fastgame import wrapper
+from pb import alphabridge_pb2
+import fastgame
+
+
+_first_card_action = wrapper.num_actions - 52
+
+SearchResult = collections.namedtuple("SearchResult", [
+        "action_index", "visit_fractions", "num_simulations", "num_nodes",
+        "elapsed_ms", "ms_per_simulation"])
+
+
+class Search:
+    """A search tree over the cards played from a view of a deal.
+
+    The tree lives in preallocated arrays, indexed by node: children maps
+    the 52 cards to child nodes, -1 when unexpanded, and visits, available
+    and rewards hold the node statistics. Node 0 is the root. Each
+    simulation deals the cards hidden from the seat to act in the view out
+    at random, like Game.sample_consistent_deals, and expands the tree
+    along the legal cards of that deal.
+    """
+
+    def __init__(self, max_nodes=100000, exploration=0.7):
+        self.exploration = exploration
+        self.children = np.full((max_nodes, 52), -1, dtype=np.int32)
+        self.visits = np.zeros(max_nodes, dtype=np.int32)
+        self.available = np.zeros(max_nodes, dtype=np.int32)
+        self.rewards = np.zeros(max_nodes, dtype=np.float64)
+        self.num_nodes = 0
+        self.view = None
+
+    def reset(self, view):
+        """Empties the tree, to search from view.
+
+        view should show what the seat to act knows, as Game.actor_view.
+        """
+        if view._state.stage != wrapper.DealState.STAGE_PLAY:
+            raise ValueError("search starts in the play stage")
+        self.view = view
+        self.num_nodes = 0
+
+    def simulate(self, n, rng):
+        """Runs n more simulations, continuing on the current tree."""
+        self.num_nodes = fastgame.search_tree(
+                self.view._state._vector, self.children, self.visits,
+                self.available, self.rewards, self.num_nodes, n,
+                rng.getrandbits(64), self.exploration)
+
+    def run(self, view, n, rng):
+        """Searches from view for n simulations.
+
+        Returns the visit fractions of the actions at the root.
+        """
+        self.reset(view)
+        self.simulate(n, rng)
+        return self.visit_fractions()
+
+    def visit_fractions(self):
+        """Returns a (num_actions,) array of the fraction of root visits
+        that went to each action, as in alphabridge_pb2.Action."""
+        fractions = np.zeros(wrapper.num_actions, dtype=np.float32)
+        if self.num_nodes == 0:
+            return fractions
+        children = self.children[0]
+        expanded = children >= 0
+        visits = self.visits[children[expanded]]
+        fractions[_first_card_action:][expanded] = visits / max(
+                visits.sum(), 1)
+        return fractions
+
+    def best_action_index(self):
+        """Returns the most visited action at the root, or None."""
+        fractions = self.visit_fractions()
+        if not fractions.any():
+            return None
+        return int(fractions.argmax())
+
+    def values(self):
+        """Returns a (num_actions,) array of the mean fraction of the
+        remaining tricks taken by the side to act after each action at the
+        root, NaN for the actions not searched."""
+        values = np.full(wrapper.num_actions, np.nan)
+        if self.num_nodes == 0:
+            return values
+        children = self.children[0]
+        expanded = children >= 0
+        nodes = children[expanded]
+        values[_first_card_action:][expanded] = (
+                self.rewards[nodes] / np.maximum(self.visits[nodes], 1))
+        return values
+
+    def action(self, action_index):
+        """Returns action_index as an alphabridge_pb2.Action with the visit
+        fractions at the root."""
+        return alphabridge_pb2.Action(
+                token=wrapper._actions.tokens[action_index],
+                mcts_visit_fraction=self.visit_fractions().tolist())
+
+
+def search(deal, budget_ms, rng=None, tree=None):
+    """Searches the play from deal for about budget_ms of wall-clock time.
+
+    deal is what the seat to act knows, as Game.actor_view, and is left
+    unchanged. Simulations run in batches, each sized from the rate
+    measured so far to take half the time left, so the clock is read a
+    few times rather than once a simulation. Returns a SearchResult with
+    the most visited action, and tree, or a new Search, holds the tree.
+    """
+    start = time.perf_counter()
+    deadline = start + budget_ms / 1000
+    if rng is None:
+        rng = random.Random()
+    if tree is None:
+        tree = Search()
+    tree.reset(deal.copy_replay_state())
+    num_simulations = 0
+    batch = 16
+    while batch > 0:
+        tree.simulate(batch, rng)
+        num_simulations += batch
+        now = time.perf_counter()
+        batch = int((deadline - now) / 2 * num_simulations / (now - start))
+    elapsed_ms = 1000 * (now - start)
+    return SearchResult(
+            action_index=tree.best_action_index(),
+            visit_fractions=tree.visit_fractions(),
+            num_simulations=num_simulations,
+            num_nodes=tree.num_nodes,
+            elapsed_ms=elapsed_ms,
+            ms_per_simulation=elapsed_ms / num_simulations)
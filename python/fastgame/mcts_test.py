@@ -0,0 +1,85 @@
+from absl.testing import absltest
+import numpy.testing
+import random
+
+import bridge.fastgame.mcts as mcts
+import bridge.fastgame.wrapper as bridgegame
+
+
+class SearchTest(absltest.TestCase):
+    def setUp(self):
+        self.game = bridgegame.Game()
+        deal = self.game.random_deal(rng=random.Random(1))
+        self.deal = self.game.execute_action_ids(deal, [19, 35, 35, 35])
+
+    def test_run(self):
+        rng = random.Random(2)
+        search = mcts.Search(max_nodes=5000)
+        deal = self.deal
+        for _ in range(6):
+            view = self.game.actor_view(deal, deal.num_actions())
+            fractions = search.run(view, 2000, rng)
+            self.assertEqual(search.visits[0], 2000)
+            self.assertAlmostEqual(fractions.sum(), 1, places=5)
+            numpy.testing.assert_array_equal(fractions > 0,
+                    self.game.legal_action_mask(view))
+            best = search.best_action_index()
+            self.assertEqual(fractions[best], fractions.max())
+            values = search.values()
+            self.assertTrue((values[fractions > 0] >= 0).all())
+            self.assertTrue((values[fractions > 0] <= 1).all())
+            deal = self.game.execute_action_index(deal, best)
+            self.assertEqual(deal.error, None)
+
+    def test_simulate(self):
+        view = self.game.actor_view(self.deal, self.deal.num_actions())
+        search = mcts.Search(max_nodes=100)
+        search.run(view, 300, random.Random(3))
+        self.assertEqual(search.num_nodes, 100)
+        search.simulate(200, random.Random(4))
+        self.assertEqual(search.visits[0], 500)
+        fractions = search.visit_fractions()
+
+        again = mcts.Search(max_nodes=100)
+        again.run(view, 300, random.Random(3))
+        again.simulate(200, random.Random(4))
+        numpy.testing.assert_array_equal(again.visit_fractions(), fractions)
+
+        action = search.action(search.best_action_index())
+        self.assertLen(action.mcts_visit_fraction, bridgegame.num_actions)
+        self.assertIn(action.token, bridgegame._cards.tokens)
+
+    def test_search(self):
+        view = self.game.actor_view(self.deal, self.deal.num_actions())
+        vector = view._state._vector.copy()
+        tree = mcts.Search()
+        result = mcts.search(view, 50, random.Random(6), tree)
+        numpy.testing.assert_array_equal(view._state._vector, vector)
+        self.assertGreater(result.num_simulations, 0)
+        self.assertEqual(result.num_simulations, tree.visits[0])
+        self.assertEqual(result.num_nodes, tree.num_nodes)
+        # Generous, as the first batch runs whatever the clock says.
+        self.assertLess(result.elapsed_ms, 5000)
+        self.assertAlmostEqual(result.ms_per_simulation,
+                result.elapsed_ms / result.num_simulations)
+        self.assertTrue(
+                self.game.legal_action_mask(view)[result.action_index])
+        numpy.testing.assert_array_equal(
+                result.visit_fractions, tree.visit_fractions())
+
+    def test_bench_search(self):
+        view = self.game.actor_view(self.deal, self.deal.num_actions())
+        for budget_ms in [10, 50, 200]:
+            result = mcts.search(view, budget_ms, random.Random(7))
+            print(f"search {budget_ms}ms: {result.elapsed_ms}ms, "
+                    f"{result.num_simulations} simulations, "
+                    f"{result.ms_per_simulation}ms per simulation")
+
+    def test_bidding(self):
+        deal = self.game.random_deal(rng=random.Random(5))
+        with self.assertRaises(ValueError):
+            mcts.Search().reset(self.game.actor_view(deal, 0))
+
+
+if __name__ == "__main__":
+    absltest.main()
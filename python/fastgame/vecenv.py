@@ -0,0 +1,115 @@
+"""Many deals stepped together, for batched actors."""
+import collections
+import random
+import numpy as np
+
+from bridge.fastgame import wrapper
+import fastgame
+
+
+StepResult = collections.namedtuple("StepResult", [
+        "next_to_act", "legal_mask", "done", "scores", "errors"])
+
+_max_actions = 35 * 9 + 52
+
+
+class BridgeVecEnv:
+    """n deals whose states are the rows of one (n, STATE_SIZE) array.
+
+    Every deal is dealt by Game.random_deal, and is dealt afresh as soon as
+    it finishes, that is once no action is legal, so all n are always in
+    play.
+    """
+
+    def __init__(self, n, num_ranks=13, seed=None):
+        self.game = wrapper.Game(num_ranks=num_ranks)
+        self.rng = random.Random(seed)
+        self.states = np.zeros((n, fastgame.STATE_SIZE), dtype=np.int8)
+        self.histories = np.full((n, _max_actions, 2), -1, dtype=np.int8)
+        self.history_lengths = np.zeros(n, dtype=np.int32)
+        self.vulnerability = [None] * n
+        self.vulnerable = np.zeros((n, 2), dtype=bool)
+        self._legal_mask = np.zeros((n, wrapper.num_actions), dtype=bool)
+        self._step_history = np.zeros((n, 1, 2), dtype=np.int8)
+        self._rows = np.arange(n)
+
+    def __len__(self):
+        return len(self.states)
+
+    def reset(self):
+        """Deals every deal afresh. Returns (next_to_act, legal_mask)."""
+        for i in range(len(self)):
+            self._reset_deal(i)
+        return self.next_to_act(), self.legal_mask()
+
+    def step(self, actions):
+        """Executes actions[i], an action id, on deal i.
+
+        Returns a StepResult of (n,) arrays, and an (n, num_actions)
+        legal_mask. next_to_act and legal_mask are for the deal now in
+        play, so a finished deal shows its replacement. scores are the
+        North-South table scores of the deals that finished, and 0
+        elsewhere. A deal with an illegal action is dealt afresh too, and
+        flagged in errors.
+        """
+        ids = np.asarray(actions, dtype=np.int8).reshape(-1, 1)
+        counts, error_codes = fastgame.execute_action_ids_batch(
+                self.states, ids, self._step_history)
+        stepped = counts > 0
+        self.histories[self._rows[stepped],
+                self.history_lengths[stepped]] = self._step_history[stepped, 0]
+        self.history_lengths += counts
+        errors = error_codes != 0
+        fastgame.legal_action_mask(self.states, self._legal_mask)
+        done = ~self._legal_mask.any(axis=1)
+        scores = np.zeros(len(self), dtype=np.int32)
+        for i in np.flatnonzero(done):
+            if not errors[i]:
+                scores[i] = self._table_score(i)
+            self._reset_deal(i)
+            fastgame.legal_action_mask(self.states[i], self._legal_mask[i])
+        return StepResult(self.next_to_act(), self._legal_mask.copy(), done,
+                scores, errors)
+
+    def next_to_act(self):
+        """Returns the (n,) seats to act, -1 for none."""
+        return self.states[:, fastgame.NEXT_TO_ACT_OFFSET].copy()
+
+    def legal_mask(self):
+        """Returns the (n, num_actions) legal action masks."""
+        fastgame.legal_action_mask(self.states, self._legal_mask)
+        return self._legal_mask.copy()
+
+    def observations(self, out=None):
+        """Returns the (n, OBSERVATION_SIZE) observations of the seats to
+        act, as wrapper.encode_observations."""
+        return wrapper.encode_observations(self.states, self.histories,
+                self.vulnerable, out)
+
+    def deal(self, i):
+        """Returns deal i as a wrapper.Deal, sharing its state."""
+        deal = self.game.Deal()
+        deal._state._vector = self.states[i]
+        deal._history = self.histories[i]
+        deal._history_length = self.history_lengths[i]
+        deal.vulnerability = self.vulnerability[i]
+        return deal
+
+    def _reset_deal(self, i):
+        deal = self.game.random_deal(self.rng)
+        self.states[i] = deal._state._vector
+        self.histories[i] = -1
+        self.history_lengths[i] = 0
+        self.vulnerability[i] = deal.vulnerability
+        self.vulnerable[i] = wrapper.vulnerable_sides(deal.vulnerability)
+
+    def _table_score(self, i):
+        # accept_claim writes to the row, which is dealt afresh after this.
+        deal = self.deal(i)
+        if not deal.contract_level():
+            return 0
+        state = deal._state
+        deal = self.game.accept_claim(deal,
+                state.tricks_taken[state.declarer % 2::2].sum())
+        ns, ew = self.game.table_score(deal.result, deal.vulnerability)
+        return ns if ns is not None else -ew
@@ -0,0 +1,94 @@
+from absl.testing import absltest
+import numpy as np
+import numpy.testing
+import random
+
+import bridge.fastgame.vecenv as vecenv
+import bridge.fastgame.wrapper as bridgegame
+
+
+class BridgeVecEnvTest(absltest.TestCase):
+    def test_step(self):
+        rng = random.Random(1)
+        for num_ranks in [2, 13]:
+            env = vecenv.BridgeVecEnv(8, num_ranks=num_ranks, seed=2)
+            game = env.game
+            next_to_act, legal_mask = env.reset()
+            num_done = 0
+            for _ in range(200):
+                deals = [env.deal(i).copy_replay_state()
+                        for i in range(len(env))]
+                actions = [rng.choice(np.flatnonzero(mask))
+                        for mask in legal_mask]
+                result = env.step(actions)
+                self.assertFalse(result.errors.any())
+                for i, deal in enumerate(deals):
+                    deal = game.execute_action_index(deal, actions[i])
+                    self.assertEqual(deal.error, None)
+                    self.assertEqual(result.done[i],
+                            not game.possible_action_indices(deal))
+                    if not result.done[i]:
+                        numpy.testing.assert_array_equal(
+                                env.deal(i)._state._vector,
+                                deal._state._vector)
+                        numpy.testing.assert_array_equal(
+                                env.deal(i)._history, deal._history)
+                        self.assertEqual(result.scores[i], 0)
+                        continue
+                    num_done += 1
+                    state = deal._state
+                    game.accept_claim(deal,
+                            state.tricks_taken[state.declarer % 2::2].sum())
+                    ns, ew = game.table_score(deal.result,
+                            deal.vulnerability)
+                    self.assertEqual(result.scores[i],
+                            ns if ns is not None else -ew)
+                    self.assertEqual(env.deal(i).num_actions(), 0)
+                for i in range(len(env)):
+                    self.assertEqual(result.next_to_act[i],
+                            env.deal(i)._state.next_to_act)
+                    numpy.testing.assert_array_equal(result.legal_mask[i],
+                            game.legal_action_mask(env.deal(i)))
+                legal_mask = result.legal_mask
+            self.assertGreater(num_done, 0)
+
+    def test_observations(self):
+        env = vecenv.BridgeVecEnv(4, seed=4)
+        next_to_act, legal_mask = env.reset()
+        for _ in range(30):
+            env.step([np.flatnonzero(mask)[-1] for mask in legal_mask])
+            legal_mask = env.legal_mask()
+        out = numpy.zeros((4, bridgegame.fastgame.OBSERVATION_SIZE),
+                numpy.float32)
+        self.assertIs(env.observations(out), out)
+        for i in range(len(env)):
+            deal = env.deal(i)
+            numpy.testing.assert_array_equal(out[i],
+                    bridgegame.encode_observations(
+                        deal._state._vector[None], deal._history[None],
+                        [bridgegame.vulnerable_sides(deal.vulnerability)])[0])
+
+    def test_illegal_action(self):
+        env = vecenv.BridgeVecEnv(2, seed=3)
+        next_to_act, legal_mask = env.reset()
+        actions = [np.flatnonzero(legal_mask[0])[0],
+                np.flatnonzero(~legal_mask[1])[0]]
+        result = env.step(actions)
+        numpy.testing.assert_array_equal(result.errors, [False, True])
+        numpy.testing.assert_array_equal(result.done, [False, True])
+        self.assertEqual(env.deal(0).num_actions(), 1)
+        self.assertEqual(env.deal(1).num_actions(), 0)
+        self.assertEqual(env.deal(1).error, None)
+
+    def test_passed_out(self):
+        env = vecenv.BridgeVecEnv(2, seed=5)
+        env.reset()
+        for _ in range(4):
+            result = env.step([35, 35])
+        numpy.testing.assert_array_equal(result.done, [True, True])
+        numpy.testing.assert_array_equal(result.scores, [0, 0])
+        self.assertFalse(result.errors.any())
+
+
+if __name__ == "__main__":
+    absltest.main()
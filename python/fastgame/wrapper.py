@@ -1,5 +1,9 @@
 """Optimized version of game.py."""
+import bisect
+import collections
+import concurrent.futures
 import copy
+import os
 import numpy as np
 
 from bridge import players
@@ -32,7 +36,7 @@ def _named_vector_position(n, doc=None):
 
 class DealState:
     def __init__(self, dealer=None, dealt_cards=0, min_length=0, max_length=13):
-        self._vector = np.zeros(330, dtype=np.int8)
+        self._vector = np.zeros(fastgame.STATE_SIZE, dtype=np.int8)
         self.dealt_cards[:] = dealt_cards
         self.min_length[:] = min_length
         self.max_length[:] = max_length
@@ -53,6 +57,7 @@ class DealState:
         self.trick_winning_suit = None
         self.trick_winning_rank = None
         self.bidding_is_open = 0
+        self.rehash()
 
     @property
     def dealt_cards(self):
@@ -78,6 +83,14 @@ class DealState:
     def tricks_taken(self):
         return np.reshape(self._vector[312:316], (4))
 
+    def state_hash(self):
+        """The 64-bit Zobrist hash of the state, as an int."""
+        return int(self._vector[330:338].view(np.uint64)[0])
+
+    def rehash(self):
+        """Recomputes state_hash() after writing the state directly."""
+        fastgame.rehash(self._vector)
+
     stage = _named_vector_position(316 + 0)
     next_to_act = _named_vector_position(316 + 1)
     pass_position = _named_vector_position(316 + 2)
@@ -105,13 +118,15 @@ class DealState:
         return self.trick_position or self.tricks_taken.sum() != 0
 
     def add_cards(self, seat, cards):
-        for cards_seat in range(4):
-            if seat is None or cards_seat == seat:
-                self.dealt_cards[cards_seat,:,:] |= cards[cards_seat,:,:]
-                for suit in range(4):
-                    n = self.dealt_cards[cards_seat,suit,:].sum()
-                    if n > self.min_length[cards_seat,suit]:
-                        self.min_length[cards_seat,suit] = n
+        seats = slice(None) if seat is None else slice(seat, seat + 1)
+        dealt_cards = self.dealt_cards[seats]
+        dealt_cards |= cards[seats]
+        min_length = self.min_length[seats]
+        np.maximum(min_length, dealt_cards.sum(axis=2, dtype=np.int8),
+                out=min_length)
+        if not self.shrink_lengths():
+            self.set_error("Revoke?")
+        self.rehash()
 
     def give_card(self, seat, suit, rank):
         if self.stage == self.STAGE_ERROR:
@@ -130,67 +145,86 @@ class DealState:
                 self.dealt_cards[seat,suit,rank] = 1
         else:
             self.dealt_cards[seat,suit,rank] = 1
+        if self.stage != self.STAGE_ERROR and not self.shrink_lengths():
+            self.set_error("Revoke?")
+        self.rehash()
 
     def set_error(self, msg):
         if self.stage != self.STAGE_ERROR:
             self.stage = self.STAGE_ERROR
             self.error_message = msg
+            self.rehash()
+
+    def shrink_lengths(self):
+        """Tightens min_length and max_length to what the dealt cards and
+        the 13 cards of each hand and suit imply.
+
+        Returns False if no deal meets them.
+        """
+        raise NotImplementedError
 
-    def execute_action_ids(self, ids, history):
+    def execute_action_ids(self, ids, history, undo_records=None):
         raise NotImplementedError
 
+    def undo_action(self, history_entry, undo_record):
+        raise NotImplementedError
+
+    def legal_action_mask(self, out=None):
+        raise NotImplementedError
+
+    def packed_state(self, out=None):
+        """Returns the card play state in bitboard form.
+
+        The result has fastgame.PACKED_STATE_SIZE bytes, and is only
+        playable by fastgame.execute_packed_action_ids when all cards are
+        dealt.
+        """
+        if out is None:
+            out = np.zeros(fastgame.PACKED_STATE_SIZE, dtype=np.uint8)
+        fastgame.pack_state(self._vector, out)
+        return out
+
+    @classmethod
+    def execute_action_ids_batch(cls, states, ids, histories):
+        """Steps states[i] by ids[i], which is padded with -1."""
+        counts = np.zeros(len(states), dtype=np.int32)
+        for i, state in enumerate(states):
+            n = ids.shape[1]
+            padding = np.flatnonzero(ids[i] < 0)
+            if len(padding):
+                n = padding[0]
+            counts[i] = state.execute_action_ids(ids[i, :n], histories[i])
+        return counts
+
 
 class DebugDealState(DealState):
-# TODO(njt): uncomment ater a) needed and (b) tested.
-#    def shrink_lengths(self):
-#        min_length = self.min_length
-#        max_length = self.max_length
-#
-#        for seat in range(4):
-#            for suit in range(4):
-#                n = self.dealt_cards[seat,suit,:].sum()
-#                if n > min_length[seat,suit]:
-#                    min_length[seat,suit] = n
-#
-#        dirty = True
-#        while dirty:
-#            dirty = False
-#            for seat in range(4):
-#                for suit in range(4):
-#                    n = min_length[seat,:].sum()
-#                    n -= min_length[seat,suit]
-#                    if 13 - n < max_length[seat,suit]:
-#                        max_length[seat,suit] = 13 - n
-#                        dirty = True
-#
-#                    n = min_length[:,suit].sum()
-#                    n -= min_length[seat,suit]
-#                    if 13 - n < max_length[seat,suit]:
-#                        max_length[seat,suit] = 13 - n
-#                        dirty = True
-#
-#                    n = max_length[seat,:].sum()
-#                    n -= max_length[seat,suit]
-#                    if 13 - n > min_length[seat,suit]:
-#                        min_length[seat,suit] = 13 - n
-#                        dirty = True
-#
-#                    n = max_length[:,suit].sum()
-#                    n -= max_length[seat,suit]
-#                    if 13 - n > min_length[seat,suit]:
-#                        min_length[seat,suit] = 13 - n
-#                        dirty = True
-#
-#                    if min_length[seat,suit] > max_length[seat,suit]:
-#                        raise ValueError
-
-    def execute_action_ids(self, ids, history):
+    def shrink_lengths(self):
+        min_length = self.min_length
+        max_length = self.max_length
+        np.maximum(min_length, self.dealt_cards.sum(axis=2), out=min_length)
+        while True:
+            upper = np.minimum(
+                    13 - (min_length.sum(axis=1)[:,None] - min_length),
+                    13 - (min_length.sum(axis=0)[None,:] - min_length))
+            lower = np.maximum(
+                    13 - (max_length.sum(axis=1)[:,None] - max_length),
+                    13 - (max_length.sum(axis=0)[None,:] - max_length))
+            if (upper >= max_length).all() and (lower <= min_length).all():
+                break
+            np.minimum(max_length, upper, out=max_length)
+            np.maximum(min_length, lower, out=min_length)
+            if (min_length > max_length).any():
+                return False
+        return not (min_length > max_length).any()
+
+    def execute_action_ids(self, ids, history, undo_records=None):
         for i, action_id in enumerate(ids):
             if self.stage == self.STAGE_ERROR:
                 return i
             elif self.stage == self.STAGE_SCORING:
                 self.set_error("action after deal finished")
                 return i
+            before = self._vector.copy()
             history[i, :] = (self.next_to_act, action_id)
             if action_id < 35:
                 level_ix = action_id // 5
@@ -202,9 +236,78 @@ class DebugDealState(DealState):
                 suit_ix = (action_id - 38) // 13
                 rank_ix = (action_id - 38) % 13
                 self._execute_play_action(suit_ix, rank_ix)
-            
+            self.rehash()
+            if undo_records is not None:
+                self._record_changes(before, undo_records[i])
+            if self.stage == self.STAGE_ERROR:
+                return i
         return len(ids)
 
+    def _record_changes(self, before, undo_record):
+        offsets = np.flatnonzero(before != self._vector)
+        n = len(offsets)
+        undo_record[:] = 0
+        if 3 * n + 1 > len(undo_record):
+            undo_record[0] = -1
+            return
+        undo_record[0] = n
+        changes = undo_record[1:3 * n + 1].reshape(n, 3)
+        changes[:, 0] = offsets
+        changes[:, 1] = before[offsets]
+        changes[:, 2] = self._vector[offsets]
+
+    def undo_action(self, history_entry, undo_record):
+        n = undo_record[0]
+        if n < 0 or 3 * n + 1 > len(undo_record):
+            raise ValueError("undo record overflowed")
+        restored = self._vector.copy()
+        for offset, old, new in undo_record[1:3 * n + 1].reshape(n, 3)[::-1]:
+            if restored[offset] != new:
+                raise ValueError("undo record does not match state")
+            restored[offset] = old
+        if restored[316 + 1] != history_entry[0]:
+            raise ValueError("undo record does not match state")
+        self._vector[:] = restored
+
+    def legal_action_mask(self, out=None):
+        mask = np.zeros(num_actions, dtype=bool) if out is None else out
+        mask[:] = False
+        actor = self.next_to_act
+        if self.stage == self.STAGE_BIDDING:
+            is_open = self.last_bid_level is not None
+            first_bid = 0
+            if is_open:
+                first_bid = 5 * self.last_bid_level + self.last_bid_strain + 1
+            mask[first_bid:35] = True
+            mask[35 + self.CALL_PASS] = True
+            if is_open:
+                own_side = self.last_bid_seat % 2 == actor % 2
+                mask[35 + self.CALL_DOUBLE] = (
+                        self.last_bid_double == self.CALL_PASS and not own_side)
+                mask[35 + self.CALL_REDOUBLE] = (
+                        self.last_bid_double == self.CALL_DOUBLE and own_side)
+        elif self.stage == self.STAGE_PLAY:
+            hand = self.dealt_cards[actor,:,:] != 0
+            unplayed = self.played_cards == 0
+            cards = hand & unplayed
+            suit_cards = hand.sum(axis=1)
+            if suit_cards.sum() < 13:
+                min_length = self.min_length[actor,:]
+                max_length = self.max_length[actor,:]
+                room_in_suit = ((suit_cards < min_length) |
+                                (min_length < max_length))
+                unknown = ~self.dealt_cards.any(axis=0) & unplayed
+                cards |= unknown & room_in_suit[:,None]
+            if self.trick_position != 0:
+                follow_suit = self.trick_suit
+                if ((hand[follow_suit] & unplayed[follow_suit]).any() or
+                        suit_cards[follow_suit] <
+                        self.min_length[actor,follow_suit]):
+                    cards[:follow_suit,:] = False
+                    cards[follow_suit + 1:,:] = False
+            mask[38:] = cards.reshape(52)
+        return mask
+
     def _execute_bid_action(self, level_ix, strain_ix):
         if not self._check_equal(
                 self.stage, self.STAGE_BIDDING, "stage for bid"):
@@ -215,6 +318,7 @@ class DebugDealState(DealState):
                     strain_ix <= self.last_bid_strain):
                 self.set_error("Insufficient bid")
                 return
+        self.bidding_is_open = 1
         self.last_bid_seat = self.next_to_act
         self.last_bid_level = level_ix
         self.last_bid_strain = strain_ix
@@ -287,11 +391,16 @@ class DebugDealState(DealState):
                 (self.dealt_cards[seat,self.trick_suit,:] &
                 ~self.played_cards[self.trick_suit]).sum() > 0):
             self.set_error("Revoke")
+        learned = False
         if self.trick_position != 0 and suit != self.trick_suit:
             self.max_length[seat, self.trick_suit] = \
-                    self.min_length[seat, self.trick_suit]
+                    self.dealt_cards[seat, self.trick_suit].sum()
+            learned = True
         if not self.dealt_cards[seat, suit, rank]:
             self.give_card(seat, suit, rank)
+        elif learned and self.stage != self.STAGE_ERROR:
+            if not self.shrink_lengths():
+                self.set_error("Revoke?")
         if self.stage == self.STAGE_ERROR:
             return
 
@@ -312,6 +421,10 @@ class DebugDealState(DealState):
             self.trick_position = 0
             self.next_to_act = self.trick_winning_seat
             self.tricks_taken[self.trick_winning_seat] += 1
+            self.trick_suit = None
+            self.trick_winning_seat = None
+            self.trick_winning_suit = None
+            self.trick_winning_rank = None
             if self.tricks_taken.sum() == 13:
                 self.stage = self.STAGE_SCORING 
                 self.next_to_act = None
@@ -324,15 +437,96 @@ class DebugDealState(DealState):
             return False
 
 class FastDealState(DealState):
-    def execute_action_ids(self, ids, history):
+    def shrink_lengths(self):
+        return fastgame.shrink_lengths(self._vector)
+
+    def execute_action_ids(self, ids, history, undo_records=None):
         if self.stage != self.STAGE_ERROR:
-            n, err = fastgame.execute_action_ids(self._vector, ids, history)
+            n, err = fastgame.execute_action_ids(
+                    self._vector, ids, history, undo_records)
             if self.stage == self.STAGE_ERROR:
                 self.error_message = err
             return n
         else:
             return 0
 
+    def undo_action(self, history_entry, undo_record):
+        fastgame.undo_action(self._vector, history_entry, undo_record)
+
+    def legal_action_mask(self, out=None):
+        if out is None:
+            out = np.zeros(num_actions, dtype=bool)
+        fastgame.legal_action_mask(self._vector, out)
+        return out
+
+    @classmethod
+    def execute_action_ids_batch(cls, states, ids, histories):
+        vectors = np.stack([state._vector for state in states])
+        counts, errors = fastgame.execute_action_ids_batch(
+                vectors, ids, histories)
+        for state, vector, err in zip(states, vectors, errors):
+            state._vector[:] = vector
+            if err:
+                state.error_message = fastgame.error_messages[err]
+        return counts
+
+
+def new_undo_records(n):
+    """Returns storage for the undo records of n actions."""
+    return np.zeros((n, fastgame.UNDO_RECORD_SIZE), dtype=np.int16)
+
+
+def encode_observations(states, histories, vulnerable, out=None):
+    """Encodes what the seat deciding the next action sees of each deal.
+
+    states is (N, STATE_SIZE), as BridgeVecEnv.states or stacked
+    DealState._vector, histories (N, K, 2) as Deal._history, and
+    vulnerable (N, 2) for North-South and East-West. out is
+    (N, fastgame.OBSERVATION_SIZE), uint8 by default or float32; the
+    layout is described at OBS_HAND in fastgame.c. Only the observer's
+    hand and a public dummy are read from dealt_cards, so states may hold
+    the full deal.
+    """
+    if out is None:
+        out = np.zeros((len(states), fastgame.OBSERVATION_SIZE),
+                dtype=np.uint8)
+    fastgame.encode_observations(states, histories, vulnerable, out)
+    return out
+
+
+ActorViews = collections.namedtuple("ActorViews", [
+        "observations", "actors", "action_ids", "legal_masks"])
+
+
+def vulnerable_sides(vulnerability):
+    """Returns [North-South, East-West] vulnerability flags of a list of
+    seats, as Deal.vulnerability."""
+    vulnerability = vulnerability or []
+    return ["North" in vulnerability, "East" in vulnerability]
+
+
+_TABLE = "table"
+_ACTOR = "actor"
+_KIBITZER = "kibitzer"
+
+
+def _visible_seats(state, observer):
+    """The seats whose hands observer sees in state, besides played cards."""
+    if observer == _KIBITZER or state.stage == DealState.STAGE_SCORING:
+        return range(4)
+    seats = []
+    if state.dummy_is_public():
+        seats.append((state.declarer + 2) % 4)
+    if observer == _ACTOR:
+        actor_ix = state.next_to_act
+        if actor_ix is None:
+            return range(4)
+        if (state.stage == DealState.STAGE_PLAY and
+                actor_ix % 2 == state.declarer % 2):
+            actor_ix = state.declarer
+        seats.append(actor_ix)
+    return seats
+
 
 class Game:
     def __init__(self, num_ranks=13, mode=MODE_FAST):
@@ -364,11 +558,14 @@ class Game:
         unplayed_cards = [(suit, rank) for suit in range(4)
             for rank in range(13 - self.num_ranks, 13)]
         rng.shuffle(unplayed_cards)
+        cards = np.zeros((4, 4, 13), dtype=np.int8)
         for i, card in enumerate(played_cards + unplayed_cards):
-            deal._state.give_card(i % 4, card[0], card[1])
+            cards[i % 4, card[0], card[1]] = 1
+        deal._state.add_cards(None, cards)
 
         deal._state.max_length[:] = deal._state.min_length
         deal._state.played_cards[:,:13 - self.num_ranks] = 1
+        deal._state.rehash()
         return deal
 
     def distinct_boards(self):
@@ -379,6 +576,7 @@ class Game:
             self._set_error(deal, "claim before bidding finished")
             return deal
         deal._state.stage = DealState.STAGE_SCORING
+        deal._state.rehash()
 
         tricks_contracted = int(deal.contract_level()) + self.book
         diff = int(total_tricks) - tricks_contracted
@@ -530,6 +728,7 @@ class Game:
         if deal._state.next_to_act is None:
             deal._state.next_to_act = dealer_ix
             deal._state.stage = DealState.STAGE_BIDDING
+            deal._state.rehash()
         else:
             self._set_error(deal, "dealer already set")
         return deal
@@ -569,6 +768,33 @@ class Game:
         deal.result = Event([level, strain, player, double, outcome])
         return deal
 
+    def played_game_from_deal(self, deal):
+        """As OldGame.played_game_from_deal. Deals here keep no explanations
+        or commentary, so there are no annotations."""
+        player_ids = {k: alphabridge_pb2.PlayerId(player_name=v)
+                for k, v in (deal.players or {}).items()}
+        dealt_cards = deal.dealt_cards.reshape(4, 52)
+        board = alphabridge_pb2.Board(
+                vulnerable_seat=deal.vulnerability,
+                board_sequence_name=deal.board_name,
+                scoring=deal.scoring,
+                dealer=deal.dealer(),
+                dealt_cards={seat: alphabridge_pb2.Hand(card_token=[
+                    _cards.tokens[i] for i in np.flatnonzero(dealt_cards[j])])
+                    for j, seat in enumerate(_seats.tokens)})
+        actions = [alphabridge_pb2.Action(token=_actions.tokens[i])
+                for i in deal._history[:deal._history_length, 1]]
+        if deal.result:
+            result = alphabridge_pb2.Result(summary_token=deal.result.tokens)
+        else:
+            result = alphabridge_pb2.Result()
+        return alphabridge_pb2.PlayedGame(
+                player=player_ids,
+                board=board,
+                actions=actions,
+                result=result,
+                table_name=deal.table_name)
+
     def give_card(self, deal, seat, suit, rank):
         seat_ix = _seats.index[seat]
         suit_ix = _suits.index[suit]
@@ -596,41 +822,14 @@ class Game:
         return [_make_action_event(actor, i) for i in possible_ids]
 
     def possible_action_indices(self, deal):
-        possible = []
-        state = deal._state
-        actor_ix = state.next_to_act
-        if state.stage == DealState.STAGE_BIDDING:
-            if not state.bidding_is_open:
-                return list(range(36))
-            last_bid_action_id = \
-                    5 * state.last_bid_level + state.last_bid_strain
-            possible = list(range(last_bid_action_id + 1, 35))
-            for i, call in enumerate(_calls.tokens):
-                hdeal = self.make_call(deal.copy_replay_state(), call)
-                if not hdeal.error:
-                    possible.append(35 + i)
-        else:
-            if state.dealt_cards[actor_ix, :, :].sum() == 13:
-                cards_left = (state.dealt_cards[actor_ix, :, :] & ~state.played_cards[:, :])
-                follow_suit = state.trick_suit
-                if state.trick_position == 0:
-                    follow_suit = None
-                if follow_suit is not None and \
-                        cards_left[follow_suit].sum() == 0:
-                    follow_suit = None
-                for suit in range(4):
-                    if follow_suit is not None and suit != follow_suit:
-                        continue
-                    for rank in range(13):
-                        if cards_left[suit][rank]:
-                            possible.append(38 + 13 * suit + rank)
-            else:
-                for i, suit in enumerate(_suits.tokens):
-                    for j, rank in enumerate(_ranks.tokens):
-                        hdeal = self.play_card(copy.deepcopy(deal), suit, rank)
-                        if not hdeal.error:
-                            possible.append(38 + 13 * i + j)
-        return possible
+        return np.flatnonzero(self.legal_action_mask(deal)).tolist()
+
+    def legal_action_mask(self, deal, out=None):
+        """Returns a bool array over action ids; True if legal for the actor.
+
+        Partially known hands are allowed any card they may still hold.
+        """
+        return deal._state.legal_action_mask(out)
 
     def make_bid(self, deal, level, strain):
         level_ix = _levels.index[level]
@@ -654,41 +853,328 @@ class Game:
         elif action.is_play():
             return self.play_card(deal, action.suit(), action.rank())
 
-    def execute_action_index(self, deal, action_id):
-        return self.execute_action_ids(deal, [action_id])
+    def execute_action_index(self, deal, action_id, undo_record=None):
+        undo_records = None
+        if undo_record is not None:
+            undo_records = undo_record.reshape(1, -1)
+        return self.execute_action_ids(deal, [action_id], undo_records)
+
+    def execute_action_ids(self, deal, action_ids, undo_records=None):
+        """Executes action_ids in order, stopping at the first error.
 
-    def execute_action_ids(self, deal, action_ids):
+        If undo_records is given, as from new_undo_records(len(action_ids)),
+        row i is filled in so that undo_action can revert action_ids[i].
+        """
+        if deal._checkpoints is not None:
+            return self._execute_checkpointed(deal, action_ids, undo_records)
         l = deal._history_length
-        n = deal._state.execute_action_ids(action_ids, deal._history[l:,:])
+        n = deal._state.execute_action_ids(
+                action_ids, deal._history[l:,:], undo_records)
         deal._history_length += n
         return deal
 
+    def _execute_checkpointed(self, deal, action_ids, undo_records):
+        """Executes action_ids up to each checkpoint in turn, recording it."""
+        state = deal._state
+        i = 0
+        while i < len(action_ids):
+            if state.stage == DealState.STAGE_PLAY:
+                m = 4 - state.trick_position
+            else:
+                m = 1
+            records = None
+            if undo_records is not None:
+                records = undo_records[i:i + m]
+            l = deal._history_length
+            n = state.execute_action_ids(
+                    action_ids[i:i + m], deal._history[l:,:], records)
+            deal._history_length += n
+            if n < len(action_ids[i:i + m]):
+                break
+            self._record_checkpoint(deal)
+            i += m
+        return deal
+
+    def _record_checkpoint(self, deal):
+        state = deal._state
+        n = deal._history_length
+        if state.stage == DealState.STAGE_BIDDING:
+            if n % (4 * deal._checkpoint_interval) != 0:
+                return
+        elif state.stage == DealState.STAGE_PLAY:
+            if (state.trick_position != 0 or
+                    state.tricks_taken.sum() % deal._checkpoint_interval != 0):
+                return
+        else:
+            return
+        deal._checkpoints.append((n, state._vector.copy()))
+
+    def record_checkpoints(self, deal, interval=1):
+        """Keeps copies of deal's state as it is played, for seek.
+
+        A copy is kept after each interval of tricks, from the end of the
+        auction, and after each 4 * interval calls of the auction, so that
+        seek executes at most 4 * interval actions. Each copy takes
+        STATE_SIZE bytes, see Deal.checkpoint_nbytes. The actions already
+        executed are replayed from deal's dealt cards, which must hold
+        every card, to record theirs.
+        """
+        replay = self._first_state(deal)
+        replay._checkpoints = []
+        replay._checkpoint_interval = interval
+        self._record_checkpoint(replay)
+        replay = self.execute_action_ids(replay,
+                deal._history[:deal._history_length, 1].copy())
+        self._check_replay(replay, deal)
+        deal._checkpoints = replay._checkpoints
+        deal._checkpoint_interval = interval
+        return deal
+
+    def _first_state(self, deal):
+        """A new deal with deal's dealer and cards, and no actions."""
+        first = self.Deal()
+        first = self.set_dealer_index(first, deal._dealer_ix())
+        first._state.add_cards(None, deal._state.dealt_cards)
+        first._state.played_cards[:] = deal._state.played_cards
+        first._state.played_cards[:] -= _played_cards(
+                deal._history[:deal._history_length, 1])
+        first._state.rehash()
+        return first
+
+    def _check_replay(self, replay, deal):
+        if (replay._history_length != deal._history_length or
+                (replay._state._vector != deal._state._vector).any()):
+            raise ValueError("deal does not replay from its dealt cards")
+
+    def seek(self, deal, action_index):
+        """Returns a copy of deal as it was after action_index actions.
+
+        Starts from the last checkpoint kept by record_checkpoints, or if
+        there are none, replays from deal's dealt cards as that does.
+        """
+        if deal._checkpoints is None:
+            deal = self.record_checkpoints(deal.copy_replay_state())
+        if not 0 <= action_index <= deal._history_length:
+            raise ValueError("no action index {}".format(action_index))
+        i = bisect.bisect_right(deal._checkpoints, action_index,
+                key=lambda checkpoint: checkpoint[0])
+        n, vector = deal._checkpoints[i - 1]
+        sought = deal.copy_replay_state()
+        del sought._checkpoints[i:]
+        sought._state._vector[:] = vector
+        sought._history[n:] = -1
+        sought._history_length = n
+        return self.execute_action_ids(sought,
+                deal._history[n:action_index, 1])
+
+    def undo_action(self, deal, undo_record):
+        """Reverts the last action executed on deal, including one that
+        failed with an error.
+
+        Raises ValueError if undo_record does not belong to that action.
+        """
+        l = deal._history_length
+        if deal._state.stage != DealState.STAGE_ERROR:
+            l -= 1
+        if l < 0:
+            raise ValueError("no action to undo")
+        deal._state.undo_action(deal._history[l], undo_record)
+        deal._history[l,:] = -1
+        deal._history_length = l
+        if deal._checkpoints and deal._checkpoints[-1][0] > l:
+            deal._checkpoints.pop()
+        return deal
+
+    def execute_action_ids_batch(self, deals, action_ids):
+        """Batch version of execute_action_ids, one list of ids per deal.
+
+        action_ids is either a list of lists, or an (N, K) array padded
+        with -1.
+        """
+        if not deals:
+            return deals
+        if any(deal._checkpoints is not None for deal in deals):
+            for deal, ids in zip(deals, action_ids):
+                self.execute_action_ids(deal, [i for i in ids if i >= 0])
+            return deals
+        ids = _padded_action_ids(action_ids)
+        histories = np.full(ids.shape + (2,), -1, dtype=np.int8)
+        states = [deal._state for deal in deals]
+        counts = type(states[0]).execute_action_ids_batch(
+                states, ids, histories)
+        num_ids = (ids >= 0).sum(axis=1)
+        for deal, history, m, n in zip(deals, histories, num_ids, counts):
+            l = deal._history_length
+            deal._history[l:l + m,:] = history[:m]
+            deal._history_length += n
+        return deals
+
     def _set_error(self, deal, msg):
         deal._state.set_error(msg)
         return deal
 
+    def double_dummy_tricks(self, deal, strain=None, declarer=None):
+        """Tricks the declaring side takes with perfect play by all seats.
+
+        With no strain and declarer, deal must be in the play stage, and
+        the result includes the tricks already taken. Otherwise the play
+        of deal's cards starts afresh with the given strain and declarer,
+        e.g. "notrump", "South". Every card must be dealt.
+        """
+        if strain is None and declarer is None:
+            state = deal._state
+        else:
+            state = self._opening_lead_state(
+                    deal, _strains.index[strain], _seats.index[declarer])
+        return fastgame.double_dummy(state.packed_state())
+
+    def double_dummy_table(self, deal):
+        """Double dummy tricks of deal for each strain and declarer.
+
+        Returns a (5, 4) array indexed like _strains and _seats.
+        """
+        return fastgame.double_dummy_table(
+                self._opening_lead_state(deal, 0, 0).packed_state())
+
+    def double_dummy_tables(self, deals, workers=None):
+        """Stacked double_dummy_table of each deal, over a process pool.
+
+        workers defaults to the number of CPUs; with workers=1 the tables
+        are computed in this process. Each worker solves its deals with one
+        transposition table.
+        """
+        packed = np.stack([self._opening_lead_state(deal, 0, 0).packed_state()
+                for deal in deals])
+        workers = min(workers or os.cpu_count() or 1, len(packed))
+        if workers <= 1:
+            return fastgame.double_dummy_table(packed)
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            return np.concatenate(list(executor.map(
+                fastgame.double_dummy_table,
+                np.array_split(packed, min(4 * workers, len(packed))))))
+
+    def random_playouts(self, deal, n, seed=0, prior=None):
+        """Plays deal out n times with random legal actions.
+
+        Actions are uniform, or weighted by prior, a (num_actions,) array.
+        Returns (tricks, contracts), each (n, 4) int8: the tricks taken by
+        each seat, and the level, strain, declarer and double indices of the
+        contract, -1 when passed out. Both rows are -1 for a playout that
+        ran into an inconsistency in partly hidden hands.
+        """
+        return fastgame.random_playouts(deal._state._vector, n, seed, prior)
+
+    def sample_consistent_deals(self, view, n, rng, as_deals=False):
+        """Deals the cards hidden in view out at random, n times.
+
+        Every sample keeps the known and played cards of view and lengths
+        within its min_length and max_length, and all such deals are
+        equally likely. Returns an (n, 4, 4, 13) array indexed like
+        dealt_cards, or with as_deals, n copies of view with the cards
+        added. Raises ValueError if no deal is consistent with view.
+        """
+        dealt = fastgame.sample_consistent_deals(
+                view._state._vector, n, rng.getrandbits(64))
+        if not as_deals:
+            return dealt
+        deals = []
+        for cards in dealt:
+            deal = view.copy_replay_state()
+            deal._state.add_cards(None, cards)
+            deals.append(deal)
+        return deals
+
+    def _opening_lead_state(self, deal, strain_ix, declarer_ix):
+        state = FastDealState(dealt_cards=deal._state.dealt_cards)
+        state.played_cards[:,:13 - self.num_ranks] = 1
+        state.stage = DealState.STAGE_PLAY
+        state.last_bid_strain = strain_ix
+        state.declarer = declarer_ix
+        state.next_to_act = (declarer_ix + 1) % 4
+        state.trick_position = 0
+        state.rehash()
+        return state
+
+    def all_actor_views(self, deal, out=None):
+        """Encodes the actor_view before each of deal's actions at once.
+
+        Returns ActorViews of arrays with a row per action: observations
+        as encode_observations, into out if given, the actors and
+        action_ids from deal's history, and the legal_masks of the
+        actors. deal's actions are replayed once from its dealt cards,
+        which must hold every card.
+        """
+        n = deal._history_length
+        history = deal._history[:n]
+        states = np.zeros((n, fastgame.STATE_SIZE), dtype=np.int8)
+        replay = self._first_state(deal)
+        for i in range(n):
+            states[i] = replay._state._vector
+            self.execute_action_index(replay, history[i, 1])
+        self._check_replay(replay, deal)
+        histories = np.where(np.arange(len(deal._history))[None,:,None]
+                < np.arange(n)[:,None,None], deal._history, -1)
+        vulnerable = [vulnerable_sides(deal.vulnerability)] * n
+        legal_masks = np.zeros((n, num_actions), dtype=bool)
+        fastgame.legal_action_mask(states, legal_masks)
+        return ActorViews(
+                encode_observations(states, histories, vulnerable, out),
+                history[:, 0].copy(), history[:, 1].copy(), legal_masks)
+
     def kibitzer_view(self, deal, action_index):
-        view = self._replay(deal, action_index)
-        view._state.add_cards(None, deal._state.dealt_cards)
-        return view
+        return self._view(deal, action_index, _KIBITZER)
 
     def table_view(self, deal, action_index):
-        view = self._replay(deal, action_index)
-        return view
+        return self._view(deal, action_index, _TABLE)
 
     def actor_view(self, deal, action_index):
-        view = self._replay(deal, action_index)
-        actor_ix = view._state.next_to_act
-        if actor_ix is None:
-            view._state.add_cards(None, deal._state.dealt_cards)
+        return self._view(deal, action_index, _ACTOR)
+
+    def _view(self, deal, action_index, observer):
+        """Creates the view of deal after action_index actions that observer
+        has: the public information, and the hands observer can see.
+
+        A deal holding every card is copied as it was after action_index
+        actions, and the cards observer cannot see are masked out. That is
+        the deal itself at its last action, or else seek from its
+        checkpoints if record_checkpoints kept any, or else a copy replayed
+        from its dealt cards; deal itself is left unchanged. Call
+        record_checkpoints first for many views of one deal. Other deals
+        replay each call and play onto a public view.
+        """
+        view = self._full_view(deal, action_index)
+        if view is None:
+            view = self._replay(deal, action_index)
+            for seat in _visible_seats(view._state, observer):
+                view._state.add_cards(seat, deal._state.dealt_cards)
             return view
-        if view._state.stage == DealState.STAGE_PLAY:
-            if actor_ix % 2 == view._state.declarer % 2:
-                view._state.add_cards(view._state.declarer, deal._state.dealt_cards)
-            else:
-                view._state.add_cards(actor_ix, deal._state.dealt_cards)
-        else:
-            view._state.add_cards(actor_ix, deal._state.dealt_cards)
+        view._checkpoints = None
+        view._checkpoint_interval = 1
+        visible = 0
+        for seat in _visible_seats(view._state, observer):
+            visible |= 1 << seat
+        if not fastgame.mask_hidden_cards(view._state._vector, view._history,
+                view._history_length, visible):
+            view._state.set_error("Revoke?")
+        return view
+
+    def _full_view(self, deal, action_index):
+        """A copy of deal as it was after action_index actions, or None
+        unless deal holds every card and has no error."""
+        if (deal._state.stage == DealState.STAGE_ERROR or
+                np.count_nonzero(deal._state._vector[:208]) != 52):
+            return None
+        if action_index >= deal._history_length:
+            return deal.copy_replay_state()
+        if deal._checkpoints is not None:
+            return self.seek(deal, action_index)
+        view = deal.copy_replay_state()
+        view._state._vector[:] = self._first_state(deal)._state._vector
+        view._history[:] = -1
+        view._history_length = 0
+        view = self.execute_action_ids(view, deal._history[:action_index, 1])
+        if view._state.stage == DealState.STAGE_ERROR:
+            return None
         return view
 
     def _replay(self, deal, action_index):
@@ -701,12 +1187,16 @@ class Game:
         view.scoring = deal.scoring
         view.result = deal.result
         view = self.set_dealer(view, deal.dealer())
+        if self.num_ranks < 13:
+            # The low ranks random_deal plays before the auction are
+            # public, and keep 13 cards in each hand and suit.
+            low_ranks = np.zeros_like(deal._state.dealt_cards)
+            low_ranks[:,:,:13 - self.num_ranks] = (
+                    deal._state.dealt_cards[:,:,:13 - self.num_ranks])
+            view._state.add_cards(None, low_ranks)
+            view._state.played_cards[:,:13 - self.num_ranks] = 1
+            view._state.rehash()
         view = self.execute_action_ids(view, deal._history[:action_index,1])
-        if view._state.stage == DealState.STAGE_SCORING:
-            view._state.add_cards(None, deal._state.dealt_cards)
-        elif view._state.dummy_is_public():
-            dummy_ix = (view._state.declarer + 2) % 4
-            view._state.add_cards(dummy_ix, deal._state.dealt_cards)
         return view
 
     def add_explanation(self, deal, explanation):
@@ -731,6 +1221,8 @@ class Deal:
         self.vulnerability =  None
         self.scoring =  None
         self.result = None
+        self._checkpoints = None
+        self._checkpoint_interval = 1
 
     @property
     def error(self):
@@ -742,8 +1234,23 @@ class Deal:
         new_deal._state = copy.copy(self._state)
         new_deal._state._vector = self._state._vector.copy()
         new_deal._history = self._history.copy()
+        if self._checkpoints is not None:
+            new_deal._checkpoints = list(self._checkpoints)
         return new_deal
 
+    def checkpoint_nbytes(self):
+        """Bytes taken by the states kept by Game.record_checkpoints."""
+        if self._checkpoints is None:
+            return 0
+        return sum(vector.nbytes for n, vector in self._checkpoints)
+
+    def state_hash(self):
+        """A 64-bit hash of the rules state, equal for transposed positions.
+
+        The action history, names and scoring are not included.
+        """
+        return self._state.state_hash()
+
     def history_string(self):
         return '+'.join(self._history[:self.history_length, 1])
 
@@ -1338,6 +1845,20 @@ class Tokens(object):
         self.tokens = tokens
         self.index = {v:i for i, v in enumerate(tokens)}
         self.rindex = {i:v for i, v in enumerate(tokens)}
+        self.array = np.array(tokens)
+
+    def ids_to_tokens(self, ids):
+        """Vectorized rindex: an array of the tokens of an array of ids."""
+        return self.array.take(ids)
+
+    def tokens_to_ids(self, tokens):
+        """An int32 array of the ids of a sequence of tokens.
+
+        Raises KeyError for a token not in the list. A dict lookup per
+        token is faster than any numpy search over strings.
+        """
+        index = self.index
+        return np.array([index[t] for t in tokens], dtype=np.int32)
 
 
 _extra = Tokens([
@@ -1402,6 +1923,15 @@ first_action_id = all_tokens.index[_actions.tokens[0]]
 first_score_id = all_tokens.index[_scores.tokens[0]]
 first_action_verb_id = all_tokens.index[_action_verbs.tokens[0]]
 
+# all_tokens ids by seat index, by [seat index, verb] for bids and plays,
+# by action id, by card id (13 * suit + rank) and by score + 24.
+seat_token_ids = all_tokens.tokens_to_ids(_seats.tokens)
+action_verb_token_ids = all_tokens.tokens_to_ids(
+        _action_verbs.tokens).reshape(2, 4).T.copy()
+action_token_ids = all_tokens.tokens_to_ids(_actions.tokens)
+card_token_ids = action_token_ids[len(_bids.tokens) + len(_calls.tokens):]
+score_token_ids = all_tokens.tokens_to_ids(_scores.tokens)
+
 
 _IMP_table = [ 20, 50, 90, 130, 170, 220, 270, 320, 370, 430, 500, 600, 750,
         900, 1100, 1300, 1500, 1750, 2000, 2250, 2500, 3000, 3500, 5000, 1e99 ]
@@ -1455,5 +1985,21 @@ def _make_action_event(seat_ix, action_ix):
 def _make_trick_event(seat):
     return Event([seat, "takes_trick"])
 
+def _played_cards(action_ids):
+    """The (4, 13) cards, by suit and rank, among action_ids."""
+    played = np.zeros(52, dtype=np.int8)
+    played[action_ids[action_ids >= 38] - 38] = 1
+    return played.reshape(4, 13)
+
+
+def _padded_action_ids(action_ids):
+    if isinstance(action_ids, np.ndarray):
+        return action_ids.astype(np.int8, copy=False)
+    width = max((len(ids) for ids in action_ids), default=0)
+    padded = np.full((len(action_ids), width), -1, dtype=np.int8)
+    for i, ids in enumerate(action_ids):
+        padded[i,:len(ids)] = ids
+    return padded
+
 if __name__ == "__main__":
     print(len(all_tokens.tokens))
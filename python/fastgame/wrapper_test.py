@@ -10,6 +10,7 @@ import time
 import bridge.fastgame.wrapper as bridgegame
 import bridge.game as origgame
 import bridge.lin as lin
+import bridgebot.bridge.tokens as tokens
 import scaffold.fsa as fsa
 
 
@@ -27,6 +28,17 @@ class Reader(io.StringIO):
         self.name = "test"
 
 
+class StringActionsGame:
+    """game, without execute_action_ids, so lin parses it action by action."""
+    def __init__(self, game):
+        self.game = game
+
+    def __getattr__(self, name):
+        if name == "execute_action_ids":
+            raise AttributeError(name)
+        return getattr(self.game, name)
+
+
 class StateTest(absltest.TestCase):
     def test_init(self):
         state = bridgegame.DealState(3, 0, 2, 4)
@@ -44,6 +56,41 @@ class StateTest(absltest.TestCase):
         state.dealt_cards[1][2][3] = 5
         self.assertEqual(state._vector[3 + 2 * 13 + 1 * 4 * 13], 5)
 
+    def test_shrink_lengths(self):
+        for cls in [bridgegame.DebugDealState, bridgegame.FastDealState]:
+            state = cls()
+            state.dealt_cards[2,3,:] = 1
+            state.min_length[1,:3] = 3
+            self.assertTrue(state.shrink_lengths())
+            self.assertAllEqual(state.min_length,
+                    [[0, 0, 0, 0], [3, 3, 3, 0], [0, 0, 0, 13], [0, 0, 0, 0]])
+            self.assertAllEqual(state.max_length,
+                    [[10, 10, 10, 0], [7, 7, 7, 0], [0, 0, 0, 13],
+                     [10, 10, 10, 0]])
+            state.min_length[0,0] = 11
+            self.assertFalse(state.shrink_lengths())
+
+    def test_add_cards(self):
+        cards = numpy.zeros((4, 4, 13), dtype=numpy.int8)
+        cards[0,0,:5] = 1
+        cards[2,1,:4] = 1
+        for cls in [bridgegame.DebugDealState, bridgegame.FastDealState]:
+            state = cls()
+            state.min_length[0,:] = 2
+            state.add_cards(2, cards)
+            self.assertAllEqual(state.dealt_cards[0], 0)
+            self.assertAllEqual(state.dealt_cards[2], cards[2])
+            self.assertAllEqual(state.min_length,
+                    [[2, 2, 2, 2], [0, 0, 0, 0], [0, 4, 0, 0], [0, 0, 0, 0]])
+            state.add_cards(None, cards)
+            self.assertAllEqual(state.dealt_cards, cards)
+            self.assertAllEqual(state.min_length,
+                    [[5, 2, 2, 2], [0, 0, 0, 0], [0, 4, 0, 0], [0, 0, 0, 0]])
+            self.assertEqual(state.stage, None)
+
+    def assertAllEqual(self, actual, expected):
+        numpy.testing.assert_array_equal(actual, expected)
+
 
 class GameTest(absltest.TestCase):
     def setUp(self):
@@ -412,6 +459,330 @@ class GameTest(absltest.TestCase):
             self.assertEqual(errors, {})
             self.assertEqual(len(boards), 1)
 
+    def test_played_game_from_deal(self):
+        orig = origgame.Game()
+        expected = orig.played_game_from_deal(
+                self.lin.parse_single(Reader(self.good_lin[0]), orig))
+        for name, game in self.games.items():
+            deal = self.lin.parse_single(Reader(self.good_lin[0]), game)
+            played_game = game.played_game_from_deal(deal)
+            self.assertEqual(played_game.SerializeToString(deterministic=True),
+                    expected.SerializeToString(deterministic=True))
+
+    def test_lin_action_ids(self):
+        lindata = self.good_lin[0]
+        variants = [lindata,
+                lindata.replace("mb|1N|", "mb|1n|").replace("mb|p|", "mb|P|"),
+                lindata.replace("mb|1H|", "mb|1X|"),
+                lindata.replace("pc|cJ|", "pc|c6|"),
+                lindata.replace("pc|c5|pc|h2|pg||", "pc|c5|pc|c6|"),
+                lindata.replace("pc|c5|pc|h2|pg||", "pc|c5|pc|z2|"),
+                lindata.replace("pc|c5|pc|h2|", "pc|c5|pc|c6|"),
+                lindata.replace("pc|cJ|", "pc|c6|").replace("pc|h6|", "pc|z6|"),
+                lindata.replace("mb|1H|", "mb|1C|").replace("mb|2H|", "mb|2X|"),
+                lindata.replace("3SK97", "3SKK7"),
+                lindata.replace("pc|d2|", "an|d2 is odd|pc|d2|"),
+                lindata.replace("pc|c5|", "mc|9|pc|c5|")]
+        outcomes = set()
+        for name, game in self.games.items():
+            if not hasattr(game, 'execute_action_ids'):
+                continue
+            for lindata in variants:
+                results = []
+                for g in [game, StringActionsGame(game)]:
+                    tokens, err = self.lin.tokenize(Reader(lindata))
+                    header, tokens, err = self.lin.parse_header(tokens)
+                    results.append(self.lin.parse_deal(header, tokens, g))
+                (deal, err), (expected, expected_err) = results
+                self.assertEqual(err, expected_err)
+                if expected is None:
+                    self.assertIsNone(deal)
+                else:
+                    self.assertDealEqual(deal, expected)
+                outcomes.add((err, expected and expected.error))
+        self.assertGreater(len(outcomes), 5)
+
+    def test_lin_action_id_runs(self):
+        for name, game in self.games.items():
+            if not hasattr(game, 'execute_action_ids'):
+                continue
+            runs = []
+
+            class CountingGame(StringActionsGame):
+                def execute_action_ids(self, deal, action_ids):
+                    runs.append(len(action_ids))
+                    return self.game.execute_action_ids(deal, action_ids)
+
+            deal = self.lin.parse_single(Reader(self.good_lin[0]),
+                    CountingGame(game))
+            self.assertIsNone(deal.error)
+            self.assertEqual(runs, [deal.num_actions()])
+
+    def test_execute_action_ids_batch(self):
+        for name, game in self.games.items():
+            if not hasattr(game, 'execute_action_ids_batch'):
+                continue
+            orig_deal = self.lin.parse_single(Reader(self.good_lin[0]), game)
+            ids = orig_deal._history[:orig_deal.num_actions(), 1]
+            ragged = [ids[:n] for n in (0, 5, 11, 12, len(ids))] + [[0, 0]]
+
+            def new_deal():
+                deal = game.set_dealer(game.Deal(), orig_deal.dealer())
+                deal._state.add_cards(None, orig_deal.dealt_cards)
+                return deal
+
+            deals = game.execute_action_ids_batch(
+                    [new_deal() for _ in ragged], ragged)
+            for deal, deal_ids in zip(deals, ragged):
+                expected = game.execute_action_ids(new_deal(), deal_ids)
+                self.assertStateEqual(deal._state, expected._state)
+                self.assertAllEqual(deal._history, expected._history)
+                self.assertEqual(deal.error, expected.error)
+            self.assertNotEqual(deals[-1].error, None)
+
+    def test_legal_action_mask(self):
+        for name, game in self.games.items():
+            if not hasattr(game, 'legal_action_mask'):
+                continue
+            deal = self.lin.parse_single(Reader(self.good_lin[0]), game)
+            views = []
+            for n in range(0, deal.num_actions(), 3):
+                views.append(game.actor_view(deal, n))
+                views.append(game.table_view(deal, n))
+            for view in views:
+                expected = [
+                    not game.execute_action_index(
+                        view.copy_replay_state(), i).error
+                    for i in range(bridgegame.num_actions)]
+                self.assertAllEqual(game.legal_action_mask(view), expected)
+
+            vectors = numpy.stack([view._state._vector for view in views])
+            masks = numpy.zeros((len(views), bridgegame.num_actions), bool)
+            bridgegame.fastgame.legal_action_mask(vectors, masks)
+            for view, mask in zip(views, masks):
+                self.assertAllEqual(mask, game.legal_action_mask(view))
+
+    def test_sample_consistent_deals(self):
+        deal = self.lin.parse_single(Reader(self.good_lin[0]), self.game)
+        rng = random.Random(6)
+        for n in range(0, deal.num_actions(), 4):
+            view = self.game.actor_view(deal, n)
+            state = view._state
+            dealt = self.game.sample_consistent_deals(view, 100, rng)
+            self.assertEqual(dealt.shape, (100, 4, 4, 13))
+            self.assertTrue((dealt.sum(axis=1) == 1).all())
+            self.assertTrue((dealt.sum(axis=(2, 3)) == 13).all())
+            self.assertTrue((dealt >= state.dealt_cards).all())
+            lengths = dealt.sum(axis=3)
+            self.assertTrue((lengths >= state.min_length).all())
+            self.assertTrue((lengths <= state.max_length).all())
+
+        samples = self.game.sample_consistent_deals(
+                view, 2, random.Random(7), as_deals=True)
+        for sample, cards in zip(samples, self.game.sample_consistent_deals(
+                view, 2, random.Random(7))):
+            self.assertAllEqual(sample.dealt_cards, cards)
+            self.assertEqual(sample.num_actions(), view.num_actions())
+            self.assertEqual(sample.error, None)
+            self.assertNotEqual(self.game.possible_action_indices(sample), [])
+
+        state.max_length[:] = state.dealt_cards.sum(axis=2)
+        with self.assertRaises(ValueError):
+            self.game.sample_consistent_deals(view, 1, rng)
+
+    def test_encode_observations(self):
+        deal = self.lin.parse_single(Reader(self.good_lin[0]), self.game)
+        deal.vulnerability = ["East", "West"]
+        prefix = self.game.set_dealer(self.game.Deal(), deal.dealer())
+        prefix._state.add_cards(None, deal.dealt_cards)
+        states, histories, views = [], [], []
+        for n in range(deal.num_actions() + 1):
+            states.append(prefix._state._vector.copy())
+            histories.append(prefix._history.copy())
+            views.append(self.game.actor_view(deal, n))
+            if n < deal.num_actions():
+                prefix = self.game.execute_action_index(
+                        prefix, deal._history[n, 1])
+        vulnerable = [bridgegame.vulnerable_sides(deal.vulnerability)
+                ] * len(states)
+        out = bridgegame.encode_observations(
+                numpy.stack(states), numpy.stack(histories), vulnerable)
+        self.assertEqual(out.shape,
+                (len(states), bridgegame.fastgame.OBSERVATION_SIZE))
+
+        for n, view in enumerate(views):
+            observation = numpy.zeros(
+                    bridgegame.fastgame.OBSERVATION_SIZE, numpy.float32)
+            bridgegame.fastgame.encode_observations(view._state._vector,
+                    view._history, [False, True], observation)
+            self.assertAllEqual(observation, out[n])
+
+            state = view._state
+            observer = state.next_to_act
+            if state.declarer is not None and observer == (
+                    state.declarer + 2) % 4:
+                observer = state.declarer
+            hand = state.dealt_cards[observer] & (1 - state.played_cards)
+            self.assertAllEqual(out[n, :52], hand.reshape(52))
+            self.assertEqual(out[n, 104:312].sum(),
+                    state.played_cards.sum())
+            self.assertAllEqual(out[n, 736:738],
+                    [observer % 2, 1 - observer % 2])
+            self.assertEqual(out[n, 738:742].sum(),
+                    state.next_to_act is not None)
+
+        # Dealer North is on the right of East, who acts second.
+        self.assertEqual(out[1, 312 + 3], 1)
+        self.assertEqual(out[1, 738], 1)
+        # 1D by South, doubled by West, as North sees them.
+        one_diamond = 5 * 0 + 1
+        self.assertEqual(out[4, 316 + 12 * one_diamond + 3 * 2 + 0], 1)
+        self.assertEqual(out[4, 316 + 12 * one_diamond + 3 * 3 + 1], 1)
+        self.assertEqual(out[4, 316:736].sum(), 2)
+
+    def test_packed_state(self):
+        deal = self.lin.parse_single(Reader(self.good_lin[0]), self.game)
+        first_play = [deal.action(n).is_play()
+                for n in range(deal.num_actions())].index(True)
+        view = self.game.kibitzer_view(deal, first_play)
+        packed = view._state.packed_state()
+        self.assertLess(len(packed), 64)
+        for n in range(first_play, deal.num_actions()):
+            self.assertAllEqual(packed, view._state.packed_state())
+            mask = numpy.zeros(bridgegame.num_actions, bool)
+            bridgegame.fastgame.packed_legal_action_mask(packed, mask)
+            self.assertAllEqual(mask, self.game.legal_action_mask(view))
+            action_id = deal._history[n, 1]
+            self.assertEqual(bridgegame.fastgame.execute_packed_action_ids(
+                    packed, [action_id]), (1, None))
+            view = self.game.execute_action_index(view, action_id)
+
+        n, err = bridgegame.fastgame.execute_packed_action_ids(
+                view._state.packed_state(), [38])
+        self.assertEqual(n, 0)
+        self.assertNotEqual(err, None)
+
+    def test_all_actor_views(self):
+        for name, game in self.games.items():
+            if not hasattr(game, 'all_actor_views'):
+                continue
+            deal = self.lin.parse_single(Reader(self.good_lin[0]), game)
+            views = game.all_actor_views(deal)
+            n = deal.num_actions()
+            self.assertEqual(views.observations.shape,
+                    (n, bridgegame.fastgame.OBSERVATION_SIZE))
+            self.assertAllEqual(views.actors, deal._history[:n, 0])
+            self.assertAllEqual(views.action_ids, deal._history[:n, 1])
+            for i in range(n):
+                view = game.actor_view(deal, i)
+                self.assertAllEqual(views.observations[i],
+                        bridgegame.encode_observations(
+                            view._state._vector[None], view._history[None],
+                            [[False, True]])[0])
+                self.assertAllEqual(views.legal_masks[i],
+                        game.legal_action_mask(view))
+                self.assertTrue(views.legal_masks[i, views.action_ids[i]])
+
+            out = numpy.zeros((n, bridgegame.fastgame.OBSERVATION_SIZE),
+                    numpy.float32)
+            self.assertIs(game.all_actor_views(deal, out).observations, out)
+            self.assertAllEqual(out, views.observations)
+
+    def test_seek(self):
+        def assertSameState(actual, expected):
+            self.assertAllEqual(actual._state._vector, expected._state._vector)
+            self.assertAllEqual(actual._history, expected._history)
+            self.assertEqual(actual.num_actions(), expected.num_actions())
+
+        rng = random.Random(7)
+        for name, game in self.games.items():
+            if not hasattr(game, 'seek'):
+                continue
+            for num_ranks, interval in [(13, 1), (13, 2), (3, 1)]:
+                game = bridgegame.Game(mode=game.mode, num_ranks=num_ranks)
+                deal = game.random_deal(rng)
+                unrecorded = deal.copy_replay_state()
+                deal = game.record_checkpoints(deal, interval)
+                expected = [deal.copy_replay_state()]
+                records = bridgegame.new_undo_records(bridgegame.num_actions)
+                while game.possible_action_indices(deal):
+                    action_id = rng.choice(game.possible_action_indices(deal))
+                    game.execute_action_index(deal, action_id,
+                            records[deal.num_actions()])
+                    game.execute_action_index(unrecorded, action_id)
+                    expected.append(deal.copy_replay_state())
+                assertSameState(deal, unrecorded)
+                self.assertEqual(deal.checkpoint_nbytes(),
+                        len(deal._checkpoints) * bridgegame.fastgame.STATE_SIZE)
+                self.assertLessEqual(len(deal._checkpoints),
+                        2 + deal.num_actions() // (4 * interval))
+                for n in range(deal.num_actions() + 1):
+                    sought = game.seek(deal, n)
+                    assertSameState(sought, expected[n])
+                    self.assertEqual(sought.num_actions(), n)
+                    self.assertLessEqual(
+                            n - sought._checkpoints[-1][0], 4 * interval)
+                for n in reversed(range(10, deal.num_actions())):
+                    game.undo_action(deal, records[n])
+                assertSameState(game.seek(deal, 9), expected[9])
+                self.assertEqual(game.seek(deal, 10)._checkpoints,
+                        deal._checkpoints)
+                with self.assertRaises(ValueError):
+                    game.seek(deal, 11)
+
+            deal = self.lin.parse_single(Reader(self.good_lin[0]), game)
+            self.assertEqual(deal.checkpoint_nbytes(), 0)
+            assertSameState(game.seek(deal, deal.num_actions()), deal)
+
+    def test_undo_action(self):
+        for name, game in self.games.items():
+            if not hasattr(game, 'undo_action'):
+                continue
+            deal = self.lin.parse_single(Reader(self.good_lin[0]), game)
+            view = game.actor_view(deal, 0)
+            records = bridgegame.new_undo_records(deal.num_actions())
+            for n in range(deal.num_actions()):
+                before = view.copy_replay_state()
+                for action_id in range(bridgegame.num_actions):
+                    record = bridgegame.new_undo_records(1)[0]
+                    game.execute_action_index(view, action_id, record)
+                    game.undo_action(view, record)
+                    self.assertDealEqual(view, before)
+                game.execute_action_index(
+                        view, deal._history[n, 1], records[n])
+                self.assertEqual(view.error, None)
+            with self.assertRaises(ValueError):
+                game.undo_action(view, records[0])
+            for n in reversed(range(deal.num_actions())):
+                game.undo_action(view, records[n])
+            self.assertDealEqual(view, game.actor_view(deal, 0))
+
+    def test_state_hash(self):
+        for name, game in self.games.items():
+            if not hasattr(game, 'undo_action'):
+                continue
+            deal = self.lin.parse_single(Reader(self.good_lin[0]), game)
+            hashes = set()
+            view = game.table_view(deal, 0)
+            for n in range(deal.num_actions()):
+                expected = view.copy_replay_state()
+                expected._state.rehash()
+                self.assertEqual(view.state_hash(), expected.state_hash())
+                hashes.add(view.state_hash())
+                view = game.execute_action_index(view, deal._history[n, 1])
+            self.assertEqual(len(hashes), deal.num_actions())
+
+            # Cards revealed by play, or known in advance.
+            transposed = game.table_view(deal, 0)
+            played = numpy.zeros_like(deal.dealt_cards)
+            for seat, action_id in deal._history[:deal.num_actions()]:
+                if action_id >= 38:
+                    played[seat].flat[action_id - 38] = 1
+            transposed._state.add_cards(None, played)
+            transposed = game.execute_action_ids(
+                    transposed, deal._history[:deal.num_actions(), 1])
+            self.assertEqual(transposed.state_hash(), view.state_hash())
+
 
     @absltest.skip
     def test_commentary(self):
@@ -709,6 +1080,265 @@ class NCardTest(absltest.TestCase):
         for name, game in self.games.items():
                 deal = game.random_deal(rng=random.Random())
 
+    def test_views(self):
+        rng = random.Random(9)
+        for name, game in self.games.items():
+            for _ in range(3):
+                deal = game.random_deal(rng=rng)
+                ids = game.possible_action_indices(deal)
+                while ids:
+                    deal = game.execute_action_index(deal, rng.choice(ids))
+                    ids = game.possible_action_indices(deal)
+                checkpointed = game.record_checkpoints(
+                        deal.copy_replay_state())
+                for i in range(deal.num_actions() + 1):
+                    for view, observer in [
+                            (game.actor_view(deal, i), bridgegame._ACTOR),
+                            (game.table_view(deal, i), bridgegame._TABLE),
+                            (game.kibitzer_view(deal, i),
+                                bridgegame._KIBITZER)]:
+                        self.assertIsNone(view.error, (name, i))
+                        replay = game._replay(deal, i)
+                        for seat in bridgegame._visible_seats(
+                                replay._state, observer):
+                            replay._state.add_cards(seat,
+                                    deal._state.dealt_cards)
+                        numpy.testing.assert_array_equal(
+                                view._state._vector, replay._state._vector)
+                        numpy.testing.assert_array_equal(
+                                view._history, replay._history)
+                    self.assertEqual(view.state_hash(),
+                            game.seek(deal, i).state_hash(), (name, i))
+                    numpy.testing.assert_array_equal(
+                            game.actor_view(checkpointed, i)._state._vector,
+                            game.actor_view(deal, i)._state._vector)
+                self.assertIsNone(deal._checkpoints)
+
+    def test_transposed_state_hash(self):
+        def visit(game, deal, depth, hashes, paths):
+            state = deal._state
+            if state.trick_position == 0:
+                key = (state.played_cards.tobytes(),
+                        state.tricks_taken.tobytes(), state.next_to_act)
+                hashes.setdefault(key, set()).add(deal.state_hash())
+                paths[key] = paths.get(key, 0) + 1
+            if depth == 0:
+                return
+            for i in game.possible_action_indices(deal):
+                visit(game, game.execute_action_index(
+                    deal.copy_replay_state(), i), depth - 1, hashes, paths)
+
+        rng = random.Random(1)
+        for name, game in self.games.items():
+            if game.num_ranks not in (2, 3):
+                continue
+            deal = game.execute_action_ids(game.random_deal(rng=rng),
+                    [4, 35, 35, 35])
+            hashes, paths = {}, {}
+            visit(game, deal, 8, hashes, paths)
+            self.assertGreater(max(paths.values()), 1, name)
+            for key, key_hashes in hashes.items():
+                self.assertLen(key_hashes, 1, name)
+
+    def test_double_dummy(self):
+        def brute_force(game, deal):
+            ids = game.possible_action_indices(deal)
+            if not ids:
+                return deal._state.tricks_taken[deal._state.declarer % 2::2].sum()
+            values = [brute_force(game, game.execute_action_index(
+                    deal.copy_replay_state(), i)) for i in ids]
+            if deal._state.next_to_act % 2 == deal._state.declarer % 2:
+                return max(values)
+            return min(values)
+
+        rng = random.Random(3)
+        for name, game in self.games.items():
+            if game.num_ranks > 3:
+                continue
+            for _ in range(5):
+                deal = game.random_deal(rng=rng)
+                strain = rng.randrange(5)
+                self.assertEqual(
+                    game.double_dummy_tricks(deal.copy_replay_state(),
+                        bridgegame._strains.tokens[strain], deal.dealer()),
+                    brute_force(game, game.execute_action_ids(
+                        deal.copy_replay_state(), [strain, 35, 35, 35])))
+                deal = game.execute_action_ids(deal, [strain, 35, 35, 35])
+                for n in range(4):
+                    self.assertEqual(game.double_dummy_tricks(deal),
+                            brute_force(game, deal))
+                    ids = game.possible_action_indices(deal)
+                    deal = game.execute_action_index(deal, rng.choice(ids))
+
+    def test_double_dummy_table(self):
+        rng = random.Random(4)
+        game = bridgegame.Game(num_ranks=4)
+        deals = [game.random_deal(rng=rng) for _ in range(6)]
+        tables = game.double_dummy_tables(deals, workers=2)
+        self.assertEqual(tables.shape, (6, 5, 4))
+        numpy.testing.assert_array_equal(
+                tables, game.double_dummy_tables(deals, workers=1))
+        for deal, table in zip(deals, tables):
+            numpy.testing.assert_array_equal(
+                    game.double_dummy_table(deal), table)
+            for strain in range(5):
+                for declarer in range(4):
+                    self.assertEqual(table[strain, declarer],
+                        game.double_dummy_tricks(deal,
+                            bridgegame._strains.tokens[strain],
+                            bridgegame._seats.tokens[declarer]))
+
+    def test_double_dummy_table_13_cards(self):
+        rng = random.Random(1)
+        game = bridgegame.Game()
+        deals = [game.random_deal(rng=rng) for _ in range(3)]
+        # Reference tables from DDS.
+        expected = [
+            [[6, 7, 6, 7], [11, 1, 11, 1], [9, 4, 9, 4], [5, 8, 5, 8],
+                [8, 3, 8, 3]],
+            [[10, 2, 10, 2], [11, 2, 11, 2], [5, 7, 5, 7], [4, 8, 4, 8],
+                [11, 2, 11, 2]],
+            [[4, 8, 4, 8], [4, 8, 4, 8], [8, 4, 8, 4], [3, 10, 3, 10],
+                [4, 6, 4, 6]],
+        ]
+        start = time.perf_counter()
+        tables = [game.double_dummy_table(deal) for deal in deals]
+        t = time.perf_counter() - start
+        print(f"double_dummy_table 13 cards: {1000*t/len(deals)}ms")
+        numpy.testing.assert_array_equal(tables, expected)
+        self.assertLess(t, 60)
+
+    def test_random_playouts(self):
+        rng = random.Random(5)
+        for name, game in self.games.items():
+            deal = game.random_deal(rng=rng)
+            tricks, contracts = game.random_playouts(deal, 50, seed=1)
+            self.assertEqual(tricks.shape, (50, 4))
+            self.assertEqual(contracts.shape, (50, 4))
+            numpy.testing.assert_array_equal(tricks,
+                    game.random_playouts(deal, 50, seed=1)[0])
+            passed_out = contracts[:,0] < 0
+            numpy.testing.assert_array_equal(
+                    tricks.sum(axis=1), game.num_ranks * ~passed_out)
+
+            prior = numpy.zeros(bridgegame.num_actions)
+            prior[35] = 1
+            tricks, contracts = game.random_playouts(deal, 5, prior=prior)
+            numpy.testing.assert_array_equal(contracts, -1)
+            numpy.testing.assert_array_equal(tricks, 0)
+
+            deal = game.execute_action_ids(deal, [4, 35, 35, 35])
+            tricks, contracts = game.random_playouts(deal, 50, seed=2)
+            numpy.testing.assert_array_equal(tricks.sum(axis=1), game.num_ranks)
+            numpy.testing.assert_array_equal(contracts,
+                    [[0, 4, deal._state.declarer, 0]] * 50)
+
+
+class TokenizerTest(absltest.TestCase):
+    def setUp(self):
+        self.tokenizer = tokens.Tokenizer()
+        self.lin = lin.Parser()
+        self.lindata = [
+                """
+                rs|2HN+1|
+                pn|Ferov,Dunev,Andonov,nobody,,,,|pg||
+                qx|o9|st||md|3SK97H96DQJT98CA42,SAQJ5HKT4DA7CKJT5,ST86HAQ832DK52C73,S432HJ75D643CQ986|sv|e|pg||
+                mb|p|mb|p|mb|1D!|mb|d|mb|1H|mb|p|mb|1N|mb|d|mb|2H|mb|p|mb|p|mb|p|pg||
+                pc|c6|pc|c2|pc|cK|pc|c3|pg||
+                pc|cJ|pc|c7|pc|c8|pc|cA|pg||
+                pc|h6|pc|h4|pc|hQ|pc|h7|pg||
+                pc|d2|pc|d3|pc|dQ|pc|dA|pg||
+                pc|c5|pc|h2|pc|c9|pc|c4|pg||
+                pc|hA|pc|h5|pc|h9|pc|hT|pg||
+                pc|h3|pc|hJ|pc|s7|pc|hK|pg||
+                pc|cT|pc|h8|pc|cQ|pc|s9|pg||
+                pc|dK|pc|d4|pc|d8|pc|d7|pg||
+                """,
+                """
+                rs|PASS|
+                pn|,,,,,,,|pg||
+                qx|o9|st||md|3SK97H96DQJT98CA42,SAQJ5HKT4DA7CKJT5,ST86HAQ832DK52C73,S432HJ75D643CQ986|sv|b|pg||
+                mb|p|mb|p|mb|p|mb|p|pg||
+                """]
+
+    def test_tokens_to_ids(self):
+        ids = self.tokenizer.tokens_to_ids(["South", "pass"])
+        self.assertEqual(ids, [origgame.all_tokens.index["South"],
+                origgame.all_tokens.index["pass"]])
+        tokens = self.tokenizer.ids_to_tokens(ids)
+        self.assertEqual(tokens, ["South", "pass"])
+        self.assertIs(type(tokens[0]), str)
+
+    def test_view_to_ids(self):
+        fast = bridgegame.Game()
+        for lindata in self.lindata:
+            deal = self.lin.parse_single(Reader(lindata), origgame.Game())
+            fast_deal = self.lin.parse_single(Reader(lindata), fast)
+            for n in range(fast_deal.num_actions() + 1):
+                for view, fast_view in [
+                        (origgame.Game().actor_view(deal, n),
+                            fast.actor_view(fast_deal, n)),
+                        (origgame.Game().table_view(deal, n),
+                            fast.table_view(fast_deal, n))]:
+                    # The games differ on which cards a final view shows.
+                    view.dealt_cards = fast_view.dealt_cards.copy()
+                    expected = self.tokenizer.tokens_to_ids(
+                            self.tokenizer.tokenize_view(
+                                view, random.Random(n)))
+                    ids = self.tokenizer.view_to_ids(
+                            fast_view, random.Random(n))
+                    self.assertEqual(ids.dtype, numpy.int32)
+                    self.assertEqual(ids.tolist(), expected)
+
+    def test_views_to_ids(self):
+        fast = bridgegame.Game()
+        deal = self.lin.parse_single(Reader(self.lindata[0]), fast)
+        views = [fast.actor_view(deal, n) for n in [0, 20, 50]]
+        rng = random.Random(1)
+        rows = [self.tokenizer.view_to_ids(view, rng) for view in views]
+        ids, lengths = self.tokenizer.views_to_ids(views, random.Random(1))
+        self.assertEqual(lengths.tolist(), [len(row) for row in rows])
+        self.assertEqual(ids.shape, (3, max(lengths)))
+        for i, row in enumerate(rows):
+            numpy.testing.assert_array_equal(ids[i, :len(row)], row)
+            self.assertTrue((ids[i, len(row):] == 0).all())
+
+        ids, lengths = self.tokenizer.views_to_ids(views, random.Random(1),
+                length=40)
+        self.assertEqual(ids.shape, (3, 40))
+        numpy.testing.assert_array_equal(ids[2], rows[2][:40])
+
+    def test_session(self):
+        game = bridgegame.Game()
+        deal = self.lin.parse_single(Reader(self.lindata[0]), game)
+        replay = game.kibitzer_view(deal, 0)
+        session = tokens.TokenizerSession(replay, random.Random(2))
+        records = bridgegame.new_undo_records(deal.num_actions())
+        for n in range(deal.num_actions() + 1):
+            ids = session.update()
+            numpy.testing.assert_array_equal(ids,
+                    self.tokenizer.view_to_ids(replay, random.Random(2)))
+            if n < deal.num_actions():
+                game.execute_action_index(replay, deal._history[n, 1],
+                        records[n])
+        for n in reversed(range(20, deal.num_actions())):
+            game.undo_action(replay, records[n])
+        game.execute_action_index(replay, 35)
+        numpy.testing.assert_array_equal(session.update(),
+                self.tokenizer.view_to_ids(replay, random.Random(2)))
+
+        # Cards shown by play change the header.
+        view = game.table_view(deal, 0)
+        session = tokens.TokenizerSession(view, random.Random(3))
+        for n in range(deal.num_actions()):
+            game.execute_action_index(view, deal._history[n, 1])
+            ids = session.update()
+            expected = self.tokenizer.view_to_ids(view, random.Random(3))
+            self.assertEqual(len(ids), len(expected))
+            self.assertEqual(sorted(ids), sorted(expected))
+            header = session._header_length
+            numpy.testing.assert_array_equal(ids[header:], expected[header:])
+
 
 if __name__ == "__main__":
     absltest.main()
@@ -1009,6 +1009,20 @@ class Tokens(object):
         self.tokens = tokens
         self.index = {v:i for i, v in enumerate(tokens)}
         self.rindex = {i:v for i, v in enumerate(tokens)}
+        self.array = np.array(tokens)
+
+    def ids_to_tokens(self, ids):
+        """Vectorized rindex: an array of the tokens of an array of ids."""
+        return self.array.take(ids)
+
+    def tokens_to_ids(self, tokens):
+        """An int32 array of the ids of a sequence of tokens.
+
+        Raises KeyError for a token not in the list. A dict lookup per
+        token is faster than any numpy search over strings.
+        """
+        index = self.index
+        return np.array([index[t] for t in tokens], dtype=np.int32)
 
 
 _extra = Tokens([
@@ -1073,6 +1087,15 @@ first_action_id = all_tokens.index[_actions.tokens[0]]
 first_score_id = all_tokens.index[_scores.tokens[0]]
 first_action_verb_id = all_tokens.index[_action_verbs.tokens[0]]
 
+# all_tokens ids by seat index, by [seat index, verb] for bids and plays,
+# by action id, by card id (13 * suit + rank) and by score + 24.
+seat_token_ids = all_tokens.tokens_to_ids(_seats.tokens)
+action_verb_token_ids = all_tokens.tokens_to_ids(
+        _action_verbs.tokens).reshape(2, 4).T.copy()
+action_token_ids = all_tokens.tokens_to_ids(_actions.tokens)
+card_token_ids = action_token_ids[len(_bids.tokens) + len(_calls.tokens):]
+score_token_ids = all_tokens.tokens_to_ids(_scores.tokens)
+
 
 _IMP_table = [ 20, 50, 90, 130, 170, 220, 270, 320, 370, 430, 500, 600, 750,
         900, 1100, 1300, 1500, 1750, 2000, 2250, 2500, 3000, 3500, 5000, 1e99 ]
@@ -1,5 +1,8 @@
 import copy
 import io
+import mmap
+import random
+import tempfile
 from absl.testing import absltest
 import numpy.testing
 
@@ -10,6 +13,15 @@ import bridge.lin as lin
 import pdb
 
 
+_lin_header = """vg|Gabi Pleven Teams,Round 5_11,I,1,32,Avesta,0,Struma,0|
+                rs|,,,,,,,,,,,,,,,,2HN+1,1NSx=,3CN+2,3HW-4,3SE+1,4SE=,4SW-1,4SW-1,3NN+3,3NN=,3HW-1,2HW=,1NS=,2CW-2,4HE+1,4SE+1,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,|
+                pn|Ferov,Dunev,Andonov,Kovandzhiy,Slavov,Alexandrov,Videnova,Georgiev|pg||
+                """
+_lin_deal = """qx|{}|st||md|3SK97H96DQJT98CA42,SAQJ5HKT4DA7CKJT5,ST86HAQ832DK52C73,S432HJ75D643CQ986|sv|e|mb|p|mb|p|mb|1D!|mb|d|mb|1H|mb|p|mb|1N|mb|d|mb|2H|mb|p|mb|p|mb|p|pc|c6|pc|c2|pc|cK|pc|c3|pg||
+                pc|cJ|pc|c7|pc|c8|pc|cA|pg||
+                """
+
+
 class Reader(io.StringIO):
     def __init__(self, buffer=None):
         super().__init__(buffer)
@@ -46,6 +58,36 @@ class GameTest(absltest.TestCase):
         self.assertEqual(actual.result.tokens, expected.result.tokens)
         self.assertEqual(actual.error, expected.error)
 
+    def test_token_ids(self):
+        tokens = bridgegame.all_tokens
+        ids = tokens.tokens_to_ids(tokens.tokens)
+        self.assertEqual(ids.dtype, numpy.int32)
+        self.assertAllEqual(ids, range(len(tokens.tokens)))
+        self.assertAllEqual(tokens.ids_to_tokens(ids[::-1]),
+                tokens.tokens[::-1])
+        self.assertAllEqual(tokens.tokens_to_ids(["South", "pass"]),
+                [tokens.index["South"], tokens.index["pass"]])
+        self.assertEqual(len(tokens.tokens_to_ids([])), 0)
+        with self.assertRaises(KeyError):
+            tokens.tokens_to_ids(["South", "Sout"])
+
+        for i, token in enumerate(bridgegame._actions.tokens):
+            self.assertEqual(bridgegame.action_token_ids[i],
+                    tokens.index[token])
+        for i, token in enumerate(bridgegame._cards.tokens):
+            self.assertEqual(bridgegame.card_token_ids[i],
+                    tokens.index[token])
+        for i, seat in enumerate(bridgegame._seats.tokens):
+            self.assertEqual(bridgegame.seat_token_ids[i], tokens.index[seat])
+            self.assertEqual(bridgegame.action_verb_token_ids[i, 0],
+                    tokens.index[seat + "_bids"])
+            self.assertEqual(bridgegame.action_verb_token_ids[i, 1],
+                    tokens.index[seat + "_plays"])
+        for score in range(-24, 25):
+            token = "{0:+}".format(score) if score else "="
+            self.assertEqual(bridgegame.score_token_ids[score + 24],
+                    tokens.index[token])
+
     def test_duplicate_card(self):
         deal = self.game.Deal()
         deal = self.game.give_card(deal, "East", "Spade", "Two")
@@ -348,6 +390,141 @@ class GameTest(absltest.TestCase):
             boards, _ = self.lin.parse(Reader(lindata), self.game)
             self.assertEqual(len(boards), 1)
 
+    def test_iter_deals(self):
+        lindata = (_lin_header + _lin_deal.format("o9")
+                + _lin_deal.format("c9") + _lin_deal.format("x9")
+                + _lin_deal.format("c10").split("|pc|")[0] + "|pg||")
+        reader = Reader(lindata)
+        deals = self.lin.iter_deals(reader, self.game)
+        board_name, table_name, first = next(deals)
+        self.assertEqual((board_name, table_name), ("9", "o"))
+        self.assertLess(reader.tell(), lindata.index("qx|x9"))
+
+        error_counts = {}
+        deals = list(self.lin.iter_deals(Reader(lindata), self.game,
+            error_counts))
+        self.assertEqual([d[:2] for d in deals],
+                [("9", "o"), ("9", "c"), ("10", "c")])
+        self.assertEqual(error_counts, {"Unexpected room code": 1})
+        self.assertDealEqual(deals[0][2], first)
+        boards, errors = self.lin.parse(Reader(lindata), self.game)
+        self.assertEqual(errors, error_counts)
+        self.assertEqual(sorted(boards), ["10", "9"])
+        for board_name, table_name, deal in deals:
+            self.assertDealEqual(boards[board_name].tables[table_name], deal)
+
+        buffer_deals = list(self.lin.iter_buffer_deals(lindata.encode(),
+            self.game))
+        self.assertEqual(len(buffer_deals), len(deals))
+        for actual, expected in zip(buffer_deals, deals):
+            self.assertEqual(actual[:2], expected[:2])
+            self.assertDealEqual(actual[2], expected[2])
+
+    def test_resync(self):
+        lindata = (_lin_header
+                + _lin_deal.format("o9").replace("|pc|c2|", "|pcc2|")
+                + _lin_deal.format("c9") + "qx|o10|md|3SK97")
+        skipped = {
+            "Expected 2 letters in lin command":
+                lindata.index("qx|c9") - lindata.index("pcc2"),
+            "Malformed lin payload": len("md|3SK97"),
+        }
+        for name, deals in [
+                ("reader", lambda *args: self.lin.iter_deals(
+                    Reader(lindata), *args)),
+                ("buffer", lambda *args: self.lin.iter_buffer_deals(
+                    lindata.encode(), *args))]:
+            error_counts, skipped_bytes = {}, {}
+            result = list(deals(self.game, error_counts, skipped_bytes))
+            self.assertEqual([d[:2] for d in result], [("9", "c")], name)
+            self.assertEqual(error_counts,
+                    {err: 1 for err in skipped}, name)
+            self.assertEqual(skipped_bytes, skipped, name)
+        self.assertEqual(self.lin.tokenize(Reader(lindata)),
+                (None, "Expected 2 letters in lin command"))
+        boards, errors = self.lin.parse(Reader(lindata), self.game)
+        self.assertEqual(list(boards["9"].tables), ["c"])
+
+        lindata = "vgx|a|" + _lin_header + _lin_deal.format("o9")
+        error_counts, skipped_bytes = {}, {}
+        result = list(self.lin.iter_buffer_deals(lindata.encode(), self.game,
+            error_counts, skipped_bytes))
+        self.assertEqual(result, [])
+        self.assertEqual(error_counts, {"Expected 2 letters in lin command": 1,
+            "Player names not found": 1})
+        self.assertEqual(skipped_bytes, {"Expected 2 letters in lin command":
+            lindata.index("qx|o9")})
+
+    def assertTokenizersAgree(self, lindata):
+        self.assertEqual(list(self.lin._tokenize_lines(Reader(lindata))),
+                list(self.lin._tokenize_buffer(lindata.encode())), lindata)
+        results = []
+        for deals in [lambda *args: self.lin.iter_deals(Reader(lindata), *args),
+                lambda *args: self.lin.iter_buffer_deals(lindata.encode(),
+                    *args)]:
+            error_counts, skipped_bytes = {}, {}
+            result = deals(self.game, error_counts, skipped_bytes)
+            results.append(([d[:2] for d in result], error_counts,
+                    skipped_bytes))
+        self.assertEqual(results[0], results[1], lindata)
+
+    def test_tokenize_dirty_input(self):
+        lindata = (_lin_header + _lin_deal.format("o9").replace(
+                "pc|cA|pg||", "pc|cA|pg||xy") + _lin_deal.format("c9"))
+        self.assertTokenizersAgree(lindata)
+        error_counts, skipped_bytes = {}, {}
+        list(self.lin.iter_deals(Reader(lindata), self.game, error_counts,
+                skipped_bytes))
+        self.assertEqual(skipped_bytes, {"Expected 2 letters in lin command":
+                lindata.index("qx|c9") - lindata.index("xy")})
+
+        rng = random.Random(1)
+        lindata = _lin_header + _lin_deal.format("o9") + _lin_deal.format("c9")
+        pieces = ["", "|", "||", "pg||", "|pg||", "qx|", "nt|", "nt||", "\n",
+                " ", "x", "é"]
+        for _ in range(1000):
+            mutated = lindata
+            for _ in range(rng.randrange(1, 4)):
+                start = rng.randrange(len(mutated) + 1)
+                end = min(len(mutated), start + rng.randrange(4))
+                mutated = mutated[:start] + rng.choice(pieces) + mutated[end:]
+            self.assertTokenizersAgree(mutated)
+        self.assertTokenizersAgree(lindata[:-30])
+        self.assertTokenizersAgree(lindata + "nt||")
+
+    def test_tokenize_buffer(self):
+        lindata = """pn|a,b,c,d|pg||
+                qx|o1|md|3SK97,SAQJ5|sv|e|mb|1D!|an|better minor|pg||
+                nt|wait | for it|pg||
+                pc|cJ|pc|c7|pg||
+                """
+        tokens, err = self.lin.tokenize_buffer(lindata.encode())
+        self.assertEqual(err, None)
+        self.assertEqual(tokens, self.lin.tokenize(Reader(lindata))[0])
+        self.assertEqual(tokens[8], lin.Token("nt", "wait | for it"))
+
+        with tempfile.TemporaryFile() as f:
+            f.write(lindata.encode())
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                self.assertEqual(self.lin.tokenize_buffer(buffer),
+                        (tokens, None))
+
+        cursor = lin.Cursor(b"  mb|1D|pc|cJ|pg||\n")
+        self.assertEqual(list(cursor),
+                [(b"mb", 5, 7), (b"pc", 11, 13), (b"pg", 17, 17)])
+        self.assertEqual(cursor.argument(5, 7), "1D")
+        self.assertEqual(cursor.error, None)
+        cursor = lin.Cursor(b"mb|1D|pcx|cJ|")
+        self.assertEqual(list(cursor), [(b"mb", 3, 5)])
+        self.assertEqual(cursor.error, "Expected 2 letters in lin command")
+        self.assertEqual(cursor.pos, 6)
+        for bad in ["mb|1D|p", "mb|1D", "nt|no end|", "mb|p|nt|||pg"]:
+            self.assertEqual(self.lin.tokenize_buffer(bad.encode()),
+                    self.lin.tokenize(Reader(bad)))
+            self.assertNotEqual(self.lin.tokenize_buffer(bad.encode())[1],
+                    None)
+
 
     def test_commentary(self):
         lindata = """
@@ -1,5 +1,6 @@
 """Lin file manipulations.""" 
 import collections
+import re
 import sys
 import logging
 import pdb
@@ -7,6 +8,140 @@ import pdb
 
 Token = collections.namedtuple("Token", ["command", "argument"])
 
+_whitespace = re.compile(rb"\s*")
+_bar = ord("|")
+# A qx command, at the start of the file or after a "|" or whitespace.
+_deal_start_bytes = re.compile(rb"(?<![^|\s])qx\|")
+
+
+def _by_letter(names):
+    table = {}
+    for name in names:
+        table[name[0].lower()] = name
+        table[name[0].upper()] = name
+    return table
+
+
+_suits = _by_letter(["Spade", "Heart", "Diamond", "Club"])
+_ranks = {"2": "Two", "3": "Three", "4": "Four", "5": "Five",
+        "6": "Six", "7": "Seven", "8": "Eight", "9": "Nine",
+        "T": "Ten", "10": "Ten", "J": "Jack", "Q": "Queen", "K": "King",
+        "A": "Ace"}
+_strains = _by_letter(["notrump", "Spades", "Hearts", "Diamonds", "Clubs"])
+
+# mb and pc arguments to action ids, as numbered by games with
+# execute_action_ids: bids 5 * level + strain, then pass, double and
+# redouble, then cards 38 + 13 * suit + rank, with strains, suits and ranks
+# in the orders below. mb arguments are looked up in _call_ids first, then
+# by their first two characters in _bid_ids.
+_strain_order = ["Clubs", "Diamonds", "Hearts", "Spades", "notrump"]
+_suit_order = ["Club", "Diamond", "Heart", "Spade"]
+_rank_order = ["Two", "Three", "Four", "Five", "Six", "Seven", "Eight",
+        "Nine", "Ten", "Jack", "Queen", "King", "Ace"]
+_call_ids = {"p": 35, "P": 35, "p!": 35, "-": 35,
+        "d": 36, "D": 36, "d!": 36,
+        "r": 37, "R": 37, "r!": 37}
+_bid_ids = {str(level) + letter: 5 * (level - 1) + _strain_order.index(name)
+        for level in range(1, 8) for letter, name in _strains.items()}
+_card_ids = {letter + rank: 38 + 13 * _suit_order.index(suit)
+        + _rank_order.index(rank_name)
+        for letter, suit in _suits.items()
+        for rank, rank_name in _ranks.items()}
+
+
+class Cursor(object):
+    """A single forward pass over the tokens of a bytes or mmap buffer.
+
+    Iterating yields (command, start, end) for each token, where command is
+    the two byte command and buffer[start:end] its undecoded argument. It
+    stops at the end of the buffer, or at a malformed token, with error set
+    and pos left at the start of that token. Every byte is looked at a
+    constant number of times, however long the lines.
+
+    A file can also be fed in as it is read: until final is set, buffer is
+    a bytearray that append extends, and a token running on to its end
+    stops the iteration without an error, to resume after the next append
+    where its search stopped.
+    """
+    def __init__(self, buffer, pos=0, encoding="utf-8", final=True):
+        self.buffer = buffer
+        self.pos = pos
+        self.encoding = encoding
+        self.final = final
+        self.error = None
+        # Where the search for the end of the token at pos resumes.
+        self._searched = 0
+        # Bytes skipped by skip_to_deal before pos, while it is not done.
+        self._skipped = 0
+
+    def __iter__(self):
+        buffer, pos, size = self.buffer, self.pos, len(self.buffer)
+        while True:
+            pos = _whitespace.match(buffer, pos).end()
+            self.pos = pos
+            if pos == size:
+                return
+            if size - pos < 3:
+                if self.final:
+                    self.error = "partial line"
+                return
+            if (buffer[pos + 2] != _bar or buffer[pos] > 127
+                    or buffer[pos + 1] > 127):
+                self.error = "Expected 2 letters in lin command"
+                return
+            command = bytes(buffer[pos:pos + 2])
+            if command == b'nt':
+                end = buffer.find(b'|pg||', max(pos, self._searched - 4))
+                if end == -1:
+                    if not self.final:
+                        self._searched = size
+                    elif buffer[pos:].strip() == b'nt||':
+                        self.pos = size
+                    else:
+                        self.error = "Malformed lin commentary payload"
+                    return
+            else:
+                end = buffer.find(b'|', max(pos + 3, self._searched))
+                if end == -1:
+                    if not self.final:
+                        self._searched = size
+                    else:
+                        self.error = "Malformed lin payload"
+                    return
+            self._searched = 0
+            yield command, pos + 3, end
+            pos = end + 1
+
+    def argument(self, start, end):
+        """Returns the decoded argument at buffer[start:end]."""
+        return self.buffer[start:end].decode(self.encoding, "replace")
+
+    def append(self, data):
+        """Appends data to the buffer, dropping the bytes before pos."""
+        del self.buffer[:self.pos]
+        self._searched = max(0, self._searched - self.pos)
+        self.pos = 0
+        self.buffer += data
+
+    def skip_to_deal(self):
+        """Clears error and moves pos to the next qx command after it, or to
+        the end of the buffer. Returns the number of bytes skipped.
+
+        Until final is set, returns None if there is no qx command yet, and
+        is to be called again after the next append.
+        """
+        match = _deal_start_bytes.search(self.buffer, self.pos + 1)
+        if match is None and not self.final:
+            # Keeps the last byte searched, for the lookbehind of qx.
+            end = max(self.pos, len(self.buffer) - 3)
+            self._skipped += end - self.pos
+            self.pos = end
+            return None
+        end = match.start() if match else len(self.buffer)
+        skipped = self._skipped + end - self.pos
+        self.pos, self.error, self._skipped, self._searched = end, None, 0, 0
+        return skipped
+
 
 class Board(object):
     """Represents a board of cards, played at one or more tables."""
@@ -19,41 +154,85 @@ class Parser(object):
     """.lin file parser."""
     def parse(self, reader, game):
         """Returns dict of Boards containing game.Deal objects."""
-        # TODO(njt): skip line after error; continue with file.
         all_boards = {}
         error_counts = {}
-        lin_tokens, err = self.tokenize(reader)
-        if err:
-            logging.info("Failed to tokenize %s: %s", reader.name, err)
-            return {}, {}
-        header, lin_tokens, err = self.parse_header(lin_tokens)
-        if err:
-            logging.info("Failed to parse header of %s: %s", reader.name, err)
-            return {}, {}
-        while lin_tokens:
-            next_tokens = None
-            for i, t in enumerate(lin_tokens):
-                if i > 0 and t.command == 'qx':
-                    lin_tokens, next_tokens = lin_tokens[:i], lin_tokens[i:]
-                    break
-            deal, err = self.parse_deal(header, lin_tokens, game)
-            lin_tokens = next_tokens
-            if err:
-                logging.debug("Failed to parse deal in %s: %s", reader.name, err)
-                s = str(err)
-                if s not in error_counts:
-                    error_counts[s] = 1
-                else:
-                    error_counts[s] += 1
-            elif deal.error:
-                logging.info("Failed to replay deal %s%s in %s: %s",
-                        deal.table_name, deal.board_name, reader.name, deal.error)
-            else:
-                if deal.board_name not in all_boards:
-                    all_boards[deal.board_name] = Board(deal.board_name)
-                all_boards[deal.board_name].tables[deal.table_name] = deal
+        for board_name, table_name, deal in self.iter_deals(
+                reader, game, error_counts):
+            if board_name not in all_boards:
+                all_boards[board_name] = Board(board_name)
+            all_boards[board_name].tables[table_name] = deal
         return all_boards, error_counts
 
+    def iter_deals(self, reader, game, error_counts=None, skipped_bytes=None):
+        """Yields (board_name, table_name, deal) for each deal in reader.
+
+        Reads reader one "pg||" line at a time, and keeps only the tokens of
+        the deal being read, so memory does not grow with the file. Deals
+        that fail to parse are counted by error in error_counts, and deals
+        that fail to replay are logged; neither is yielded.
+
+        A tokenize error drops the deal being read and resumes at the next
+        qx command. It is counted in error_counts too, and the bytes passed
+        over, as UTF-8, are added up by error in skipped_bytes. A header error
+        ends the iteration.
+        """
+        return self._iter_deals(reader.name, self._tokenize_lines(reader),
+                game, error_counts, skipped_bytes)
+
+    def iter_buffer_deals(self, buffer, game, error_counts=None,
+            skipped_bytes=None, name="buffer"):
+        """As iter_deals, for a bytes or mmap buffer of a whole file."""
+        return self._iter_deals(name, self._tokenize_buffer(buffer), game,
+                error_counts, skipped_bytes)
+
+    def _iter_deals(self, name, lines, game, error_counts, skipped_bytes):
+        if error_counts is None:
+            error_counts = {}
+        if skipped_bytes is None:
+            skipped_bytes = {}
+        header = None
+        lin_tokens = []
+        for line_tokens, err, skipped in lines:
+            if err:
+                logging.info("Skipped %d bytes of %s after tokenize error: %s",
+                        skipped, name, err)
+                _add_count(error_counts, err)
+                _add_count(skipped_bytes, err, skipped)
+                if header is not None:
+                    lin_tokens = []
+                continue
+            for token in line_tokens:
+                if token.command == 'qx':
+                    if header is None:
+                        header, _, err = self.parse_header(lin_tokens)
+                        if err:
+                            logging.info("Failed to parse header of %s: %s",
+                                    name, err)
+                            return
+                    elif lin_tokens:
+                        yield from self._finish_deal(name, header,
+                                lin_tokens, game, error_counts)
+                    lin_tokens = []
+                lin_tokens.append(token)
+        if header is None:
+            _, _, err = self.parse_header(lin_tokens)
+            if err:
+                logging.info("Failed to parse header of %s: %s", name, err)
+        elif lin_tokens:
+            yield from self._finish_deal(name, header, lin_tokens, game,
+                    error_counts)
+
+    def _finish_deal(self, name, header, lin_tokens, game, error_counts):
+        deal, err = self.parse_deal(header, lin_tokens, game)
+        if err:
+            logging.debug("Failed to parse deal in %s: %s", name, err)
+            _add_count(error_counts, str(err))
+        elif deal.error:
+            logging.info("Failed to replay deal %s%s in %s: %s",
+                    deal.table_name, deal.board_name, name, deal.error)
+        else:
+            yield deal.board_name, deal.table_name, deal
+
     def parse_single(self, reader, game):
         lin_tokens, err = self.tokenize(reader)
         if err:
@@ -115,24 +294,27 @@ class Parser(object):
         return (level, strain, player, double, outcome), None 
 
     def parse_deal(self, header, lin_tokens, game):
-        suits, suit_names = {}, ["Spade", "Heart", "Diamond", "Club"]
-        ranks = {"2": "Two", "3": "Three", "4": "Four", "5": "Five",
-                "6": "Six", "7": "Seven", "8": "Eight", "9": "Nine",
-                "T": "Ten", "10": "Ten", "J": "Jack", "Q": "Queen", "K": "King",
-                "A": "Ace"}
-        strains, strain_names = {}, ["notrump", "Spades", "Hearts", "Diamonds", "Clubs"]
-        for v in strain_names:
-            strains[v[0].lower()] = v
-            strains[v[0].upper()] = v
-        for v in suit_names:
-            suits[v[0].lower()] = v
-            suits[v[0].upper()] = v
+        """Returns (deal, err).
+
+        With a game that has execute_action_ids, runs of bids and plays are
+        looked up in _call_ids, _bid_ids and _card_ids and executed by one
+        call each, rather than one make_call, make_bid or play_card each.
+        A run ends at any command other than pg, so there is one call per
+        deal unless it has annotations. Errors are those of executing the
+        tokens one by one: the run before a bid or play missing from the
+        tables is executed first, so an earlier illegal action is reported
+        ahead of "invalid bid" or "invalid play".
+        """
+        execute_ids = hasattr(game, 'execute_action_ids')
+        action_ids = []
+        # Whether a skipped pg token follows the last action of the run.
+        followed = False
 
         deal = game.Deal()
         deal_token = lin_tokens[0]
         if deal_token.command != 'qx':
             return None, "Expected qx token"
-        deal.table_name, deal.board_name = deal_token.argument[0], deal_token.argument[1:]
+        deal.table_name, deal.board_name = deal_token.argument[:1], deal_token.argument[1:]
 
         if 'pn' not in header:
             return None, "Player names not found"
@@ -174,6 +356,23 @@ class Parser(object):
         else:
             deal.scoring = "IMPs"
         for pos, token in enumerate(lin_tokens[1:]):
+            if execute_ids and token.command in ('mb', 'pc'):
+                if token.command == 'mb':
+                    action_id = _call_ids.get(token.argument)
+                    if action_id is None:
+                        action_id = _bid_ids.get(token.argument[:2])
+                else:
+                    action_id = _card_ids.get(token.argument)
+                if action_id is not None:
+                    action_ids.append(action_id)
+                    followed = False
+                    continue
+            elif action_ids and token.command == 'pg':
+                followed = True
+                continue
+            if action_ids:
+                deal = game.execute_action_ids(deal, action_ids)
+                action_ids = []
             if not deal:
                 logging.error("Internal error {}[{}]".format(lin_tokens, pos))
                 return None, "internal error"
@@ -192,10 +391,10 @@ class Parser(object):
                         continue
                     suit = None
                     for card in cards[i]:
-                        if card in suits:
-                            suit = suits[card]
-                        elif card in ranks:
-                            rank = ranks[card]
+                        if card in _suits:
+                            suit = _suits[card]
+                        elif card in _ranks:
+                            rank = _ranks[card]
                             if not suit:
                                 return None, "missing suit in hand specification"
                             if hasattr(game, 'give_cards'):
@@ -217,53 +416,112 @@ class Parser(object):
                     if len(token.argument) < 2:
                         return None, "invalid bid"
                     num, strain = token.argument[0], token.argument[1]
-                    if num not in [str(n) for n in range(1,8)] or strain not in strains:
+                    if num not in [str(n) for n in range(1,8)] or strain not in _strains:
                         return None, "invalid bid"
-                    deal = game.make_bid(deal, num, strains[strain])
+                    deal = game.make_bid(deal, num, _strains[strain])
             elif token.command == 'pc':
-                suit, rank = token.argument[0], token.argument[1:]
-                if suit not in suits or rank not in ranks:
+                suit, rank = token.argument[:1], token.argument[1:]
+                if suit not in _suits or rank not in _ranks:
                     return None, "invalid play"
-                deal = game.play_card(deal, suits[suit], ranks[rank])
+                deal = game.play_card(deal, _suits[suit], _ranks[rank])
             elif token.command == 'mc':
                 deal = game.accept_claim(deal, token.argument)
             elif token.command == 'an':
                 deal = game.add_explanation(deal, token.argument)
             elif token.command == 'nt':
                 deal = game.add_commentary(deal, token.argument)
+        if action_ids:
+            if deal.error:
+                return None, deal.error
+            n = deal.num_actions()
+            deal = game.execute_action_ids(deal, action_ids)
+            # As if executed one by one: an error before the last token
+            # fails the parse, while one at the last token is left in
+            # deal.error for the caller.
+            if deal.error and (followed
+                    or deal.num_actions() - n < len(action_ids) - 1):
+                return None, deal.error
         if not deal.result:
             return None, "no claim in deal"
         return deal, None
 
     def tokenize(self, reader):
         tokens = []
+        for line_tokens, err, _ in self._tokenize_lines(reader):
+            if err:
+                return None, err
+            tokens.extend(line_tokens)
+        return tokens, None
+
+    def tokenize_buffer(self, buffer):
+        """As tokenize, for a bytes or mmap buffer of a whole file.
+
+        Unlike tokenize, this neither decodes nor re-encodes the buffer.
+        """
+        tokens = []
+        for line_tokens, err, _ in self._tokenize_buffer(buffer):
+            if err:
+                return None, err
+            tokens.extend(line_tokens)
+        return tokens, None
+
+    def _tokenize_buffer(self, buffer):
+        """Yields (tokens, None, 0) for each "pg||" line of buffer.
+
+        On an error, yields (None, err, skipped) and resumes at the next qx
+        command, skipped being the number of bytes passed over.
+        """
+        cursor = Cursor(buffer)
         while True:
-            line = reader.readline()
-            if not line:
+            tokens = []
+            for command, start, end in cursor:
+                tokens.append(Token(command.decode(),
+                    cursor.argument(start, end)))
+                if command == b'pg':
+                    yield tokens, None, 0
+                    tokens = []
+            if tokens:
+                yield tokens, None, 0
+            if not cursor.error:
+                return
+            err = cursor.error
+            yield None, err, cursor.skip_to_deal()
+
+    def _tokenize_lines(self, reader):
+        """As _tokenize_buffer, for the UTF-8 encoding of reader's text, fed
+        to a Cursor one line at a time."""
+        cursor = Cursor(bytearray(), final=False)
+        tokens = []
+        err = None
+        while True:
+            if err is None:
+                for command, start, end in cursor:
+                    tokens.append(Token(command.decode(),
+                        cursor.argument(start, end)))
+                    if command == b'pg':
+                        yield tokens, None, 0
+                        tokens = []
+                if cursor.error:
+                    if tokens:
+                        yield tokens, None, 0
+                        tokens = []
+                    err = cursor.error
+            if err is not None:
+                skipped = cursor.skip_to_deal()
+                if skipped is not None:
+                    yield None, err, skipped
+                    err = None
+                    continue
+            if cursor.final:
                 break
-            while line.find("|pg||") == -1:
-                next_line = reader.readline()
-                if not next_line:
-                    break
-                line = line + next_line
-            line = line.strip()
-            while line:
-                if len(line) < 3:
-                    return None, "partial line"
-                if line[2] != '|':
-                    pos = line.find('|')
-                    return None, "Expected 2 letters in lin command"
-                if line[:2] == 'nt':
-                    end_pos = line.find('|pg||')
-                    if end_pos == -1:
-                        if line == "nt||":
-                            return tokens, None
-                        return None, "Malformed lin commentary payload"
-                else:
-                    end_pos = line[3:].find('|')
-                    if end_pos == -1:
-                        return None, "Malformed lin payload"
-                    end_pos = end_pos + 3
-                tokens.append(Token(line[:2], line[3:end_pos]))
-                line = line[end_pos + 1:].strip()
-        return tokens, None
+            line = reader.readline()
+            if line:
+                cursor.append(line.encode("utf-8", "surrogateescape"))
+            else:
+                cursor.final = True
+        if tokens:
+            yield tokens, None, 0
+
+
+def _add_count(counts, key, n=1):
+    counts[key] = counts.get(key, 0) + n
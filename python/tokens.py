@@ -1,7 +1,21 @@
 """Create tokens file for simple bridge language, designed for use with masked LM"""
+import numpy as np
+
 from bridgebot.bridge import game as bridgegame
 
 
+_seat_ids = bridgegame.seat_token_ids
+_verb_ids = bridgegame.action_verb_token_ids
+_action_ids = bridgegame.action_token_ids
+_card_ids = bridgegame.card_token_ids
+_double_ids = bridgegame.all_tokens.tokens_to_ids(
+        ["undoubled", "doubled", "redoubled"])
+(_pad_id, _deals_id, _declares_id, _passed_out_id, _takes_trick_id, _gets_id,
+        _sits_id, _vulnerable_id) = bridgegame.all_tokens.tokens_to_ids([
+        "[PAD]", "deals", "declares", "passed_out", "takes_trick", "gets",
+        "sits", "vulnerable"])
+
+
 class Tokenizer(object):
     """Tokenizer for formal bridge language."""
     def tokenize_score(self, score):
@@ -61,8 +75,186 @@ class Tokenizer(object):
             tokens.extend(self.tokenize_event(event))
         return tokens
 
+    def view_to_ids(self, view, rng):
+        """Returns tokens_to_ids(tokenize_view(view, rng)) for view, a
+        fastgame.wrapper deal, as an int32 array.
+
+        No token strings are made: seats, cards and actions map straight
+        to ids, and the contract and trick events are worked out from
+        view's history with numpy. rng shuffles each hand as
+        tokenize_view does.
+        """
+        return np.concatenate([_header_ids(view, rng),
+                _history_ids(view._history[:view.num_actions()])])
+
+    def views_to_ids(self, views, rng, length=None):
+        """Batch version of view_to_ids.
+
+        Returns (ids, lengths): ids is (N, length) int32, padded with the
+        [PAD] id, and cut at length if given, else as long as the longest
+        view. lengths are the (N,) lengths before padding or cutting.
+        """
+        rows = [self.view_to_ids(view, rng) for view in views]
+        lengths = np.array([len(row) for row in rows], dtype=np.int32)
+        if length is None:
+            length = lengths.max(initial=0)
+        ids = np.full((len(rows), length), _pad_id, dtype=np.int32)
+        for i, row in enumerate(rows):
+            row = row[:length]
+            ids[i, :len(row)] = row
+        return ids, lengths
+
     def tokens_to_ids(self, tokens):
         return [bridgegame.all_tokens.index[t] for t in tokens]
 
     def ids_to_tokens(self, ids):
         return [bridgegame.all_tokens.rindex[i] for i in ids]
+
+
+class TokenizerSession(object):
+    """The token ids of a fastgame.wrapper deal, as Tokenizer.view_to_ids,
+    kept up to date as actions are executed on the deal.
+
+    The header, up to the deal event, is kept until the deal's dealt cards
+    change, as when dummy is shown, and each update only adds the ids of
+    the new actions.
+    """
+    def __init__(self, deal, rng):
+        self.deal = deal
+        self.rng = rng
+        self._buffer = np.zeros(256, dtype=np.int32)
+        self._length = 0
+        self._header_length = 0
+        self._dealt_cards = None
+        self._history = np.zeros((0, 2), dtype=np.int8)
+        self._num_actions = 0
+
+    @property
+    def ids(self):
+        """The current ids, a view of the buffer valid until the next
+        update."""
+        return self._buffer[:self._length]
+
+    def update(self):
+        """Adds the ids of the actions executed since the last update, and
+        returns ids."""
+        deal = self.deal
+        n = deal.num_actions()
+        m = self._num_actions
+        if n < m or (deal._history[:m] != self._history[:m]).any():
+            self._length = self._header_length
+            self._num_actions = 0
+        if (self._dealt_cards is None or
+                (self._dealt_cards != deal.dealt_cards).any()):
+            self._dealt_cards = deal.dealt_cards.copy()
+            header = _header_ids(deal, self.rng)
+            events = self._buffer[self._header_length:self._length].copy()
+            self._length = 0
+            self._append(header)
+            self._append(events)
+            self._header_length = len(header)
+        self._append(_history_ids(deal._history[:n], self._num_actions))
+        self._history = deal._history[:n].copy()
+        self._num_actions = n
+        return self.ids
+
+    def _append(self, ids):
+        length = self._length + len(ids)
+        if length > len(self._buffer):
+            buffer = np.zeros(max(length, 2 * len(self._buffer)),
+                    dtype=np.int32)
+            buffer[:self._length] = self._buffer[:self._length]
+            self._buffer = buffer
+        self._buffer[self._length:length] = ids
+        self._length = length
+
+
+def _header_ids(view, rng):
+    """The token ids of tokenize_view up to and including the deal event."""
+    index = bridgegame.all_tokens.index
+    ids = []
+    for i, seat in enumerate(bridgegame._seats.tokens):
+        player = view.players[seat]
+        if player in index:
+            ids.extend([index[player], _sits_id, _seat_ids[i]])
+        else:
+            ids.extend([_seat_ids[i], _sits_id, _seat_ids[i]])
+    if view.vulnerability:
+        ids.append(_vulnerable_id)
+        ids.extend(index[seat] for seat in view.vulnerability)
+    if view.scoring in index:
+        ids.append(index[view.scoring])
+    dealt_cards = view.dealt_cards.reshape(4, 52)
+    for i in range(4):
+        cards = _card_ids[np.flatnonzero(dealt_cards[i])].tolist()
+        if cards:
+            rng.shuffle(cards)
+            ids.extend([_seat_ids[i], _gets_id])
+            ids.extend(cards)
+    ids.extend([_seat_ids[view._dealer_ix()], _deals_id])
+    return np.array(ids, dtype=np.int32)
+
+
+def _history_ids(history, start=0):
+    """The token ids of the events after the deal event, for the (n, 2)
+    (actor, action id) rows of a legal history.
+
+    Only the events of actions from start on are included, with the
+    contract and trick events of auctions and tricks they end. These are
+    worked out from the actions, as the rules do, rather than by stepping
+    a state.
+    """
+    n = len(history)
+    actors = history[:, 0].astype(int)
+    action_ids = history[:, 1].astype(int)
+    is_play = action_ids >= 38
+    events = np.empty((n, 2), dtype=np.int32)
+    events[start:, 0] = _verb_ids[actors[start:], is_play[start:] * 1]
+    events[start:, 1] = _action_ids[action_ids[start:]]
+    end = np.argmax(is_play) if is_play.any() else n
+    pieces = [events[start:end].ravel()]
+    contract = _contract_ids(actors[:end], action_ids[:end])
+    if contract is None:
+        return pieces[0]
+    if end > start:
+        pieces.append(contract)
+    if len(contract) == 1:
+        return np.concatenate(pieces)
+
+    # Each trick event follows its fourth card.
+    first = end + max(0, (start - end) // 4) * 4
+    num_tricks = (n - first) // 4
+    last = first + 4 * num_tricks
+    tricks = action_ids[first:last].reshape(-1, 4) - 38
+    suits = tricks // 13
+    strain = action_ids[np.flatnonzero(action_ids[:end] < 35)[-1]] % 5
+    strength = tricks % 13 + 13 * (suits == suits[:, :1]) + 26 * (
+            suits == strain)
+    winners = actors[first:last].reshape(-1, 4)[
+            np.arange(num_tricks), np.argmax(strength, axis=1)]
+    trick_events = np.empty((num_tricks, 10), dtype=np.int32)
+    trick_events[:, :8] = events[first:last].reshape(-1, 8)
+    trick_events[:, 8] = _seat_ids[winners]
+    trick_events[:, 9] = _takes_trick_id
+    trick_events = trick_events.ravel()
+    pieces.append(trick_events[2 * max(0, start - first):])
+    pieces.append(events[max(start, last):].ravel())
+    return np.concatenate(pieces)
+
+
+def _contract_ids(actors, auction):
+    """The token ids of the contract or passed out event ending an auction
+    of action ids, or None if it has not ended."""
+    bids = np.flatnonzero(auction < 35)
+    passes = 3 if len(bids) else 4
+    if len(auction) < passes or (auction[len(auction) - passes:] != 35).any():
+        return None
+    if not len(bids):
+        return np.array([_passed_out_id], dtype=np.int32)
+    bid = auction[bids[-1]]
+    side = actors[bids[-1]] % 2
+    doubles = auction[bids[-1]:]
+    double = 2 if (doubles == 37).any() else int((doubles == 36).any())
+    mentions = bids[(auction[bids] % 5 == bid % 5) & (actors[bids] % 2 == side)]
+    return np.array([_seat_ids[actors[mentions[0]]], _declares_id,
+            _action_ids[bid], _double_ids[double]], dtype=np.int32)